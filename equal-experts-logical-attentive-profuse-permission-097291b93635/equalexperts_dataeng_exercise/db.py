@@ -1,5 +1,16 @@
+import atexit
+import collections
+import contextlib
+import json
 import logging
+import os
+import re
 import sys
+import tempfile
+import threading
+import time
+import weakref
+
 import duckdb
 
 logger = logging.getLogger()
@@ -11,6 +22,47 @@ if not logger.hasHandlers():
     handler.setLevel(logging.INFO)
 logger.setLevel(logging.INFO)
 
+DATABASE_SETTINGS = {}  # Database path -> DuckDB settings applied on every connect
+CONNECTION_POOL = {}  # Real path of the database -> long-lived connection the pooled cursors come from
+POOL_LOCK = threading.Lock()
+QUERY_LOG_LENGTH = 10000  # Statements kept in QUERY_LOG, the oldest are dropped first
+QUERY_LOG = collections.deque(maxlen=QUERY_LOG_LENGTH)  # Metrics of the latest instrumented statements
+QUERY_LOG_LOCK = threading.Lock()
+INSTRUMENTATION = {"enabled": False, "profile": False, "output": None}  # Set with configure_instrumentation
+DML_STATEMENT = re.compile(r"\s*(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)  # Statements whose result is a row count
+CATALOG_CACHE = weakref.WeakKeyDictionary()  # Cursor -> its catalog, inside a catalog_cache block
+
+# Schemas of the cursor's database, and the tables and views in each of them
+CATALOG_QUERY = """
+    SELECT schema_name, NULL AS table_name FROM duckdb_schemas() WHERE database_name = current_database()
+    UNION ALL
+    SELECT schema_name, table_name FROM duckdb_tables() WHERE database_name = current_database()
+    UNION ALL
+    SELECT schema_name, view_name FROM duckdb_views() WHERE database_name = current_database() AND NOT internal
+"""
+
+
+def configure_database(db_name, settings):
+    """
+    Registers DuckDB settings such as threads, memory_limit and temp_directory that
+    are applied to every connection opened to the database afterwards.
+    Parameters:
+    db_name (str): Path to the DuckDB database file
+    settings (dict): Setting name to value, None values are left at DuckDB's default
+    """
+    DATABASE_SETTINGS[db_name] = {name: value for name, value in settings.items() if value is not None}
+    with POOL_LOCK:
+        if pool_key(db_name) in CONNECTION_POOL:
+            apply_settings(CONNECTION_POOL[pool_key(db_name)], db_name)
+
+
+def apply_settings(connection, db_name):
+    """
+    Applies the settings registered with configure_database to a connection.
+    """
+    for name, value in DATABASE_SETTINGS.get(db_name, {}).items():
+        connection.execute(f"SET {name} = '{value}'")
+
 
 def connect_to_db(db_name):
     """
@@ -20,6 +72,7 @@ def connect_to_db(db_name):
     """
     try:
         connection = duckdb.connect(db_name)
+        apply_settings(connection, db_name)
         logging.info("Connected to DuckDB.")
         return connection
     except Exception as e:
@@ -27,6 +80,320 @@ def connect_to_db(db_name):
         raise
 
 
+def pool_key(db_name):
+    """
+    Returns the key of the database in CONNECTION_POOL, the real path of its file,
+    so a relative path names the same database whatever the working directory.
+    Parameters:
+    db_name (str): Path to the DuckDB database file
+    """
+    return os.path.realpath(db_name)
+
+
+def pooled_cursor(db_name):
+    """
+    Returns a cursor on the pool's long-lived connection to the database, which is
+    opened on first use. Every cursor has its own transaction and is safe to use
+    from its own thread, and closing it, directly, with close_connection or by
+    leaving a with block, leaves the shared connection open. This saves reloading
+    the catalog and taking the file lock again for every step of a run. The cursor
+    is an InstrumentedCursor while configure_instrumentation has it enabled.
+    Parameters:
+    db_name (str): Path to the DuckDB database file
+    """
+    key = pool_key(db_name)
+    with POOL_LOCK:
+        if key not in CONNECTION_POOL:
+            CONNECTION_POOL[key] = connect_to_db(db_name)
+        try:
+            cursor = CONNECTION_POOL[key].cursor()
+            if INSTRUMENTATION["enabled"]:
+                return InstrumentedCursor(cursor, INSTRUMENTATION["profile"], INSTRUMENTATION["output"])
+            return cursor
+        except Exception as e:
+            logging.error(f"Failed to open a cursor on the pooled DuckDB connection: {e}")
+            raise
+
+
+def close_pool(db_name=None):
+    """
+    Closes the pooled connection to the database, and with it every cursor still open on it.
+    The next pooled_cursor call opens a new one.
+    Parameters:
+    db_name (str): Path to the DuckDB database file, None closes the connections to every database
+    """
+    with POOL_LOCK:
+        for key in [pool_key(db_name)] if db_name is not None else list(CONNECTION_POOL):
+            close_connection(CONNECTION_POOL.pop(key, None))
+
+
+atexit.register(close_pool)
+
+
+def configure_instrumentation(enabled, profile=False, output=None):
+    """
+    Switches the instrumentation of the cursors handed out by pooled_cursor
+    afterwards. An instrumented cursor records the wall time and the rows
+    affected or fetched of every statement in QUERY_LOG. Disabled, pooled_cursor
+    hands out plain DuckDB cursors, so there is no overhead.
+    Parameters:
+    enabled (bool): Instrument the cursors handed out from now on
+    profile (bool): Also keep DuckDB's EXPLAIN ANALYZE profile of every statement, as JSON
+    output (str): Path of a JSON lines file every statement's metrics are appended to, None for none
+    """
+    INSTRUMENTATION.update(enabled=enabled, profile=profile, output=output)
+
+
+class InstrumentedCursor:
+    """
+    Wraps a DuckDB cursor to time its statements and count their rows. Every
+    statement run with execute, executemany or sql, and every register, adds a
+    dictionary to QUERY_LOG with the statement, the seconds spent executing it
+    and fetching its result, and the rows it inserted, updated or deleted, or the
+    rows fetched from it. A relation returned by sql only runs when it is read,
+    so it is wrapped in an InstrumentedRelation that adds the time spent reading
+    it to the statement's. With profiling on, DuckDB's profile of the statement
+    is added once its result has been read, when the next statement starts or the
+    cursor is closed, which is also when it is written to the output file.
+    Anything else goes straight to the DuckDB cursor.
+    """
+
+    def __init__(self, connection, profile=False, output=None):
+        self.connection = connection
+        self.profile = profile
+        self.output = output
+        self.record = None
+        self.pending_rows = None  # Row count result of a DML statement, read to record it
+        self.count_fetched = False  # Whether the rows fetched are the rows of the statement
+        self.profile_path = None
+        if profile:
+            handle, self.profile_path = tempfile.mkstemp(suffix=".json")
+            os.close(handle)
+            os.remove(self.profile_path)
+            connection.execute("PRAGMA enable_profiling = 'json'")
+            connection.execute(f"PRAGMA profiling_output = '{self.profile_path}'")
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def cursor(self):
+        return InstrumentedCursor(self.connection.cursor(), self.profile, self.output)
+
+    def execute(self, query, parameters=None):
+        self.finish()
+        record = {"statement": " ".join(query.split()), "seconds": 0.0, "rows": None}
+        tic = time.perf_counter()
+        try:
+            if parameters is None:
+                self.connection.execute(query)
+            else:
+                self.connection.execute(query, parameters)
+            if DML_STATEMENT.match(query):
+                self.pending_rows = self.connection.fetchall()
+                record["rows"] = self.pending_rows[0][0] if self.pending_rows else None
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["seconds"] += time.perf_counter() - tic
+            self.start(record, count_fetched=self.pending_rows is None)
+        return self
+
+    def executemany(self, query, parameters):
+        self.finish()
+        record = {"statement": " ".join(query.split()), "seconds": 0.0, "rows": len(parameters)}
+        tic = time.perf_counter()
+        try:
+            self.connection.executemany(query, parameters)
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["seconds"] += time.perf_counter() - tic
+            self.start(record)
+        return self
+
+    def sql(self, query):
+        self.finish()
+        record = {"statement": " ".join(query.split()), "seconds": 0.0, "rows": None}
+        tic = time.perf_counter()
+        try:
+            relation = self.connection.sql(query)
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["seconds"] += time.perf_counter() - tic
+            self.start(record)
+        return None if relation is None else InstrumentedRelation(relation, record)
+
+    def register(self, view_name, python_object):
+        self.finish()
+        record = {"statement": f"REGISTER {view_name}", "seconds": 0.0, "rows": None}
+        tic = time.perf_counter()
+        try:
+            self.connection.register(view_name, python_object)
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["seconds"] += time.perf_counter() - tic
+            self.start(record)
+        return self
+
+    def fetchone(self):
+        if self.pending_rows is not None:
+            return self.pending_rows.pop(0) if self.pending_rows else None
+        row = self.fetch("fetchone")
+        self.count_rows(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=1):
+        if self.pending_rows is not None:
+            rows, self.pending_rows = self.pending_rows[:size], self.pending_rows[size:]
+            return rows
+        rows = self.fetch("fetchmany", size)
+        self.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        if self.pending_rows is not None:
+            rows, self.pending_rows = self.pending_rows, []
+            return rows
+        rows = self.fetch("fetchall")
+        self.count_rows(len(rows))
+        return rows
+
+    def df(self):
+        frame = self.fetch("df")
+        self.count_rows(len(frame))
+        return frame
+
+    def arrow(self):
+        table = self.fetch("arrow")
+        self.count_rows(table.num_rows)
+        return table
+
+    fetchdf = df
+    fetch_arrow_table = arrow
+
+    def fetch(self, method, *args):
+        """
+        Reads the result through the DuckDB cursor, adding the time it takes to the statement's.
+        """
+        tic = time.perf_counter()
+        try:
+            return getattr(self.connection, method)(*args)
+        finally:
+            if self.record is not None:
+                self.record["seconds"] += time.perf_counter() - tic
+
+    def count_rows(self, rows):
+        if self.record is not None and self.count_fetched:
+            self.record["rows"] = (self.record["rows"] or 0) + rows
+
+    def start(self, record, count_fetched=False):
+        self.record, self.count_fetched = record, count_fetched
+        with QUERY_LOG_LOCK:
+            QUERY_LOG.append(record)
+
+    def finish(self):
+        """
+        Completes the record of the previous statement with its profile and writes it to the output.
+        """
+        record, self.record, self.pending_rows = self.record, None, None
+        if record is None:
+            return
+        if self.profile_path and "error" not in record:
+            # DuckDB only writes the profile once the whole result is read, executemany leaves none
+            with contextlib.suppress(duckdb.InvalidInputException):
+                self.connection.fetchall()
+        if self.profile_path and os.path.exists(self.profile_path):
+            with open(self.profile_path) as profile:
+                record["profile"] = json.loads(profile.read(), strict=False)
+            os.remove(self.profile_path)
+        if self.output:
+            with QUERY_LOG_LOCK:
+                with open(self.output, "a") as output:
+                    output.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        self.finish()
+        self.connection.close()
+        if self.profile_path and os.path.exists(self.profile_path):
+            os.remove(self.profile_path)
+
+
+class InstrumentedRelation:
+    """
+    Wraps the DuckDB relation of a statement run with InstrumentedCursor.sql. The
+    relation only runs when its result is read, so the time spent reading it, and
+    the rows read, are added to the statement's record in QUERY_LOG. Anything
+    else goes straight to the DuckDB relation.
+    """
+
+    def __init__(self, relation, record):
+        self.relation = relation
+        self.record = record
+
+    def __getattr__(self, name):
+        return getattr(self.relation, name)
+
+    def read(self, method, *args):
+        """
+        Reads the result through the DuckDB relation, adding the time it takes to the statement's.
+        """
+        tic = time.perf_counter()
+        try:
+            return getattr(self.relation, method)(*args)
+        finally:
+            self.record["seconds"] += time.perf_counter() - tic
+
+    def count_rows(self, rows):
+        self.record["rows"] = (self.record["rows"] or 0) + rows
+
+    def fetchone(self):
+        row = self.read("fetchone")
+        self.count_rows(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self.read("fetchmany", size)
+        self.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.read("fetchall")
+        self.count_rows(len(rows))
+        return rows
+
+    def df(self):
+        frame = self.read("df")
+        self.count_rows(len(frame))
+        return frame
+
+    def arrow(self):
+        table = self.read("arrow")
+        self.count_rows(table.num_rows)
+        return table
+
+    def show(self, *args, **kwargs):
+        tic = time.perf_counter()
+        try:
+            self.relation.show(*args, **kwargs)
+        finally:
+            self.record["seconds"] += time.perf_counter() - tic
+
+    fetchdf = df
+    fetch_arrow_table = arrow
+
+
 def close_connection(connection):
     """
     Closes the DuckDB connection.
@@ -42,6 +409,71 @@ def close_connection(connection):
         raise
 
 
+def load_catalog(cursor):
+    """
+    Reads the schemas of the cursor's database and the tables and views in them.
+
+    :param cursor: duckdb connection object
+    :return: Dictionary of lower case schema name to the set of its lower case table and view names
+    """
+    catalog = {}
+    for schema_name, table_name in cursor.execute(CATALOG_QUERY).fetchall():
+        tables = catalog.setdefault(schema_name.lower(), set())
+        if table_name is not None:
+            tables.add(table_name.lower())
+    return catalog
+
+
+@contextlib.contextmanager
+def catalog_cache(cursor):
+    """
+    Answers table_exists and schema_exists for the cursor from one read of the
+    catalog until the block ends, instead of querying it for every check.
+    create_schema and create_table keep the cached catalog up to date. Any other
+    DDL issued through the cursor inside the block must be followed by
+    invalidate_catalog, as must a rollback. Nested blocks share the outer cache.
+
+    :param cursor: duckdb connection object
+    """
+    if cursor in CATALOG_CACHE:
+        yield
+        return
+    CATALOG_CACHE[cursor] = None
+    try:
+        yield
+    finally:
+        CATALOG_CACHE.pop(cursor, None)
+
+
+def cached_catalog(cursor):
+    """
+    Returns the cached catalog of the cursor, reading it first if it was invalidated.
+    """
+    if CATALOG_CACHE[cursor] is None:
+        CATALOG_CACHE[cursor] = load_catalog(cursor)
+    return CATALOG_CACHE[cursor]
+
+
+def invalidate_catalog(cursor):
+    """
+    Makes the next existence check of a cursor with a cached catalog read the catalog again.
+
+    :param cursor: duckdb connection object
+    """
+    if cursor in CATALOG_CACHE:
+        CATALOG_CACHE[cursor] = None
+
+
+def cache_created(cursor, schema_name, table_name=None):
+    """
+    Adds a schema, or a table of a schema, that was just created to the cursor's cached catalog.
+    """
+    if CATALOG_CACHE.get(cursor) is not None:
+        tables = CATALOG_CACHE[cursor].setdefault(schema_name.lower(), set())
+        if table_name is not None:
+            tables.add(table_name.lower())
+
+
 def create_schema(cursor, database_name, schema_name):
     """
     Creates a schema in duckdb database with specified name
@@ -49,6 +481,7 @@ def create_schema(cursor, database_name, schema_name):
     create_schema_query = f"CREATE SCHEMA IF NOT EXISTS {schema_name}"
     try:
         cursor.execute(create_schema_query)
+        cache_created(cursor, schema_name)
         logging.info(
             f"Created a schema named {schema_name} under the database named {database_name}.")
 
@@ -100,6 +533,7 @@ def create_table(cursor, db, schema_name, table_name, table_schema, primary_key)
                             """
         # Execute the SQL query
         cursor.execute(create_table_query)
+        cache_created(cursor, schema_name, table_name)
         logging.info(
             f"Table '{table_name}' in db {db} created successfully with schema: {table_schema} and primary key: {primary_key}")
 
@@ -112,7 +546,8 @@ def create_table(cursor, db, schema_name, table_name, table_schema, primary_key)
 
 def table_exists(cursor, schema_name, table_name):
     """
-    Checks if a table exists in the DuckDB database.
+    Checks if a table or view exists in the DuckDB database, from the cached
+    catalog inside a catalog_cache block.
 
     :param cursor: database connection object
     schema_name: schema_name under which table exists
@@ -120,12 +555,12 @@ def table_exists(cursor, schema_name, table_name):
     :return: True if the table exists, False otherwise
     """
     try:
-        check_table_exists_query = f"SELECT 1 FROM {schema_name}.{table_name} LIMIT 1"
-        cursor.execute(check_table_exists_query)
-        return True
-    except duckdb.CatalogException:
-        return False
-
+        if not schema_name or not table_name:
+            raise ValueError("The schema and table names must not be empty")
+        if cursor in CATALOG_CACHE:
+            return table_name.lower() in cached_catalog(cursor).get(schema_name.lower(), ())
+        query = f"SELECT 1 FROM ({CATALOG_QUERY}) WHERE lower(schema_name) = lower(?) AND lower(table_name) = lower(?)"
+        return cursor.execute(query, [schema_name, table_name]).fetchone() is not None
     except Exception as e:
         logging.error(
             f"Error checking if table '{schema_name}.{table_name}' exists: {e}")
@@ -134,7 +569,8 @@ def table_exists(cursor, schema_name, table_name):
 
 def schema_exists(cursor, schema_name):
     """
-    Checks if a schema exists in the DuckDB database.
+    Checks if a schema exists in the DuckDB database, from the cached catalog
+    inside a catalog_cache block.
 
     :param cursor: duckdb connection object
     schema_name: Name of the schema to check
@@ -142,8 +578,10 @@ def schema_exists(cursor, schema_name):
     """
     try:
         if (schema_name != ''):
-            query = f"SELECT schema_name FROM information_schema.schemata WHERE schema_name = '{schema_name}';"
-            result = cursor.execute(query).fetchone()
+            if cursor in CATALOG_CACHE:
+                return schema_name.lower() in cached_catalog(cursor)
+            query = f"SELECT 1 FROM ({CATALOG_QUERY}) WHERE lower(schema_name) = lower(?)"
+            result = cursor.execute(query, [schema_name]).fetchone()
             return result is not None
         else:
             raise Exception
@@ -151,3 +589,23 @@ def schema_exists(cursor, schema_name):
     except Exception as e:
         logging.error(f"Error checking if schema '{schema_name}' exists: {e}")
         raise
+
+
+def table_columns(cursor, schema_name, table_name):
+    """
+    Returns the columns of a table with their data types, in column order.
+
+    :param cursor: duckdb connection object
+    schema_name: schema_name under which table exists
+    table_name: Name of the table
+    :return: Dictionary of column name to data type
+    """
+    try:
+        query = """
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = ? AND table_name = ? ORDER BY ordinal_position
+        """
+        return dict(cursor.execute(query, [schema_name, table_name]).fetchall())
+    except Exception as e:
+        logging.error(f"Error reading the columns of table '{schema_name}.{table_name}': {e}")
+        raise
@@ -1,23 +1,129 @@
+import argparse
+import bz2
 import concurrent.futures
+import glob
+import gzip
+import hashlib
+import io
 import json
 import logging
+import os
+import re
 import sys
+import tarfile
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import PurePath
 
 import duckdb
 
-from equalexperts_dataeng_exercise import db
+from equalexperts_dataeng_exercise import db, outliers
+
+try:
+    import pyarrow
+except ImportError:  # Optional dependency, installed with the "arrow" extra
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, installed with the "zstd" extra
+    zstandard = None
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where peak memory isn't reported
+    resource = None
 
 DATABASE = "warehouse.db"  # Path to the DuckDB database file
 TABLE_NAME = "votes"  # Name of the table to be created
+STAGING_TABLE_NAME = "votes_staging"  # Incremental loads land here before being merged
+RUNS_TABLE_NAME = "ingestion_runs"  # One row per ingestion run, holds the watermark
+CHECKPOINTS_TABLE_NAME = "ingestion_checkpoints"  # Progress of resumable loads that haven't finished
+REJECTED_TABLE_NAME = "votes_rejected"  # Quarantine for lines that fail validation
 SCHEMA_NAME = "blog_analysis"
 PRIMARY_KEY = "Id"  # Column name to be set as the primary key or for checking duplicate records
 NUM_THREADS = 3  # Num of threads using which the multithreading operation will run
+BATCH_SIZE = 50000  # Max rows held in memory before a flush when streaming
+ENGINES = ("duckdb", "parallel", "python")  # duckdb scans the file natively, python is the fallback
+DEFAULT_ENGINE = "duckdb"
 SCHEMA = {
     "Id": "STRING",
     "PostId": "STRING",
     "VoteTypeId": "STRING",
     "CreationDate": "DATETIME"
 }  # Dictionary defining the schema
+TYPED_SCHEMA = {
+    "Id": "BIGINT",
+    "PostId": "BIGINT",
+    "VoteTypeId": "UTINYINT",
+    "CreationDate": "TIMESTAMP"
+}  # Compact storage schema, numeric ids compare and hash faster than strings
+RUNS_SCHEMA = {
+    "RunId": "INTEGER",
+    "Mode": "STRING",
+    "FileFingerprint": "STRING",
+    "MaxId": "BIGINT",
+    "MaxCreationDate": "DATETIME",
+    "RowsInserted": "BIGINT",
+    "IngestedAt": "DATETIME"
+}
+CHECKPOINTS_SCHEMA = {
+    "FileFingerprint": "STRING",
+    "TableName": "STRING",
+    "ByteOffset": "BIGINT",
+    "LinesRead": "BIGINT",
+    "LastId": "STRING",
+    "RowsCommitted": "BIGINT",
+    "UpdatedAt": "DATETIME"
+}
+LINE_COLUMNS = ("SourceFile", "LineNumber", "Error", "RawLine")  # Where each parsed row came from
+BATCH_COLUMNS = (*SCHEMA, *LINE_COLUMNS)  # Columns of a parsed batch, before validation
+VALIDATION_SCHEMA = TYPED_SCHEMA  # Every value must cast to these types, whatever the storage schema
+REJECTED_SCHEMA = {
+    "SourceFile": "STRING",
+    "LineNumber": "BIGINT",
+    "Reason": "STRING",
+    "Id": "STRING",
+    "PostId": "STRING",
+    "VoteTypeId": "STRING",
+    "CreationDate": "STRING",
+    "RawLine": "STRING",
+    "RejectedAt": "DATETIME"
+}
+CHUNK_SIZE_8_MIB = 8 * 1024 * 1024
+# Cores the process may run on, which taskset and cpuset limits of a container restrict
+CPU_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+PARSE_WORKERS = CPU_CORES  # Processes decoding JSON in the parallel engine
+PARSE_RANGE_BYTES = 64 * 1024 * 1024  # Upper bound on the bytes a parse worker holds at once
+SETTING_ENV_VARS = {
+    "threads": "INGEST_THREADS",
+    "batch_size": "INGEST_BATCH_SIZE",
+    "duckdb_threads": "INGEST_DUCKDB_THREADS",
+    "memory_limit": "INGEST_MEMORY_LIMIT",
+    "temp_directory": "INGEST_TEMP_DIRECTORY",
+    "auto_tune": "INGEST_AUTO_TUNE",
+}  # Environment variables read when the matching command-line option is not given
+AUTO_TUNE_MIN_BATCH_SIZE = 10000
+AUTO_TUNE_MAX_BATCH_SIZE = 250000
+AUTO_TUNE_MEMORY_FRACTION = 0.75  # Share of physical memory DuckDB may use in auto mode
+COMPRESSION_SUFFIXES = {".gz": ".gz", ".tgz": ".gz", ".bz2": ".bz2", ".zst": ".zst"}  # Decompressed while read
+NATIVE_COMPRESSION_SUFFIXES = (".gz", ".zst")  # Also decompressed by DuckDB's JSON reader
+TAR_MEMBER_SEPARATOR = "::"  # archive.tar.gz::votes.jsonl names one member of a tarball
+DEDUP_BITMAP_MAX_ID = 2 ** 30  # Ids below this can use one bit each (128 MiB at most), larger ones a set
+DEDUP_BITMAP_BYTES_PER_ID = 8  # The bitmap only grows while it takes at most this much per Id recorded
+DEDUP_BITMAP_MIN_BYTES = 1024 * 1024  # Budget of the bitmap however few Ids were recorded
+DEDUP_SET_WARNING_IDS = 10 ** 7  # Ids held in sets, at 65 to 90 bytes each, before warning to use the duckdb engine
+BIGINT_RANGE = (-2 ** 63, 2 ** 63 - 1)
+BIGINT_TEXT = re.compile(r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?")  # Decimal text DuckDB casts to BIGINT
+BIGINT_PREFIXED_TEXT = re.compile(r"0([xX][0-9a-fA-F]+|[bB][01]+)")  # Hexadecimal and binary text it casts too
+CAST_WHITESPACE = " \t\n\r\v\f"  # Trimmed by DuckDB before a cast
+FINGERPRINT_HEAD_BYTES = 1024 * 1024  # Bytes at the start of a file hashed into its fingerprint
+SHARD_PATTERN = "*.jsonl*"  # Files picked up when the input is a directory
+GLOB_CHARACTERS = "*?["
+STAGE_REPORT = []  # Metrics of the pipeline stages run since the last reset, in the order they started
+STAGE_PATH = []  # Names of the stages running now, outermost first
 
 logger = logging.getLogger()
 if not logger.hasHandlers():
@@ -29,45 +135,388 @@ if not logger.hasHandlers():
 logger.setLevel(logging.INFO)
 
 
-def fetch_data():
+def expand_input_paths(file_path):
+    """
+    Expand a directory or glob pattern into the shard files it names. Shards are
+    sorted by name, so hourly shards are read oldest first and the first entry per
+    primary key wins in time order.
+
+    :param file_path: Path to a file, a directory of shards or a glob pattern
+    :return: List of file paths
+    """
+    path = str(file_path)
+    if os.path.isdir(path):
+        paths = sorted(glob.glob(os.path.join(glob.escape(path), SHARD_PATTERN)))
+    elif any(char in path for char in GLOB_CHARACTERS) and not os.path.exists(path):
+        paths = sorted(glob.glob(path))
+    else:
+        return [path]
+    if not paths:
+        raise FileNotFoundError(f"No input files match {path}")
+    return paths
+
+
+def split_input_path(file_path):
+    """
+    Split an input path into the file on disk and, for tarballs, the member to read.
+
+    :param file_path: Path to a JSON lines file, or to a tarball optionally followed by ::member
+    :return: Tuple of the path on disk and the member name, None when no member is named
+    """
+    path = str(file_path)
+    if TAR_MEMBER_SEPARATOR in path:
+        archive, member = path.rsplit(TAR_MEMBER_SEPARATOR, 1)
+        if is_tar_archive(archive):
+            return archive, member
+    return path, None
+
+
+def is_tar_archive(path):
+    suffixes = PurePath(path).suffixes
+    return ".tar" in suffixes or suffixes[-1:] == [".tgz"]
+
+
+def compression_of(path):
+    """
+    Return the compression suffix of a path, None for an uncompressed file.
+    """
+    return COMPRESSION_SUFFIXES.get(PurePath(path).suffix)
+
+
+def readable_by_duckdb(file_path):
+    """
+    DuckDB's JSON reader decompresses gzip and zstd files itself but can't read
+    bzip2 files or tarball members.
     """
-    Fetch data from a JSON file specified in the command-line arguments.
+    for path in expand_input_paths(file_path):
+        path, _ = split_input_path(path)
+        if is_tar_archive(path) or compression_of(path) not in (None, *NATIVE_COMPRESSION_SUFFIXES):
+            return False
+    return True
+
+
+class StreamedTarMember(io.RawIOBase):
+    """
+    Forward-only reader over a member of a tarball opened in stream mode. The file
+    object tarfile returns for such members fails on seekable(), which
+    TextIOWrapper calls.
+    """
+
+    def __init__(self, member_file):
+        self.member_file = member_file
 
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.member_file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def find_tar_member(archive, member, archive_path):
+    """
+    Advance a streamed tarball to the named member, or to its first .jsonl file
+    when no member is named.
+
+    :return: Binary file object reading the member
+    """
+    for entry in archive:
+        if not entry.isfile():
+            continue
+        if member is None and entry.name.endswith(".jsonl") or member in (entry.name, os.path.basename(entry.name)):
+            return io.BufferedReader(StreamedTarMember(archive.extractfile(entry)))
+    raise FileNotFoundError(f"No {member or '.jsonl'} member found in {archive_path}")
+
+
+@contextmanager
+def decompressing_reader(raw, path, member=None):
+    """
+    Wrap a binary file object so it reads decompressed bytes, and for tarballs the
+    bytes of one member. Everything is streamed, nothing is written to disk.
+
+    :param raw: Binary file object of the file on disk
+    :param path: Path of the file on disk, its suffixes select the decompression
+    :param member: Tarball member to read, defaults to the first .jsonl file
+    :return: Context manager yielding a binary file object
+    """
+    compression = compression_of(path)
+    if compression == ".gz":
+        stream = gzip.GzipFile(fileobj=raw)
+    elif compression == ".bz2":
+        stream = bz2.BZ2File(raw)
+    elif compression == ".zst":
+        if zstandard is None:
+            raise ImportError(f"Reading {path} needs the zstandard package, install the 'zstd' extra.")
+        stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=False))
+    else:
+        stream = raw
+    with stream:
+        if is_tar_archive(path):
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                yield find_tar_member(archive, member, path)
+        else:
+            yield stream
+
+
+@contextmanager
+def open_input(file_path, text=True):
+    """
+    Open an input file for reading. Files ending in .gz, .bz2 or .zst are
+    decompressed as they are read, and a tarball member is read straight out of the
+    archive, e.g. votes.tar.gz::votes.jsonl.
+
+    :param file_path: Path to a JSON lines file, or to a tarball optionally followed by ::member
+    :param text: Yield a text stream instead of a binary one
+    :return: Context manager yielding a file object
+    """
+    path, member = split_input_path(file_path)
+    with open(path, "rb") as raw, decompressing_reader(raw, path, member) as stream:
+        yield io.TextIOWrapper(stream, encoding="utf-8") if text else stream
+
+
+def fetch_data(file_path=None, with_line_info=False):
+    """
+    Fetch data from a JSON file specified in the command-line arguments. A directory
+    or glob pattern reads every shard it names, one after the other. A line that
+    can't be decoded is logged and skipped, the rest of the file is still read.
+    Errors that aren't about a single line, like a missing or unreadable file, are
+    logged and raised.
+
+    :param file_path: Path to the JSON file, defaults to the first command-line argument
+    :param with_line_info: Add the LINE_COLUMNS to every entry and keep undecodable
+                           lines as entries with an Error, for the validation stage
     :return: List of data entries
     """
     data = []
     try:
-        with open(sys.argv[1]) as file:
-            for line in file:
-                data.append(json.loads(line))
+        for path in expand_input_paths(file_path or sys.argv[1]):
+            with open_input(path, text=False) as file:
+                for line_number, line in enumerate(file, start=1):
+                    if not line.strip():
+                        continue
+                    entry, error = parse_line(line)
+                    if error:
+                        logging.error(f"Failed to decode line {line_number} of {path}. Error: {error}")
+                        if not with_line_info:
+                            continue
+                    if with_line_info:
+                        entry.update(SourceFile=path, LineNumber=line_number, Error=error,
+                                     RawLine=raw_line_text(line) if error else None)
+                    data.append(entry)
         logging.info(f"Fetched {len(data)} entries from the file.")
     except FileNotFoundError as e:
         logging.error(
             f"File not found. Please download the dataset using 'poetry run exercise fetch-data'. Error: {e}")
-    except json.JSONDecodeError as e:
-        logging.error(f"Failed to decode JSON. Error: {e}")
+        raise
     except Exception as e:
         logging.error(f"An unexpected error occurred while fetching data. Error: {e}")
+        raise
 
     return data
 
 
-def filtered_and_formatted_data(fetched_data):
+def parse_line(line):
+    """
+    Decode one JSON line. A line that isn't UTF-8 or isn't a JSON object comes back
+    as an empty entry with the reason, so it can be quarantined instead of stopping
+    the load.
+
+    :param line: Text or bytes of the line
+    :return: Tuple of the entry dictionary and an error message, None when valid
+    """
+    if isinstance(line, bytes):
+        try:
+            line = line.decode("utf-8")
+        except UnicodeDecodeError as e:
+            return {}, f"invalid UTF-8: {e}"
+    try:
+        entry = json.loads(line)
+    except ValueError as e:
+        return {}, f"invalid JSON: {e}"
+    if not isinstance(entry, dict):
+        return {}, "not a JSON object"
+    return entry, None
+
+
+def raw_line_text(line):
+    """
+    Text of a line that failed to parse, as kept in the quarantine table. Bytes
+    that aren't UTF-8 are replaced, so the rest of the line can still be read.
+    """
+    return line.decode("utf-8", "replace").rstrip("\r\n")
+
+
+def collect_line(batch, seen, line, source_file, line_number):
+    """
+    Parse a line into a column batch of BATCH_COLUMNS. Blank lines and keys that
+    were already seen are skipped. Lines that can't be parsed are kept with their
+    error and text, types are checked later on the whole batch.
+
+    :param batch: Dictionary of column name to list of values
+    :param seen: SeenIds of the keys collected so far
+    :param line: Bytes of the line
+    :param source_file: Path of the file the line came from
+    :param line_number: Number of the line in its file, from 1
+    """
+    if not line.strip():
+        return
+    entry, error = parse_line(line)
+    if error is None and not seen.add_new(entry.get(PRIMARY_KEY)):
+        return
+    for col in SCHEMA:
+        batch[col].append(entry.get(col))
+    batch["SourceFile"].append(source_file)
+    batch["LineNumber"].append(line_number)
+    batch["Error"].append(error)
+    batch["RawLine"].append(raw_line_text(line) if error else None)
+
+
+def bigint_key(key):
+    """
+    Cast a primary key to BIGINT the way DuckDB's TRY_CAST does once the row is
+    stored in the typed table: surrounding whitespace is ignored, leading zeros,
+    signs, decimals and exponents are accepted and rounded half away from zero,
+    so "007", "7" and 7.0 are all Id 7. Values that aren't text are cast from
+    their JSON text, as they are inserted.
+
+    :param key: Primary key as read from the file
+    :return: Integer Id, or None when the cast fails
+    """
+    text = (key if isinstance(key, str) else as_text(key)).strip(CAST_WHITESPACE)
+    if BIGINT_PREFIXED_TEXT.fullmatch(text):
+        number = int(text, 0)
+    elif BIGINT_TEXT.fullmatch(text):
+        value = Decimal(text)
+        if abs(value) > BIGINT_RANGE[1] + 1:
+            return None
+        number = int(value.to_integral_value(ROUND_HALF_UP))
+    else:
+        return None
+    return number if BIGINT_RANGE[0] <= number <= BIGINT_RANGE[1] else None
+
+
+class SeenIds:
+    """
+    Set of the primary keys seen so far, used to keep the first entry per key.
+    Integer Ids are tracked in a bitmap with one bit per possible Id. A set of
+    strings costs around 100 bytes per Id, so for dense Ids the bitmap is two to
+    three orders of magnitude smaller. The bitmap grows with the largest Id seen,
+    but only while it stays within DEDUP_BITMAP_BYTES_PER_ID bytes per Id recorded,
+    so a few huge Ids can't allocate a huge bitmap. Ids beyond it are kept in a set
+    of integers and moved into the bitmap once it grows over them. Ids that aren't
+    canonical non-negative integers go to a regular set.
+    The sets are not bounded: a file of sparse or non-integer Ids holds all of them
+    in memory, which is logged once they pass DEDUP_SET_WARNING_IDS. The duckdb
+    engine de-duplicates in SQL and can spill to disk instead.
+    For a typed table the keys are compared as the BIGINT they are stored as, so
+    "007" and "7" are the same key. Otherwise they are compared as text.
+    A missing key (None) is never recorded, so the row reaches validation.
+    With a watermark, the integer Ids up to it count as seen: an earlier run loaded them.
+    """
+
+    def __init__(self, max_id=DEDUP_BITMAP_MAX_ID, watermark=None, typed=False):
+        self.max_id = max_id
+        self.watermark = watermark
+        self.typed = typed
+        self.bitmap = bytearray()
+        self.sparse = set()  # Integer Ids beyond the end of the bitmap
+        self.others = set()
+        self.count = 0  # Integer Ids recorded, in the bitmap or the sparse set
+        self.warned = False
+
+    def key_number(self, key):
+        """
+        Return the integer a key is compared as, or None to compare it as it is.
+        """
+        if self.typed:
+            return bigint_key(key)
+        if isinstance(key, str) and key.isdigit() and key.isascii() and (key[0] != "0" or key == "0"):
+            return int(key)
+        if isinstance(key, int) and not isinstance(key, bool) and key >= 0:
+            return key
+        return None
+
+    def add_new(self, key):
+        """
+        Record a key and return whether it was seen for the first time.
+        """
+        if key is None:
+            return True
+        number = self.key_number(key)
+        if number is not None and self.watermark is not None and number <= self.watermark:
+            return False
+        if number is None or number < 0:
+            key = key if number is None else number
+            if key in self.others:
+                return False
+            self.others.add(key)
+            self.warn_if_large()
+            return True
+
+        index, bit = number >> 3, 1 << (number & 7)
+        if index >= len(self.bitmap) and not self.grow(index):
+            if number in self.sparse:
+                return False
+            self.sparse.add(number)
+            self.count += 1
+            self.warn_if_large()
+            return True
+        if self.bitmap[index] & bit:
+            return False
+        self.bitmap[index] |= bit
+        self.count += 1
+        return True
+
+    def warn_if_large(self):
+        """
+        Log once that the sets hold DEDUP_SET_WARNING_IDS Ids, which take about a gigabyte.
+        """
+        if not self.warned and len(self.sparse) + len(self.others) >= DEDUP_SET_WARNING_IDS:
+            self.warned = True
+            logging.warning(f"{DEDUP_SET_WARNING_IDS} Ids don't fit the de-duplication bitmap and are held in sets. "
+                            f"Memory grows with every new one, the duckdb engine de-duplicates on disk instead.")
+
+    def grow(self, index):
+        """
+        Grow the bitmap to hold byte `index` when that keeps it within budget: below
+        max_id and at most DEDUP_BITMAP_BYTES_PER_ID bytes per Id recorded, or
+        DEDUP_BITMAP_MIN_BYTES. The Ids of the sparse set it now covers move into it.
+
+        :param index: Index of the byte of the Id being recorded
+        :return: Whether the bitmap now holds the byte
+        """
+        budget = min(self.max_id >> 3,
+                     max(DEDUP_BITMAP_MIN_BYTES, DEDUP_BITMAP_BYTES_PER_ID * (self.count + 1)))
+        if index >= budget:
+            return False
+        size = min(max(index + 1, 2 * len(self.bitmap)), budget)
+        self.bitmap.extend(bytes(size - len(self.bitmap)))
+        for number in [number for number in self.sparse if number >> 3 < size]:
+            self.sparse.remove(number)
+            self.bitmap[number >> 3] |= 1 << (number & 7)
+        return True
+
+
+def filtered_and_formatted_data(fetched_data, watermark=None, typed=False):
     """
     Filter and format data entries based on the specified schema.
 
     :param fetched_data: List of data entries
+    :param watermark: Drop the entries with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
     :return: List of filtered and formatted data entries
     """
-    columns = SCHEMA.keys()
+    columns = BATCH_COLUMNS
     filtered_entry = []
-    seen = set()
+    seen = SeenIds(watermark=watermark, typed=typed)
     try:
         for entry in fetched_data:
-            if entry[PRIMARY_KEY] not in seen:
+            if not isinstance(entry, dict):
+                raise TypeError(f"Expected a dictionary per entry, got {type(entry).__name__}")
+            if entry.get("Error") or seen.add_new(entry.get(PRIMARY_KEY)):
                 filtered_entry.append({col: entry[col]
                                       for col in columns if col in entry})
-                seen.add(entry[PRIMARY_KEY])
         logging.info(f"Filtered down to {len(filtered_entry)} unique entries.")
     except Exception as e:
         logging.error(f"Error while filtering and formatting data: {e}")
@@ -75,22 +524,371 @@ def filtered_and_formatted_data(fetched_data):
     return filtered_entry
 
 
-def pre_ingestion_db_activities():
+def stream_batches(file_path, batch_size=BATCH_SIZE, watermark=None, typed=False):
+    """
+    Stream de-duplicated entries from a JSON lines file in bounded-size batches.
+
+    Only one batch of rows is held in memory at a time, the set of seen primary
+    keys is the only structure that grows with the input. Shards of a directory or
+    glob pattern are streamed in order and share the set of seen keys.
+
+    :param file_path: Path to the JSON lines file, a directory of shards or a glob pattern
+    :param batch_size: Maximum number of rows per batch
+    :param watermark: Skip the entries with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Generator of dictionaries of BATCH_COLUMNS to list of values
+    """
+    seen = SeenIds(watermark=watermark, typed=typed)
+    for path in expand_input_paths(file_path):
+        for batch, _, _ in read_batches(path, batch_size, seen):
+            yield batch
+
+
+def read_batches(file_path, batch_size, seen, start=0, lines_read=0):
+    """
+    Read the entries of one file in batches, from a byte offset on, skipping keys
+    already in `seen`. The offset of every batch lets a resumable load record where
+    to continue from.
+
+    :param file_path: Path to the JSON lines file, optionally compressed
+    :param batch_size: Maximum number of rows per batch
+    :param seen: SeenIds shared with earlier files or batches
+    :param start: Offset in the (decompressed) file of the first line to read
+    :param lines_read: Number of lines before the offset, so line numbers stay right
+    :return: Generator of (batch, offset, lines read) tuples, as of the end of the batch
+    """
+    batch = {col: [] for col in BATCH_COLUMNS}
+    offset, line_number = start, lines_read
+    with open_input(file_path, text=False) as file:
+        skip_bytes(file, start)
+        for line in file:
+            offset += len(line)
+            line_number += 1
+            collect_line(batch, seen, line, file_path, line_number)
+            if len(batch[PRIMARY_KEY]) >= batch_size:
+                yield batch, offset, line_number
+                batch = {col: [] for col in BATCH_COLUMNS}
+    if batch[PRIMARY_KEY]:
+        yield batch, offset, line_number
+
+
+def skip_bytes(file, count):
+    """
+    Move a binary stream `count` bytes forward. Streams that can't seek, like
+    tarball members, are read and discarded.
+    """
+    if file.seekable():
+        file.seek(count)
+        return
+    while count > 0:
+        chunk = file.read(min(count, CHUNK_SIZE_8_MIB))
+        if not chunk:
+            break
+        count -= len(chunk)
+
+
+def resource_usage():
+    """
+    CPU time used so far, by the process and its finished worker processes, and the
+    peak resident memory of the process and of its largest worker process.
+
+    :return: Tuple of CPU seconds, peak RSS in MB and the workers' peak RSS in MB, None without resource
+    """
+    times = os.times()
+    cpu_seconds = times.user + times.system + times.children_user + times.children_system
+    if resource is None:
+        return cpu_seconds, None, None
+    unit = 1024 ** 2 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, KB elsewhere
+    return (cpu_seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure a stage of the pipeline and add it to STAGE_REPORT: its wall time, the
+    CPU time of the process and its workers, and the peak RSS of the process at the
+    end of the stage. The peak never goes down, so rss_growth_mb pins the stage
+    that raised it. Stages run inside another one are named after both, e.g.
+    load.fetch. Set "rows" on the yielded dictionary to get rows_per_second.
+
+    :param name: Name of the stage
+    :return: Context manager yielding the stage's metrics
+    """
+    STAGE_PATH.append(name)
+    metrics = {"stage": ".".join(STAGE_PATH), "rows": None}
+    STAGE_REPORT.append(metrics)
+    cpu_start, peak_start, _ = resource_usage()
+    tic = time.perf_counter()
+    try:
+        yield metrics
+    except Exception:
+        metrics["failed"] = True
+        raise
+    finally:
+        wall_seconds = time.perf_counter() - tic
+        cpu_end, peak_end, workers_peak = resource_usage()
+        STAGE_PATH.pop()
+        metrics.update({
+            "wall_seconds": round(wall_seconds, 6),
+            "cpu_seconds": round(cpu_end - cpu_start, 6),
+            "peak_rss_mb": peak_end and round(peak_end, 1),
+            "rss_growth_mb": peak_end and round(peak_end - peak_start, 1),
+            "workers_peak_rss_mb": workers_peak and round(workers_peak, 1),
+            "rows_per_second": round(metrics["rows"] / wall_seconds) if metrics["rows"] and wall_seconds else None,
+        })
+
+
+def stage_report():
+    """
+    The report of the stages run since STAGE_REPORT was last cleared.
+
+    :return: Dictionary of the stages and the wall time, CPU time and peak RSS of the whole run
+    """
+    top_level = [metrics for metrics in STAGE_REPORT if "." not in metrics["stage"]]
+    peak_rss = resource_usage()[1]
+    return {
+        "stages": list(STAGE_REPORT),
+        "wall_seconds": round(sum(metrics.get("wall_seconds", 0) for metrics in top_level), 6),
+        "cpu_seconds": round(sum(metrics.get("cpu_seconds", 0) for metrics in top_level), 6),
+        "peak_rss_mb": peak_rss and round(peak_rss, 1),
+    }
+
+
+def file_fingerprint(file_path):
+    """
+    Fingerprint a file by its size, modification time and the SHA-256 of its first
+    FINGERPRINT_HEAD_BYTES, so fingerprinting takes the same time however large
+    the file is. The same drop is recognised when it is renamed. A file that is
+    rewritten or appended to, or copied, gets a new fingerprint. Compressed files
+    are fingerprinted as stored, a tarball member by the archive and the member
+    name. A set of shards is fingerprinted by the digests of its files in order.
+
+    :param file_path: Path to the file, a directory of shards or a glob pattern
+    :return: Hex digest string
+    """
+    paths = expand_input_paths(file_path)
+    if len(paths) > 1:
+        return hashlib.sha256("".join(file_fingerprint(path) for path in paths).encode()).hexdigest()
+    path, member = split_input_path(paths[0])
+    digest = hashlib.sha256()
+    if member:
+        digest.update(member.encode())
+    with open(path, "rb") as file:
+        stat = os.fstat(file.fileno())
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}:".encode())
+        digest.update(file.read(FINGERPRINT_HEAD_BYTES))
+    return digest.hexdigest()
+
+
+def split_file(file_path, num_ranges):
+    """
+    Split a file into contiguous byte ranges that start and end on line boundaries.
+
+    :param file_path: Path to the JSON lines file
+    :param num_ranges: Number of ranges wanted, fewer are returned for small files
+    :return: List of (start, end) byte offsets covering the whole file
+    """
+    size = os.path.getsize(file_path)
+    range_size = max(1, size // num_ranges)
+    offsets = [0]
+    with open(file_path, "rb") as file:
+        for i in range(1, num_ranges):
+            file.seek(max(i * range_size, offsets[-1]))
+            file.readline()  # Move to the start of the next line
+            position = file.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def parse_byte_range(file_path, start, end, watermark=None, typed=False):
+    """
+    Decode the lines of one byte range and keep the first entry per primary key.
+    Runs in a worker process, so it returns columns rather than one dict per row
+    to keep the result cheap to send back.
+
+    :param file_path: Path to the JSON lines file
+    :param start: Offset of the first byte of the range
+    :param end: Offset just past the last byte of the range
+    :param watermark: Skip the entries with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Tuple of the dictionary of BATCH_COLUMNS to list of values, with line
+             numbers counted from the start of the range, and the range's line count
+    """
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        lines = file.read(end - start).split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return parse_lines(lines, file_path, watermark, typed)
+
+
+def parse_whole_file(file_path, watermark=None, typed=False):
+    """
+    Decode a compressed file or tarball member, which can't be split into byte
+    ranges, in one worker process.
+
+    :param file_path: Path to the compressed JSON lines file
+    :param watermark: Skip the entries with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Tuple of the dictionary of BATCH_COLUMNS to list of values and the line count
+    """
+    with open_input(file_path, text=False) as file:
+        return parse_lines(file, file_path, watermark, typed)
+
+
+def parse_lines(lines, source_file, watermark=None, typed=False):
+    """
+    Decode JSON lines into columns, keeping the first entry per primary key beyond the watermark.
+    """
+    columns = {col: [] for col in BATCH_COLUMNS}
+    seen = SeenIds(watermark=watermark, typed=typed)
+    line_number = 0
+    for line_number, line in enumerate(lines, start=1):
+        collect_line(columns, seen, line, source_file, line_number)
+    return columns, line_number
+
+
+def parse_file_in_parallel(file_path, num_workers=PARSE_WORKERS, watermark=None, typed=False):
+    """
+    Decode the file, or every shard of a directory or glob pattern, across a pool
+    of processes and merge the per-range columns. Plain files are split into byte
+    ranges, compressed files are decoded whole by one worker each. Results are
+    merged in file order so the first entry per primary key wins across ranges and
+    shards as well as within them.
+
+    :param file_path: Path to the JSON lines file, a directory of shards or a glob pattern
+    :param num_workers: Number of worker processes
+    :param watermark: Skip the entries with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Dictionary of column name to list of de-duplicated values
+    """
+    paths = expand_input_paths(file_path)
+    ranges_per_file = -(-num_workers // len(paths))
+    merged = {col: [] for col in BATCH_COLUMNS}
+    seen = SeenIds(typed=typed)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        for path in paths:
+            if split_input_path(path)[0] != path or compression_of(path) or is_tar_archive(path):
+                futures.append((path, executor.submit(parse_whole_file, path, watermark, typed)))
+                continue
+            num_ranges = max(ranges_per_file, os.path.getsize(path) // PARSE_RANGE_BYTES + 1)
+            futures.extend((path, executor.submit(parse_byte_range, path, start, end, watermark, typed))
+                           for start, end in split_file(path, num_ranges))
+        previous_path, lines_before = None, 0
+        for path, future in futures:
+            if path != previous_path:
+                previous_path, lines_before = path, 0
+            columns, line_count = future.result()
+            for i, key in enumerate(columns[PRIMARY_KEY]):
+                if columns["Error"][i] is None and not seen.add_new(key):
+                    continue
+                for col, values in merged.items():
+                    values.append(columns[col][i])
+                merged["LineNumber"][-1] += lines_before
+            lines_before += line_count
+    logging.info(
+        f"Parsed {len(futures)} byte ranges and files with {num_workers} workers into {len(merged[PRIMARY_KEY])} unique entries.")
+    return merged
+
+
+def migrate_votes_table(cursor, table_schema=TYPED_SCHEMA):
+    """
+    Rewrite the votes table with new column types, keeping its rows. The table is
+    copied with casts and swapped in, in one transaction, so a value that doesn't
+    fit the new type leaves the original table untouched.
+
+    :param cursor: Database cursor
+    :param table_schema: Dictionary of column name to the new data type
+    """
+    migration_table = f"{TABLE_NAME}_migration"
+    select_columns = ", ".join([f"CAST({col} AS {dtype}) AS {col}" for col, dtype in table_schema.items()])
+    try:
+        cursor.execute("BEGIN TRANSACTION")
+        cursor.execute(f"""
+            CREATE OR REPLACE TABLE {SCHEMA_NAME}.{migration_table} AS
+            SELECT {select_columns} FROM {SCHEMA_NAME}.{TABLE_NAME}
+        """)
+        cursor.execute(f"DROP TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+        cursor.execute(f"ALTER TABLE {SCHEMA_NAME}.{migration_table} RENAME TO {TABLE_NAME}")
+        cursor.execute("COMMIT")
+        db.invalidate_catalog(cursor)
+        cursor.execute("CHECKPOINT")
+        logging.info(f"Migrated {SCHEMA_NAME}.{TABLE_NAME} to schema: {table_schema}")
+    except Exception as e:
+        cursor.execute("ROLLBACK")
+        db.invalidate_catalog(cursor)
+        logging.error(f"Failed to migrate {SCHEMA_NAME}.{TABLE_NAME}. Error: {e}")
+        raise
+
+
+def pre_ingestion_db_activities(incremental=False, typed_schema=False, resume=False):
     """
     Perform pre-ingestion database activities such as checking and creating schema and table.
+    A full load truncates the votes table and its quarantine, an incremental load
+    keeps them and starts from an empty staging table instead. The column types of an existing votes table
+    are kept unless the typed schema is requested for a table that isn't typed yet.
+    Emptying a table invalidates the checkpoints of loads into it.
+
+    :param incremental: Prepare for an incremental load
+    :param typed_schema: Store the votes with TYPED_SCHEMA instead of SCHEMA
+    :param resume: Keep the rows a checkpointed load already committed
     """
     cursor = None
     try:
-        cursor = db.connect_to_db(DATABASE)
+        cursor = db.pooled_cursor(DATABASE)
+        with db.catalog_cache(cursor):
+            if not db.schema_exists(cursor, SCHEMA_NAME):
+                db.create_schema(cursor, DATABASE, SCHEMA_NAME)
 
-        if not db.schema_exists(cursor, SCHEMA_NAME):
-            db.create_schema(cursor, DATABASE, SCHEMA_NAME)
+            table_schema = TYPED_SCHEMA if typed_schema else SCHEMA
+            if db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME) and typed_schema and \
+                    list(db.table_columns(cursor, SCHEMA_NAME, TABLE_NAME).values()) != list(TYPED_SCHEMA.values()):
+                if incremental or resume:
+                    migrate_votes_table(cursor, TYPED_SCHEMA)
+                else:
+                    cursor.execute(f"DROP TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+                    db.invalidate_catalog(cursor)
 
-        if not db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME):
-            db.create_table(cursor, DATABASE, SCHEMA_NAME,
-                            TABLE_NAME, SCHEMA, primary_key=None)
-        else:
-            db.truncate_table(cursor, DATABASE, SCHEMA_NAME, TABLE_NAME)
+            if not db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME):
+                db.create_table(cursor, DATABASE, SCHEMA_NAME,
+                                TABLE_NAME, table_schema, primary_key=None)
+            elif not incremental and not resume:
+                db.truncate_table(cursor, DATABASE, SCHEMA_NAME, TABLE_NAME)
+
+            if not db.table_exists(cursor, SCHEMA_NAME, RUNS_TABLE_NAME):
+                db.create_table(cursor, DATABASE, SCHEMA_NAME,
+                                RUNS_TABLE_NAME, RUNS_SCHEMA, primary_key="RunId")
+
+            if not db.table_exists(cursor, SCHEMA_NAME, CHECKPOINTS_TABLE_NAME):
+                db.create_table(cursor, DATABASE, SCHEMA_NAME,
+                                CHECKPOINTS_TABLE_NAME, CHECKPOINTS_SCHEMA, primary_key="FileFingerprint")
+
+            outliers.create_weekly_vote_counts(cursor)
+            if not incremental:
+                outliers.clear_vote_counts_version(cursor)
+
+            if not db.table_exists(cursor, SCHEMA_NAME, REJECTED_TABLE_NAME):
+                db.create_table(cursor, DATABASE, SCHEMA_NAME,
+                                REJECTED_TABLE_NAME, REJECTED_SCHEMA, primary_key=None)
+            elif not incremental and not resume:
+                db.truncate_table(cursor, DATABASE, SCHEMA_NAME, REJECTED_TABLE_NAME)
+
+            if incremental and not resume:
+                # Recreated from votes every time so it always has the same column types
+                cursor.execute(f"""
+                    CREATE OR REPLACE TABLE {SCHEMA_NAME}.{STAGING_TABLE_NAME}
+                    AS SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME} LIMIT 0
+                """)
+
+            if not resume:
+                cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{CHECKPOINTS_TABLE_NAME} WHERE TableName = ?",
+                               [STAGING_TABLE_NAME if incremental else TABLE_NAME])
 
         logging.info("Pre-ingestion database activities completed successfully.")
 
@@ -110,15 +908,16 @@ def pre_ingestion_db_activities():
             db.close_connection(cursor)
 
 
-def insert_batch(conn, data_batch, parameter_length):
+def insert_batch(conn, data_batch, parameter_length, table_name=TABLE_NAME):
     """
     Insert a batch of data into the database.
     :param conn: Database connection object
     :param data_batch: List of data tuples to be inserted
     :param parameter_length: Number of parameters in the data tuples
+    :param table_name: Name of the table the batch is inserted into
     """
     placeholders = ", ".join(["?"] * parameter_length)
-    insert_query = f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} VALUES ({placeholders})"
+    insert_query = f"INSERT INTO {SCHEMA_NAME}.{table_name} VALUES ({placeholders})"
     try:
         conn.executemany(insert_query, data_batch)
         logging.info(f"Inserted batch : {len(data_batch)} rows.")
@@ -131,58 +930,983 @@ def insert_batch(conn, data_batch, parameter_length):
         raise
 
 
-def insert_data_using_multithreading(filtered_entry):
+def rejection_reason_sql():
+    """
+    SQL expression giving the first problem of a parsed row, NULL for a valid row.
+    Every value must be present and cast to its VALIDATION_SCHEMA type.
+    """
+    checks = ["WHEN Error IS NOT NULL THEN Error"]
+    checks += [f"WHEN {col} IS NULL THEN 'missing {col}'" for col in SCHEMA]
+    checks += [f"WHEN TRY_CAST({col} AS {dtype}) IS NULL THEN '{col} is not a valid {dtype}'"
+               for col, dtype in VALIDATION_SCHEMA.items()]
+    return f"(CASE {' '.join(checks)} END)"
+
+
+def insert_validated(conn, source, table_name=TABLE_NAME, table_schema=SCHEMA,
+                     rejected_table=REJECTED_TABLE_NAME):
+    """
+    Validate a relation of parsed rows in SQL and insert the valid rows into the
+    table and the others, with the reason, into the quarantine table.
+
+    :param conn: Database connection object
+    :param source: Name of the table or view holding the BATCH_COLUMNS
+    :param table_name: Name of the table the valid rows are inserted into
+    :param table_schema: Column types of the table, valid rows are cast to them
+    :param rejected_table: Name of the quarantine table
+    :return: Tuple of the number of rows inserted and rejected
+    """
+    reason = rejection_reason_sql()
+    rejected_columns = ", ".join(["SourceFile", "LineNumber", "Reason",
+                                  *[f"CAST({col} AS VARCHAR)" for col in SCHEMA], "RawLine", "current_timestamp"])
+    rejected = conn.execute(f"""
+        INSERT INTO {SCHEMA_NAME}.{rejected_table}
+        SELECT {rejected_columns} FROM (SELECT *, {reason} AS Reason FROM {source}) WHERE Reason IS NOT NULL
+    """).fetchone()[0]
+    select_columns = ", ".join([f"CAST({col} AS {dtype})" for col, dtype in table_schema.items()])
+    inserted = conn.execute(f"""
+        INSERT INTO {SCHEMA_NAME}.{table_name} SELECT {select_columns} FROM {source} WHERE {reason} IS NULL
+    """).fetchone()[0]
+    if rejected:
+        logging.warning(f"Quarantined {rejected} rows in {SCHEMA_NAME}.{rejected_table}.")
+    return inserted, rejected
+
+
+def as_text(value):
+    """
+    Text of a parsed JSON value: strings are kept as they are, other values become
+    their JSON text, like the DuckDB reader reads them. Every column of a batch is
+    text until it is validated, whatever type the JSON gave a value.
+
+    :param value: Value decoded from a JSON line
+    :return: String, or None for a missing value
+    """
+    return value if value is None or isinstance(value, str) else json.dumps(value)
+
+
+def insert_columns(conn, columns, table_name=TABLE_NAME, table_schema=SCHEMA,
+                   rejected_table=REJECTED_TABLE_NAME):
+    """
+    Validate a column-oriented batch and insert it with INSERT ... SELECT, the
+    rows that fail validation go to the quarantine table.
+
+    With pyarrow installed the columns become an Arrow table of strings that
+    DuckDB scans directly, so there is no per-row binding. Without it the batch is
+    turned back into tuples for insert_batch into a scratch table.
+
+    :param conn: Database connection object
+    :param columns: Dictionary of column name to list of values, LINE_COLUMNS may be left out
+    :param table_name: Name of the table the batch is inserted into
+    :param table_schema: Column types of the table, the batch is cast to them
+    :param rejected_table: Name of the quarantine table
+    :return: Tuple of the number of rows inserted and rejected
+    """
+    row_count = len(columns[PRIMARY_KEY])
+    columns = {col: columns.get(col, [None] * row_count) if col == "LineNumber"
+               else [as_text(value) for value in columns.get(col, [None] * row_count)]
+               for col in BATCH_COLUMNS}
+    batch_name = f"batch_{uuid.uuid4().hex}"
+    try:
+        if pyarrow is None:
+            column_types = {col: "BIGINT" if col == "LineNumber" else "STRING" for col in BATCH_COLUMNS}
+            db.create_table(conn, DATABASE, SCHEMA_NAME, batch_name, column_types, primary_key=None)
+            insert_batch(conn, list(zip(*columns.values())), len(columns), batch_name)
+            source = f"{SCHEMA_NAME}.{batch_name}"
+        else:
+            conn.register(batch_name, pyarrow.table(
+                {col: pyarrow.array(values, pyarrow.int64() if col == "LineNumber" else pyarrow.string())
+                 for col, values in columns.items()}))
+            source = batch_name
+        inserted, rejected = insert_validated(conn, source, table_name, table_schema, rejected_table)
+        logging.info(f"Inserted columnar batch : {inserted} rows, {rejected} rejected.")
+        return inserted, rejected
+    except Exception as e:
+        logging.error(f"Failed to insert columnar batch: {str(e)}")
+        raise
+    finally:
+        if pyarrow is None:
+            conn.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{batch_name}")
+        else:
+            conn.unregister(batch_name)
+
+
+def insert_worker_chunks(connection, chunks, worker_table, table_schema=SCHEMA):
+    """
+    Insert the chunks of one worker thread through its own cursor into its own
+    staging and quarantine tables, so workers never share a connection or a table.
+
+    :param connection: Database connection object the cursor is taken from
+    :param chunks: Lists of dictionaries, converted to columns one chunk at a time
+    :param worker_table: Name of the worker's staging table
+    :param table_schema: Column types of the staging table
+    """
+    cursor = connection.cursor()
+    try:
+        for chunk in chunks:
+            columns = {col: [item.get(col) for item in chunk] for col in BATCH_COLUMNS}
+            insert_columns(cursor, columns, worker_table, table_schema, f"{worker_table}_rejected")
+    finally:
+        cursor.close()
+
+
+def insert_data_using_multithreading(filtered_entry, table_name=TABLE_NAME, num_threads=NUM_THREADS,
+                                     batch_size=BATCH_SIZE):
     """
     Inserts data into the database using multithreading.
 
+    Every worker writes its chunks into its own staging table through its own
+    cursor, which lets DuckDB run the appends in parallel. The staging tables and
+    the workers' quarantine tables are then merged into the target and quarantine
+    tables and dropped in a single transaction.
+
     :param filtered_entry: List of dictionaries containing the data to be inserted
+    :param table_name: Name of the table the data is inserted into
+    :param num_threads: Number of worker threads
+    :param batch_size: Maximum number of rows converted and inserted at once
+    :return: Number of rows inserted
+    """
+    connection = None
+    row_count = 0
+    in_transaction = False
+    worker_tables = []
+    try:
+        connection = db.pooled_cursor(DATABASE)
+        logging.info(f"Data insertion using {num_threads} threads starting now.")
+
+        chunk_size = min(batch_size, max(1, -(-len(filtered_entry) // num_threads)))
+        data_chunks = [filtered_entry[i:i + chunk_size]
+                       for i in range(0, len(filtered_entry), chunk_size)]
+
+        worker_count = min(num_threads, len(data_chunks))
+        for i in range(worker_count):
+            worker_table = f"{table_name}_worker_{i}"
+            for scratch_table, template in ((worker_table, table_name),
+                                            (f"{worker_table}_rejected", REJECTED_TABLE_NAME)):
+                connection.execute(f"""
+                    CREATE OR REPLACE TABLE {SCHEMA_NAME}.{scratch_table}
+                    AS SELECT * FROM {SCHEMA_NAME}.{template} LIMIT 0
+                """)
+            worker_tables.append(worker_table)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            table_schema = db.table_columns(connection, SCHEMA_NAME, table_name)
+            futures = [executor.submit(insert_worker_chunks, connection, data_chunks[i::worker_count],
+                                       worker_table, table_schema)
+                       for i, worker_table in enumerate(worker_tables)]
+            for future in futures:
+                future.result()
+
+        connection.execute("BEGIN TRANSACTION")
+        in_transaction = True
+        for target, suffix in ((table_name, ""), (REJECTED_TABLE_NAME, "_rejected")):
+            if worker_tables:
+                union_query = " UNION ALL ".join(
+                    [f"SELECT * FROM {SCHEMA_NAME}.{worker_table}{suffix}" for worker_table in worker_tables])
+                inserted = connection.execute(f"INSERT INTO {SCHEMA_NAME}.{target} {union_query}").fetchone()[0]
+                if target == table_name:
+                    row_count = inserted
+            for worker_table in worker_tables:
+                connection.execute(f"DROP TABLE {SCHEMA_NAME}.{worker_table}{suffix}")
+        connection.execute("COMMIT")
+        in_transaction = False
+        worker_tables = []
+        logging.info("Data inserted successfully.")
+        return row_count
+
+    except Exception as e:
+        if in_transaction:
+            connection.execute("ROLLBACK")
+        logging.error(f"Error during data insertion: {e}")
+        raise
+    finally:
+        if connection:
+            for worker_table in worker_tables:
+                connection.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{worker_table}")
+                connection.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{worker_table}_rejected")
+            db.close_connection(connection)
+
+
+def insert_data_streaming(file_path, batch_size=BATCH_SIZE, table_name=TABLE_NAME, watermark=None, typed=False):
+    """
+    Inserts data into the database batch by batch while the file is being read,
+    so peak memory is bounded by the batch size rather than the file size.
+
+    :param file_path: Path to the JSON lines file
+    :param batch_size: Maximum number of rows inserted per batch
+    :param table_name: Name of the table the data is inserted into
+    :param watermark: Skip the rows with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Number of rows inserted
     """
     cursor = None
     try:
-        cursor = db.connect_to_db(DATABASE)
+        cursor = db.pooled_cursor(DATABASE)
         cursor.execute("BEGIN TRANSACTION")
-        logging.info("Data insertion using multithreading starting now.")
-
-        columns = SCHEMA.keys()
-        batch_size = len(filtered_entry) // NUM_THREADS
-        data_chunks = []
-        parameter_length = len(filtered_entry[0])
-        for i in range(0, len(filtered_entry), batch_size):
-            batch = filtered_entry[i:i + batch_size]
-            batch_values = [tuple(item[col] for col in columns) for item in batch]
-            data_chunks.append(batch_values)
-
-        # Insert data using multiple threads
-        with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-            futures = [executor.submit(
-                insert_batch, cursor, chunk, parameter_length) for chunk in data_chunks]
-            concurrent.futures.wait(futures)
+        logging.info(
+            f"Streaming data insertion starting now with batches of {batch_size} rows.")
+
+        table_schema = db.table_columns(cursor, SCHEMA_NAME, table_name)
+        row_count = 0
+        for batch in stream_batches(file_path, batch_size, watermark, typed):
+            row_count += insert_columns(cursor, batch, table_name, table_schema)[0]
 
         cursor.execute("COMMIT")
-        logging.info("Data inserted successfully.")
+        logging.info(f"Streamed {row_count} rows into {SCHEMA_NAME}.{table_name}.")
+        return row_count
 
     except Exception as e:
         if cursor:
             cursor.execute("ROLLBACK")
-        logging.error(f"Error during data insertion: {e}")
+        logging.error(f"Error during streaming data insertion: {e}")
         raise
     finally:
         if cursor:
             db.close_connection(cursor)
 
 
+def insert_data_checkpointed(file_path, fingerprint, batch_size=BATCH_SIZE, table_name=TABLE_NAME,
+                             checkpoint=None, watermark=None):
+    """
+    Inserts data into the database one committed segment of `batch_size` rows at a
+    time. Every segment also records the byte offset it ended at, so a failed load
+    can be rerun from its last checkpoint instead of from the start. On resume the
+    keys already in the table, and those of the rows this load quarantined before
+    the checkpoint, are treated as seen, so a key duplicated across the checkpoint
+    is still only kept once, as in a load that never stopped. The quarantined rows
+    of this load are those of the file committed since the latest ingestion run.
+    The keys are read `batch_size` at a time, so only the SeenIds grow with the
+    rows already committed.
+
+    :param file_path: Path to a single JSON lines file, optionally compressed
+    :param fingerprint: Fingerprint of the file, the checkpoint key
+    :param batch_size: Maximum number of rows committed per segment
+    :param table_name: Name of the table the data is inserted into
+    :param checkpoint: Checkpoint returned by get_checkpoint to resume from
+    :param watermark: Skip the rows with an Id up to this, loaded by an earlier run
+    :return: Number of rows inserted, by this run and the runs it resumes
+    """
+    paths = expand_input_paths(file_path)
+    if len(paths) > 1:
+        raise ValueError("A resumable load reads a single file, not a directory or glob of shards.")
+
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        table_schema = db.table_columns(cursor, SCHEMA_NAME, table_name)
+        seen = SeenIds(watermark=watermark, typed=has_typed_key(table_schema))
+        start, lines_read, row_count = 0, 0, 0
+        if checkpoint:
+            start, lines_read = checkpoint["ByteOffset"], checkpoint["LinesRead"]
+            row_count = checkpoint["RowsCommitted"]
+            committed_keys = [
+                (f"SELECT {PRIMARY_KEY} FROM {SCHEMA_NAME}.{table_name}", []),
+                (f"""
+                    SELECT {PRIMARY_KEY} FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME}
+                    WHERE SourceFile = ? AND LineNumber <= ? AND {PRIMARY_KEY} IS NOT NULL
+                        AND coalesce(RejectedAt > (SELECT max(IngestedAt) FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}), true)
+                    ORDER BY LineNumber
+                """, [paths[0], lines_read]),
+            ]
+            for query, parameters in committed_keys:
+                result = cursor.execute(query, parameters)
+                while keys := result.fetchmany(batch_size):
+                    for (key,) in keys:
+                        seen.add_new(key)
+            logging.info(f"Resuming from byte {start} after {row_count} committed rows.")
+
+        for batch, offset, lines_read in read_batches(paths[0], batch_size, seen, start, lines_read):
+            cursor.execute("BEGIN TRANSACTION")
+            try:
+                row_count += insert_columns(cursor, batch, table_name, table_schema)[0]
+                last_id = next((key for key in reversed(batch[PRIMARY_KEY]) if key is not None), None)
+                save_checkpoint(cursor, fingerprint, table_name, offset, lines_read, last_id, row_count)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        logging.info(f"Loaded {row_count} rows into {SCHEMA_NAME}.{table_name} in checkpointed segments.")
+        return row_count
+
+    except Exception as e:
+        logging.error(f"Error during checkpointed data insertion, rerun to resume: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def save_checkpoint(cursor, fingerprint, table_name, byte_offset, lines_read, last_id, rows_committed):
+    """
+    Record how far a resumable load got, as part of the segment's transaction.
+    """
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO {SCHEMA_NAME}.{CHECKPOINTS_TABLE_NAME}
+        VALUES (?, ?, ?, ?, ?, ?, current_timestamp)
+    """, [fingerprint, table_name, byte_offset, lines_read, None if last_id is None else str(last_id), rows_committed])
+
+
+def get_checkpoint(fingerprint, table_name):
+    """
+    Look up the checkpoint of an unfinished resumable load of the file into the table.
+
+    :param fingerprint: File fingerprint
+    :param table_name: Name of the table the load writes to
+    :return: Dictionary of CHECKPOINTS_SCHEMA column to value, or None
+    """
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        if not db.schema_exists(cursor, SCHEMA_NAME) or \
+                not db.table_exists(cursor, SCHEMA_NAME, CHECKPOINTS_TABLE_NAME):
+            return None
+        result = cursor.execute(f"""
+            SELECT * FROM {SCHEMA_NAME}.{CHECKPOINTS_TABLE_NAME} WHERE FileFingerprint = ? AND TableName = ?
+        """, [fingerprint, table_name]).fetchone()
+        return dict(zip(CHECKPOINTS_SCHEMA, result)) if result else None
+    except Exception as e:
+        logging.error(f"Error while reading the ingestion checkpoint: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def insert_data_using_parallel_parse(file_path, table_name=TABLE_NAME, num_workers=PARSE_WORKERS, watermark=None,
+                                     typed=False):
+    """
+    Inserts data into the database after decoding the file on all cores.
+
+    :param file_path: Path to the JSON lines file
+    :param table_name: Name of the table the data is inserted into
+    :param num_workers: Number of worker processes decoding JSON
+    :param watermark: Skip the rows with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Number of rows inserted
+    """
+    columns = parse_file_in_parallel(file_path, num_workers, watermark, typed)
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        cursor.execute("BEGIN TRANSACTION")
+        table_schema = db.table_columns(cursor, SCHEMA_NAME, table_name)
+        row_count = 0
+        if columns[PRIMARY_KEY]:
+            row_count = insert_columns(cursor, columns, table_name, table_schema)[0]
+        cursor.execute("COMMIT")
+        logging.info(
+            f"Inserted {row_count} parallel parsed rows into {SCHEMA_NAME}.{table_name}.")
+        return row_count
+
+    except Exception as e:
+        if cursor:
+            cursor.execute("ROLLBACK")
+        logging.error(f"Error during parallel parsed data insertion: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def native_parse_query(file_path, raw_lines=False, watermark=None, typed=False):
+    """
+    Build the query that lets DuckDB parse the file into the BATCH_COLUMNS and keep
+    the first line seen for each primary key, like in the python engine. Every
+    column is read as text, so a single odd value can't change the inferred type of
+    a whole column, and is only cast once validated.
+
+    The JSON reader is the fastest, but it stops at the first malformed line and
+    skips blank lines, so its rows carry no line number. With `raw_lines` every line
+    is read as text and parsed with the JSON functions instead, which keeps
+    malformed lines, with their text, and gives exact line numbers.
+
+    :param file_path: Path to the JSON lines file, a directory of shards or a glob pattern
+    :param raw_lines: Read the file as lines of text instead of with the JSON reader
+    :param watermark: Skip the rows with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: SELECT query string
+    """
+    escaped_paths = ", ".join(["'" + path.replace("'", "''") + "'" for path in expand_input_paths(file_path)])
+    text_columns = ", ".join(SCHEMA)
+    if raw_lines:
+        extracted = ", ".join(
+            [f"CASE WHEN JsonType = 'OBJECT' THEN json_extract_string(Line, '$.{col}') END AS {col}" for col in SCHEMA])
+        lines = f"""
+            SELECT {extracted}, filename, Ordinal, Ordinal - min(Ordinal) OVER (PARTITION BY filename) + 1 AS LineNumber,
+                CASE WHEN NOT IsJson THEN 'invalid JSON' WHEN JsonType <> 'OBJECT' THEN 'not a JSON object' END AS Error,
+                CASE WHEN JsonType IS DISTINCT FROM 'OBJECT' THEN coalesce(Line, '') END AS RawLine
+            FROM (
+                SELECT *, CASE WHEN IsJson THEN json_type(Line) END AS JsonType
+                FROM (
+                    SELECT Line, filename, row_number() OVER () AS Ordinal, json_valid(Line) AS IsJson
+                    FROM read_csv([{escaped_paths}], columns={{'Line': 'VARCHAR'}}, delim='\x01', quote='', escape='',
+                                  header=false, auto_detect=false, filename=true)
+                )
+            )
+        """
+    else:
+        json_columns = ", ".join([f"{col}: 'VARCHAR'" for col in SCHEMA])
+        lines = f"""
+            SELECT {text_columns}, filename, row_number() OVER () AS Ordinal,
+                NULL::BIGINT AS LineNumber, NULL AS Error, NULL AS RawLine
+            FROM read_json([{escaped_paths}], format='newline_delimited', columns={{{json_columns}}}, filename=true)
+        """
+    beyond_watermark = "true" if watermark is None else \
+        f"coalesce(TRY_CAST({PRIMARY_KEY} AS BIGINT) > {int(watermark)}, true)"
+    # Ids that don't cast keep their text, so they can't collide with the ones that do
+    key = f"coalesce(CAST(TRY_CAST({PRIMARY_KEY} AS BIGINT) AS VARCHAR), {PRIMARY_KEY})" if typed else PRIMARY_KEY
+    return f"""
+    SELECT {text_columns}, filename AS SourceFile, LineNumber, Error, RawLine
+    FROM ({lines})
+    WHERE trim(coalesce(RawLine, '-')) <> '' AND {beyond_watermark}
+    QUALIFY Error IS NOT NULL OR {PRIMARY_KEY} IS NULL
+        OR row_number() OVER (PARTITION BY {key} ORDER BY Ordinal) = 1
+    """
+
+
+def insert_data_using_duckdb(file_path, table_name=TABLE_NAME, watermark=None, typed=False):
+    """
+    Inserts data into the database with DuckDB's vectorised JSON reader, so rows
+    never pass through the python interpreter. The file is parsed into a temporary
+    table and validated in SQL. If the JSON reader rejects the file, or any row
+    fails validation, the file is parsed again line by line so the quarantine gets
+    exact line numbers and the text of malformed lines.
+
+    :param file_path: Path to the JSON lines file
+    :param table_name: Name of the table the data is inserted into
+    :param watermark: Skip the rows with an Id up to this, loaded by an earlier run
+    :param typed: De-duplicate on the Id cast to BIGINT, as a typed table stores it
+    :return: Number of rows inserted
+    """
+    cursor = None
+    parsed_table = f"parsed_{uuid.uuid4().hex}"
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        logging.info("Data insertion using the DuckDB JSON reader starting now.")
+        try:
+            cursor.execute(f"CREATE TEMP TABLE {parsed_table} AS {native_parse_query(file_path, watermark=watermark, typed=typed)}")
+            clean = cursor.execute(
+                f"SELECT count(*) FROM {parsed_table} WHERE {rejection_reason_sql()} IS NOT NULL").fetchone()[0] == 0
+        except duckdb.InvalidInputException as e:
+            logging.warning(f"The JSON reader rejected {file_path}, parsing it line by line. Error: {e}")
+            clean = False
+        if not clean:
+            cursor.execute(f"CREATE OR REPLACE TEMP TABLE {parsed_table} AS {native_parse_query(file_path, True, watermark, typed)}")
+
+        cursor.execute("BEGIN TRANSACTION")
+        table_schema = db.table_columns(cursor, SCHEMA_NAME, table_name)
+        row_count, rejected = insert_validated(cursor, parsed_table, table_name, table_schema)
+        cursor.execute("COMMIT")
+        logging.info(f"Bulk loaded {row_count} rows into {SCHEMA_NAME}.{table_name}, rejected {rejected}.")
+        return row_count
+
+    except Exception as e:
+        if cursor:
+            cursor.execute("ROLLBACK")
+        logging.error(f"Error during DuckDB bulk load: {e}")
+        raise
+    finally:
+        if cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {parsed_table}")
+            db.close_connection(cursor)
+
+
+def choose_engine(file_path, engine=DEFAULT_ENGINE):
+    """
+    Pick the engine that loads the file. The DuckDB reader can't open bzip2 files
+    or tarball members, so those are loaded with the python engine. The python
+    engines need the zstandard package for .zst files, which is checked here, before
+    any table is truncated, rather than when the file is read.
+
+    :param file_path: Path to the JSON lines file, a directory of shards or a glob pattern
+    :param engine: One of ENGINES, the engine asked for
+    :return: The engine the file is loaded with
+    """
+    if engine == "duckdb" and not readable_by_duckdb(file_path):
+        logging.info(f"The DuckDB reader can't open {file_path}, using the python engine.")
+        engine = "python"
+    if engine != "duckdb" and zstandard is None:
+        for path in expand_input_paths(file_path):
+            if compression_of(split_input_path(path)[0]) == ".zst":
+                message = f"Reading {path} with the {engine} engine needs the zstandard package, install the 'zstd' extra."
+                logging.error(message)
+                raise ImportError(message)
+    return engine
+
+
+def load_file(file_path, table_name, engine=DEFAULT_ENGINE, streaming=False, batch_size=BATCH_SIZE,
+              num_threads=None, watermark=None):
+    """
+    Load the file into a table with the requested engine. When the DuckDB reader
+    rejects the file the python engine is used instead. Rows with an Id up to the
+    watermark are dropped as the file is parsed, so they are never staged. When the
+    table stores the Id as a number, "007" and "7" are the same Id and only the first is kept.
+
+    :param file_path: Path to the JSON lines file, a directory of shards or a glob pattern
+    :param table_name: Name of the table the rows are loaded into
+    :param engine: One of ENGINES
+    :param streaming: Use the streaming variant of the python engine
+    :param batch_size: Maximum number of rows per batch in the python engines
+    :param num_threads: Python workers, defaults to PARSE_WORKERS or NUM_THREADS per engine
+    :param watermark: Skip the rows with an Id up to this, loaded by an earlier run
+    :return: Number of rows inserted into the table
+    """
+    engine = choose_engine(file_path, engine)
+    typed = table_has_typed_key(table_name)
+    if engine == "duckdb":
+        try:
+            return insert_data_using_duckdb(file_path, table_name, watermark, typed)
+        except duckdb.Error as e:
+            logging.warning(f"DuckDB bulk load failed, falling back to the python engine. Error: {e}")
+
+    if engine == "parallel":
+        return insert_data_using_parallel_parse(file_path, table_name, num_threads or PARSE_WORKERS, watermark,
+                                                typed)
+    elif streaming:
+        return insert_data_streaming(file_path, batch_size, table_name, watermark, typed)
+    else:
+        with stage("fetch") as metrics:
+            fetched_data = fetch_data(file_path, with_line_info=True)
+            metrics["rows"] = len(fetched_data)
+        with stage("filter") as metrics:
+            filtered_data = filtered_and_formatted_data(fetched_data, watermark, typed)
+            metrics["rows"] = len(filtered_data)
+        with stage("insert") as metrics:
+            row_count = insert_data_using_multithreading(filtered_data, table_name, num_threads or NUM_THREADS,
+                                                         batch_size)
+            metrics["rows"] = row_count
+        return row_count
+
+
+def has_typed_key(table_schema):
+    """
+    Whether a table stores the primary key as TYPED_SCHEMA does, so keys are compared as numbers.
+
+    :param table_schema: Column types of the table, as returned by db.table_columns
+    """
+    return table_schema.get(PRIMARY_KEY) == TYPED_SCHEMA[PRIMARY_KEY]
+
+
+def table_has_typed_key(table_name):
+    """
+    Whether the table the rows are loaded into stores the primary key as a number.
+
+    :param table_name: Name of the table
+    :return: True for a typed table
+    """
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        return has_typed_key(db.table_columns(cursor, SCHEMA_NAME, table_name))
+    except Exception as e:
+        logging.error(f"Error while reading the columns of {SCHEMA_NAME}.{table_name}: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def get_watermark(cursor):
+    """
+    Return the highest Id loaded by the latest ingestion run.
+
+    :param cursor: Database cursor
+    :return: Watermark Id, or None before the first run
+    """
+    result = cursor.execute(f"""
+        SELECT MaxId FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} ORDER BY RunId DESC LIMIT 1
+    """).fetchone()
+    return result[0] if result else None
+
+
+def record_ingestion_run(cursor, mode, fingerprint, rows_inserted):
+    """
+    Record a run together with the new high-water mark of the votes table.
+
+    :param cursor: Database cursor
+    :param mode: "full" or "incremental"
+    :param fingerprint: Fingerprint of the ingested file
+    :param rows_inserted: Number of rows the run inserted
+    """
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA_NAME}.{RUNS_TABLE_NAME}
+        SELECT
+            (SELECT coalesce(max(RunId), 0) + 1 FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}),
+            ?,
+            ?,
+            max(TRY_CAST({PRIMARY_KEY} AS BIGINT)),
+            max(CreationDate),
+            ?,
+            current_timestamp
+        FROM {SCHEMA_NAME}.{TABLE_NAME}
+    """, [mode, fingerprint, rows_inserted])
+
+
+def merge_staged_data(fingerprint):
+    """
+    Upsert the staged rows beyond the watermark into the votes table and record the
+    run, all in one transaction. The load already skips the rows at or below the
+    watermark, the ones left, like Ids written "007", or staged before another run
+    moved the watermark, are deleted here. Only the weekly vote counts of the weeks
+    the replaced and merged rows fall in are updated. They are then marked up to
+    date with the new run, unless they were already stale before it.
+
+    :param fingerprint: Fingerprint of the ingested file
+    :return: Number of rows merged
+    """
+    cursor = None
+    staging = f"{SCHEMA_NAME}.{STAGING_TABLE_NAME}"
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        cursor.execute("BEGIN TRANSACTION")
+        watermark = get_watermark(cursor)
+        counts_stale = outliers.weekly_vote_counts_stale(cursor)
+        if watermark is not None:
+            cursor.execute(
+                f"DELETE FROM {staging} WHERE TRY_CAST({PRIMARY_KEY} AS BIGINT) <= ?", [watermark])
+        replaced = f"""(
+            SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME}
+            WHERE {PRIMARY_KEY} IN (SELECT {PRIMARY_KEY} FROM {staging})
+        )"""
+        outliers.add_weekly_vote_counts(cursor, replaced, sign=-1)
+        cursor.execute(f"""
+            DELETE FROM {SCHEMA_NAME}.{TABLE_NAME}
+            WHERE {PRIMARY_KEY} IN (SELECT {PRIMARY_KEY} FROM {staging})
+        """)
+        row_count = cursor.execute(
+            f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} SELECT * FROM {staging}").fetchone()[0]
+        outliers.add_weekly_vote_counts(cursor, staging)
+        record_ingestion_run(cursor, "incremental", fingerprint, row_count)
+        if not counts_stale:
+            outliers.stamp_vote_counts(cursor)
+        cursor.execute(f"DELETE FROM {staging}")
+        clear_checkpoint(cursor, fingerprint)
+        cursor.execute("COMMIT")
+        logging.info(f"Merged {row_count} rows beyond watermark {watermark} into {SCHEMA_NAME}.{TABLE_NAME}.")
+        return row_count
+
+    except Exception as e:
+        if cursor:
+            cursor.execute("ROLLBACK")
+        logging.error(f"Error while merging staged data: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def finish_full_load(fingerprint):
+    """
+    Record a full load so later incremental runs continue from its watermark, and
+    count the votes per week of the new table.
+
+    :param fingerprint: Fingerprint of the ingested file
+    :return: Number of rows in the votes table
+    """
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        cursor.execute("BEGIN TRANSACTION")
+        row_count = cursor.execute(
+            f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0]
+        record_ingestion_run(cursor, "full", fingerprint, row_count)
+        outliers.rebuild_weekly_vote_counts(cursor)
+        clear_checkpoint(cursor, fingerprint)
+        cursor.execute("COMMIT")
+        return row_count
+    except Exception as e:
+        if cursor:
+            cursor.execute("ROLLBACK")
+        logging.error(f"Error while recording the ingestion run: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def clear_checkpoint(cursor, fingerprint):
+    """
+    Drop the checkpoint of a load once its run is recorded.
+    """
+    cursor.execute(
+        f"DELETE FROM {SCHEMA_NAME}.{CHECKPOINTS_TABLE_NAME} WHERE FileFingerprint = ?", [fingerprint])
+
+
+def latest_watermark():
+    """
+    Read the watermark of the latest ingestion run, for an incremental load to
+    skip the rows an earlier run loaded.
+
+    :return: Watermark Id, or None before the first run
+    """
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        return get_watermark(cursor)
+    except Exception as e:
+        logging.error(f"Error while reading the ingestion watermark: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def already_ingested(fingerprint):
+    """
+    Check whether a file with this fingerprint was already ingested.
+
+    :param fingerprint: File fingerprint
+    :return: True if a previous run recorded the fingerprint
+    """
+    cursor = None
+    try:
+        cursor = db.pooled_cursor(DATABASE)
+        if not db.schema_exists(cursor, SCHEMA_NAME) or \
+                not db.table_exists(cursor, SCHEMA_NAME, RUNS_TABLE_NAME):
+            return False
+        result = cursor.execute(f"""
+            SELECT 1 FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} WHERE FileFingerprint = ? LIMIT 1
+        """, [fingerprint]).fetchone()
+        return result is not None
+    except Exception as e:
+        logging.error(f"Error while checking previous ingestion runs: {e}")
+        raise
+    finally:
+        if cursor:
+            db.close_connection(cursor)
+
+
+def ingest_file(file_path, engine=DEFAULT_ENGINE, streaming=False, batch_size=BATCH_SIZE,
+                incremental=False, num_threads=None, typed_schema=False, resumable=False):
+    """
+    Ingest the file into the votes table. A full load replaces the table, an
+    incremental load stages only the rows beyond the watermark of the previous
+    run and upserts them. A file that was already ingested is skipped in
+    incremental mode. A resumable load commits every batch with a checkpoint and
+    continues from the last one when the same file is ingested again.
+
+    :param file_path: Path to the JSON lines file, a directory of shards or a glob pattern
+    :param engine: One of ENGINES
+    :param streaming: Use the streaming variant of the python engine
+    :param batch_size: Maximum number of rows per batch in the python engines
+    :param incremental: Append to the votes table instead of reloading it
+    :param num_threads: Python workers, defaults to PARSE_WORKERS or NUM_THREADS per engine
+    :param typed_schema: Store the votes with TYPED_SCHEMA
+    :param resumable: Load in checkpointed segments with the python engine
+    """
+    with stage("fingerprint"):
+        fingerprint = file_fingerprint(file_path)
+    with stage("ddl"):
+        if incremental and already_ingested(fingerprint):
+            logging.info(f"{file_path} was already ingested, nothing to do.")
+            return
+
+        engine = choose_engine(file_path, "python" if resumable else engine)
+        table_name = STAGING_TABLE_NAME if incremental else TABLE_NAME
+        checkpoint = get_checkpoint(fingerprint, table_name) if resumable else None
+        pre_ingestion_db_activities(incremental, typed_schema, resume=checkpoint is not None)
+        watermark = latest_watermark() if incremental else None
+    with stage("load") as metrics:
+        if resumable:
+            metrics["rows"] = insert_data_checkpointed(file_path, fingerprint, batch_size, table_name, checkpoint,
+                                                       watermark)
+        else:
+            metrics["rows"] = load_file(file_path, table_name, engine, streaming, batch_size, num_threads,
+                                        watermark)
+    if incremental:
+        with stage("merge") as metrics:
+            metrics["rows"] = merge_staged_data(fingerprint)
+    else:
+        with stage("finish") as metrics:
+            metrics["rows"] = finish_full_load(fingerprint)
+
+
+def estimate_row_count(file_path, sample_bytes=CHUNK_SIZE_8_MIB):
+    """
+    Estimate the number of lines in a file from the average line length of its
+    first bytes, without reading the whole file. For a compressed file the lines
+    are counted per compressed byte read.
+
+    :param file_path: Path to the JSON lines file
+    :param sample_bytes: Number of (decompressed) bytes sampled from the start of the file
+    :return: Estimated number of lines
+    """
+    paths = expand_input_paths(file_path)
+    if len(paths) > 1:
+        return sum(estimate_row_count(path, sample_bytes) for path in paths)
+    path, member = split_input_path(paths[0])
+    size = os.path.getsize(path)
+    with open(path, "rb") as raw, decompressing_reader(raw, path, member) as file:
+        sample = file.read(sample_bytes)
+        consumed = raw.tell()
+    lines = sample.count(b"\n")
+    if lines == 0:
+        return 1 if size else 0
+    return size * lines // consumed
+
+
+def physical_memory_bytes():
+    """
+    Return the physical memory of the host, or None where the OS doesn't expose it.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def auto_tune(file_path):
+    """
+    Pick thread counts, batch size and memory limit from the cores available and the
+    size of the input file. Batches are sized so every thread gets several of them, but
+    never so small that per-batch overhead dominates or so large that one batch
+    holds a big file in memory.
+
+    :param file_path: Path to the JSON lines file
+    :return: Dictionary of setting name to value
+    """
+    cores = CPU_CORES
+    rows_per_thread = estimate_row_count(file_path) // (cores * 4)
+    batch_size = min(AUTO_TUNE_MAX_BATCH_SIZE, max(AUTO_TUNE_MIN_BATCH_SIZE, rows_per_thread))
+    memory = physical_memory_bytes()
+    memory_limit = f"{int(memory * AUTO_TUNE_MEMORY_FRACTION) // (1024 * 1024)}MB" if memory else None
+    settings = {
+        "threads": cores,
+        "batch_size": batch_size,
+        "duckdb_threads": cores,
+        "memory_limit": memory_limit,
+    }
+    logging.info(f"Auto-tuned ingestion settings: {settings}")
+    return settings
+
+
+def resolve_settings(args):
+    """
+    Combine the tuning settings from the command line, the environment and, when
+    requested, auto-tuning. Explicit values always win over auto-tuned ones.
+
+    :param args: Parsed arguments namespace
+    :return: Dictionary of setting name to value, None where DuckDB's default applies
+    """
+    settings = {
+        "threads": None,
+        "batch_size": BATCH_SIZE,
+        "duckdb_threads": None,
+        "memory_limit": None,
+        "temp_directory": None,
+    }
+    if args.auto_tune:
+        settings.update(auto_tune(args.file_path))
+    for name in settings:
+        value = getattr(args, name)
+        if value is not None:
+            settings[name] = value
+    return settings
+
+
+def env_default(name):
+    """
+    Default value of a command-line option taken from its SETTING_ENV_VARS entry.
+    """
+    return os.environ.get(SETTING_ENV_VARS[name])
+
+
+def positive_int(value):
+    """
+    Argument type for options that only accept a positive integer.
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def parse_arguments(argv):
+    """
+    Parse the command-line arguments of the ingestion process.
+
+    :param argv: List of command-line arguments without the program name
+    :return: Parsed arguments namespace
+    """
+    parser = argparse.ArgumentParser(description="Ingest vote data into DuckDB.")
+    parser.add_argument("file_path", help="Path to the JSON lines file to ingest, optionally compressed "
+                                          "(.gz, .bz2, .zst) or a tarball member (archive.tar.gz::votes.jsonl). "
+                                          "A directory or quoted glob pattern ingests every shard it names.")
+    parser.add_argument("--engine", choices=ENGINES, default=None,
+                        help=f"Ingestion engine, defaults to {DEFAULT_ENGINE} unless --streaming is set")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Insert the file in bounded-size batches while reading it (python engine). "
+                             "The seen Ids are still held in memory, sparse or non-integer ones at 65 to 90 "
+                             "bytes each; use the duckdb engine for key spaces that don't fit")
+    parser.add_argument("--batch-size", type=positive_int, default=env_default("batch_size"),
+                        help=f"Maximum number of rows per batch in the python engines (default {BATCH_SIZE})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Append rows beyond the last watermark instead of reloading the table")
+    parser.add_argument("--threads", type=positive_int, default=env_default("threads"),
+                        help="Python worker threads or processes used by the python and parallel engines")
+    parser.add_argument("--duckdb-threads", type=positive_int, default=env_default("duckdb_threads"),
+                        help="Value of DuckDB's threads setting")
+    parser.add_argument("--memory-limit", default=env_default("memory_limit"),
+                        help="Value of DuckDB's memory_limit setting, e.g. 4GB")
+    parser.add_argument("--temp-directory", default=env_default("temp_directory"),
+                        help="Directory DuckDB spills to when it runs over the memory limit")
+    parser.add_argument("--resumable", action="store_true",
+                        help="Commit every batch with a checkpoint and resume an interrupted load of the same file")
+    parser.add_argument("--typed-schema", action="store_true",
+                        help="Store ids as BIGINT and VoteTypeId as UTINYINT, migrating an existing table")
+    parser.add_argument("--auto-tune", action="store_true",
+                        default=env_default("auto_tune") in ("1", "true", "yes"),
+                        help="Pick unset tuning values from the CPU count and the file size")
+    parser.add_argument("--query-log", default=None,
+                        help="Append the wall time and row count of every SQL statement to this JSON lines file")
+    parser.add_argument("--explain-analyze", action="store_true",
+                        help="Also record DuckDB's EXPLAIN ANALYZE profile of every statement in the query log")
+    parser.add_argument("--stage-report", default=None,
+                        help="Write the wall time, CPU time, peak RSS and rows per second of every stage to this JSON file")
+    args = parser.parse_args(argv)
+    if args.engine is None:
+        args.engine = "python" if args.streaming else DEFAULT_ENGINE
+    return args
+
+
 def main():
     """
     Main function to fetch data, process it, and perform database operations.
+    The metrics of every stage are logged as JSON at the end of the run.
     """
+    args = None
+    STAGE_REPORT.clear()
     try:
-        fetched_data = fetch_data()
-        filtered_data = filtered_and_formatted_data(fetched_data)
-        pre_ingestion_db_activities()
-        insert_data_using_multithreading(filtered_data)
+        args = parse_arguments(sys.argv[1:])
+        settings = resolve_settings(args)
+        db.configure_database(DATABASE, {
+            "threads": settings["duckdb_threads"],
+            "memory_limit": settings["memory_limit"],
+            "temp_directory": settings["temp_directory"],
+        })
+        db.configure_instrumentation(args.query_log is not None or args.explain_analyze,
+                                     args.explain_analyze, args.query_log)
+        ingest_file(args.file_path, args.engine, args.streaming, settings["batch_size"],
+                    args.incremental, settings["threads"], args.typed_schema, args.resumable)
 
     except Exception as e:
         logging.error(f"An error occurred in the main function: {e}")
+    finally:
+        db.close_pool(DATABASE)
+        db.configure_instrumentation(False)
+        if STAGE_REPORT:
+            write_stage_report(args.stage_report if args else None)
+
+
+def write_stage_report(path=None):
+    """
+    Log the stage report as JSON and write it to a file.
+
+    :param path: Path of the JSON file the report is written to, None to only log it
+    """
+    report = json.dumps(stage_report())
+    logging.info(f"Stage report: {report}")
+    if path:
+        with open(path, "w") as file:
+            file.write(report + "\n")
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import argparse
 import logging
 import sys
 
@@ -18,88 +19,953 @@ TABLE_NAME = "votes"  # Name of the table to be created
 SCHEMA_NAME = "blog_analysis"
 PERCENT_OUTLIERS = 0.2
 VIEW_NAME = "outlier_weeks"
+RUNS_TABLE_NAME = "ingestion_runs"  # Written by the ingestion, one row per run
+MATERIALISED_TABLE_NAME = "outlier_weeks_materialised"  # The view's rows, stored in materialised mode
+VERSION_TABLE_NAME = "outlier_weeks_version"  # What the materialised rows were computed from
+VERSION_SCHEMA = {
+    "RunId": "INTEGER",
+    "VoteTotal": "BIGINT",
+    "Method": "STRING",
+    "Threshold": "DOUBLE",
+    "RollingWeeks": "INTEGER",
+    "ComputedAt": "DATETIME"
+}
+WEEKLY_COUNTS_TABLE_NAME = "weekly_vote_counts"  # Votes per week, kept up to date by the ingestion
+WEEKLY_COUNTS_SCHEMA = {
+    "Year": "STRING",
+    "WeekNumber": "INTEGER",
+    "VoteCount": "BIGINT"
+}
+ROLLING_BASELINE_TABLE_NAME = "weekly_rolling_baseline"  # Trailing mean of every week, per window length
+ROLLING_BASELINE_SCHEMA = {
+    "RollingWeeks": "INTEGER",
+    "Year": "STRING",
+    "WeekNumber": "INTEGER",
+    "VoteCount": "BIGINT",
+    "RollingMeanVoteCount": "DOUBLE"
+}
+DAILY_COUNTS_TABLE_NAME = "daily_vote_counts"  # Votes per day, every granularity is rolled up from it
+DAILY_COUNTS_SCHEMA = {
+    "Day": "DATE",
+    "VoteCount": "BIGINT"
+}
+COUNTS_VERSION_TABLE_NAME = "vote_counts_version"  # Ingestion run the daily and weekly counts are up to date with
+COUNTS_VERSION_SCHEMA = {
+    "RunId": "INTEGER",
+    "CountedAt": "DATETIME"
+}
 ORDER_BY_COLUMNS = "Year,WeekNumber"
-OUTLIER_QUERY = f"""CREATE OR REPLACE VIEW {SCHEMA_NAME}.{VIEW_NAME}
-AS
-WITH week_data as (
+GRANULARITIES = ("week", "isoweek", "day", "month")
+DEFAULT_GRANULARITY = "week"  # The exercise's %W weeks, which restart at week 0 every new year
+GRANULARITY_PERIODS = {
+    "week": ("WeekNumber", "year(Day)", "(dayofyear(Day) + 7 - isodow(Day)) // 7"),
+    "isoweek": ("WeekNumber", "isoyear(Day)", "week(Day)"),
+    "day": ("Day", "year(Day)", "Day"),
+    "month": ("MonthNumber", "year(Day)", "month(Day)")
+}  # Period column of each granularity, and the year and period a Day falls in
+VIEW_NAMES = {
+    "week": VIEW_NAME,
+    "isoweek": "outlier_isoweeks",
+    "day": "outlier_days",
+    "month": "outlier_months"
+}
+GROUP_COLUMNS = ("PostId", "VoteTypeId")  # Columns the votes can be partitioned by, each group has its own baseline
+GROUP_BUCKET_ROWS = 250000  # Group periods the grouped engine scores at once, bounds its working memory
+GROUPED_COUNTS_TABLE_NAME = "grouped_period_counts"  # Temp table, votes per group and period of one bucket
+GROUPED_STATS_TABLE_NAME = "grouped_period_stats"  # Temp table, statistics of the groups of one bucket
+GROUPED_SCORES_TABLE_NAME = "grouped_outlier_scores"  # Temp table, scores of every group read by detect_outliers
+ENGINES = ("group_by", "window")  # group_by aggregates once, window is the original per-row plan
+DEFAULT_ENGINE = "group_by"
+METHODS = ("mean", "zscore", "iqr", "mad", "rolling")
+DEFAULT_METHOD = "mean"  # The exercise's rule, relative deviation from the mean of all weeks
+DEFAULT_THRESHOLDS = {
+    "mean": PERCENT_OUTLIERS,
+    "zscore": 3.0,
+    "iqr": 1.5,
+    "mad": 3.5,
+    "rolling": PERCENT_OUTLIERS
+}  # A week is an outlier when its score for the method is above the threshold
+ROLLING_WEEKS = 8  # Trailing weeks the rolling method compares each week against
+OUTLIER_SCORES = {
+    "mean": "abs(round(1 - (VoteCount / MeanVoteCount), 2))",
+    "zscore": "abs(VoteCount - AvgVoteCount) / nullif(StddevVoteCount, 0)",
+    "iqr": "greatest(Q1VoteCount - VoteCount, VoteCount - Q3VoteCount) / nullif(Q3VoteCount - Q1VoteCount, 0)",
+    "mad": "0.6745 * abs(VoteCount - MedianVoteCount) / nullif(MadVoteCount, 0)",
+    "rolling": "abs(round(1 - (VoteCount / RollingMeanVoteCount), 2))"
+}  # How far a week is from the baseline of each method
+
+
+def period_column(granularity=DEFAULT_GRANULARITY):
+    """
+    Column numbering the periods of a granularity within their Year.
+
+    :param granularity: One of GRANULARITIES
+    :return: Column name
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {GRANULARITIES}")
+    return GRANULARITY_PERIODS[granularity][0]
+
+
+def group_columns(group_by=()):
+    """
+    Validate the columns to partition the votes by and put them in GROUP_COLUMNS order.
+
+    :param group_by: Some of GROUP_COLUMNS, empty for no partitioning
+    :return: List of column names
+    """
+    unknown = [column for column in group_by if column not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown group column {unknown}, expected some of {GROUP_COLUMNS}")
+    return [column for column in GROUP_COLUMNS if column in group_by]
+
+
+def period_counts_query(granularity=DEFAULT_GRANULARITY, source=f"{SCHEMA_NAME}.{DAILY_COUNTS_TABLE_NAME}",
+                        group_by=()):
+    """
+    Build the query rolling the daily vote counts up into periods. The ISO weeks
+    are numbered within their ISO year, so the days of a week that straddles the
+    new year are counted together, e.g. 2021-01-01 is in week 53 of 2020.
+
+    :param granularity: One of GRANULARITIES
+    :param source: Table name or parenthesised SELECT with the Day and VoteCount columns
+    :param group_by: Columns of the source to count per, from GROUP_COLUMNS
+    :return: SELECT query string with the group columns, Year, the period column and VoteCount
+    """
+    column = period_column(granularity)
+    _, year, period = GRANULARITY_PERIODS[granularity]
+    keys = "".join([f"{key}, " for key in group_columns(group_by)])
+    return f"""
+            SELECT {keys}CAST({year} AS VARCHAR) AS Year, {period} AS {column}, CAST(sum(VoteCount) AS BIGINT) AS VoteCount
+            FROM {source}
+            GROUP BY ALL
+        """
+
+
+def outlier_scores_query(methods=METHODS, rolling_weeks=ROLLING_WEEKS, granularity=DEFAULT_GRANULARITY):
+    """
+    Build the query scoring every period with the given methods in a single pass
+    over the vote counts. The statistics of all periods are aggregated once and
+    joined back to each period, so adding methods adds columns rather than scans.
+
+    Weeks are read from the weekly counts and their rolling baseline from its
+    table. The other granularities are rolled up from the daily counts and their
+    rolling baseline is a window over the rolled up periods.
+
+    :param methods: Methods to score the periods with, from METHODS
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param granularity: One of GRANULARITIES
+    :return: SELECT query string with Year, the period column, VoteCount and a <method>_score column per method
+    """
+    validate_settings(methods, rolling_weeks)
+    column = period_column(granularity)
+    if granularity != DEFAULT_GRANULARITY:
+        period_counts = f"({period_counts_query(granularity)})"
+        if "rolling" in methods:
+            period_counts = f"""(
 SELECT
-Id,
-PostId,
-VoteTypeId,
-strftime(CreationDate, '%Y-%m-%d') as CreationDate,
-strftime(MIN(CreationDate) over(), '%Y-%m-%d') AS MinDate,
-strftime(CreationDate, '%Y') as Year,
-CAST(strftime('%W', CreationDate) as INTEGER) AS WeekNumber
+*,
+{rolling_mean(rolling_weeks, granularity)} AS RollingMeanVoteCount
 FROM
-{SCHEMA_NAME}.{TABLE_NAME}
-),
-count_votes_per_week AS (
+{period_counts}
+)"""
+    else:
+        period_counts = f"{SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}"
+        if "rolling" in methods:
+            period_counts = f"""{period_counts}
+LEFT JOIN (
+SELECT Year, WeekNumber, RollingMeanVoteCount
+FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME}
+WHERE RollingWeeks = {int(rolling_weeks)}
+) USING (Year, WeekNumber)"""
+    return f"""WITH period_counts AS (
 SELECT
-DISTINCT
-Year,
-WeekNumber,
-count(CreationDate) over (partition by Year, WeekNumber) as VoteCount
+*
 FROM
-week_data
+{period_counts}
 ),
-mean_count AS (
+all_periods AS (
 SELECT
-Year,
-WeekNumber,
-VoteCount,
-round(avg(VoteCount) over()) as MeanVoteCount
+round(avg(VoteCount)) AS MeanVoteCount,
+avg(VoteCount) AS AvgVoteCount,
+stddev_pop(VoteCount) AS StddevVoteCount,
+quantile_cont(VoteCount, 0.25) AS Q1VoteCount,
+median(VoteCount) AS MedianVoteCount,
+quantile_cont(VoteCount, 0.75) AS Q3VoteCount
 FROM
-count_votes_per_week
+period_counts
 ),
-percent_diff AS (
+median_deviation AS (
 SELECT
-*,
-abs(round(1 -(VoteCount / MeanVoteCount), 2)) as percent_diffrence
+median(abs(VoteCount - MedianVoteCount)) AS MadVoteCount
 FROM
-mean_count
+period_counts, all_periods
 )
 SELECT
 Year,
-WeekNumber,
-VoteCount
+{column},
+VoteCount,
+{score_columns(methods)}
 FROM
-percent_diff
-WHERE percent_diffrence > {PERCENT_OUTLIERS}
-ORDER BY {ORDER_BY_COLUMNS}
+period_counts, all_periods, median_deviation
 """
 
 
-def create_outliers_view(cursor):
+def validate_settings(methods, rolling_weeks):
+    """
+    Check the methods and rolling window length before building a query from them.
+
+    :param methods: Methods to score the periods with, from METHODS
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    """
+    unknown = [method for method in methods if method not in METHODS]
+    if unknown:
+        raise ValueError(f"Unknown outlier method {unknown}, expected some of {METHODS}")
+    if rolling_weeks <= 0:
+        raise ValueError(f"The rolling baseline needs at least one week, got {rolling_weeks}")
+
+
+def score_columns(methods):
+    """
+    Select list of the <method>_score columns, from the statistics the methods need.
+
+    :param methods: Methods to score the periods with, from METHODS
+    :return: Comma separated SQL expressions
+    """
+    return ",\n".join([f"{OUTLIER_SCORES[method]} AS {method}_score" for method in methods])
+
+
+def rolling_mean(rolling_weeks=ROLLING_WEEKS, granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Window expression of the mean of the `rolling_weeks` periods before each period.
+
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns whose groups each have their own baseline, from GROUP_COLUMNS
+    :return: SQL expression
+    """
+    partition = f"PARTITION BY {', '.join(group_columns(group_by))} " if group_by else ""
+    return f"""round(avg(VoteCount) over ({partition}ORDER BY Year, {period_column(granularity)}
+ROWS BETWEEN {int(rolling_weeks)} PRECEDING AND 1 PRECEDING))"""
+
+
+def resolve_thresholds(thresholds=None):
+    """
+    Fill the thresholds that weren't given with DEFAULT_THRESHOLDS.
+
+    :param thresholds: Dictionary of method to threshold, may be partial or None
+    :return: Dictionary with a threshold for every method
+    """
+    unknown = [method for method in (thresholds or {}) if method not in METHODS]
+    if unknown:
+        raise ValueError(f"Unknown outlier method {unknown}, expected some of {METHODS}")
+    resolved = dict(DEFAULT_THRESHOLDS)
+    resolved.update({method: value for method, value in (thresholds or {}).items() if value is not None})
+    for method, value in resolved.items():
+        if value <= 0:
+            raise ValueError(f"The {method} threshold must be positive, got {value}")
+    return resolved
+
+
+def order_by_columns(granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Columns the periods of a granularity are ordered by, within their group.
+
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns the votes are partitioned by, from GROUP_COLUMNS
+    :return: Comma separated column names
+    """
+    return ",".join(group_columns(group_by) + ["Year", period_column(granularity)])
+
+
+def outliers_view_name(granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Name of the outliers view of a granularity, suffixed with the group columns,
+    e.g. outlier_weeks_by_postid_votetypeid.
+
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns the votes are partitioned by, from GROUP_COLUMNS
+    :return: View name
+    """
+    period_column(granularity)
+    keys = group_columns(group_by)
+    suffix = f"_by_{'_'.join(keys).lower()}" if keys else ""
+    return f"{VIEW_NAMES[granularity]}{suffix}"
+
+
+def outlier_select_query(method=DEFAULT_METHOD, threshold=None, rolling_weeks=ROLLING_WEEKS,
+                         granularity=DEFAULT_GRANULARITY):
     """
-    Create a view for detecting outliers in the votes data.
+    Build the query selecting the outlier periods of one method.
+
+    :param method: One of METHODS
+    :param threshold: Score above which a period is an outlier, defaults to DEFAULT_THRESHOLDS
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param granularity: One of GRANULARITIES
+    :return: SELECT query string with the Year, period and VoteCount columns
+    """
+    threshold = resolve_thresholds({method: threshold})[method]
+    return f"""SELECT
+Year,
+{period_column(granularity)},
+VoteCount
+FROM (
+{outlier_scores_query([method], rolling_weeks, granularity)}
+)
+WHERE {method}_score > {threshold}
+ORDER BY {order_by_columns(granularity)}
+"""
+
+
+def outlier_query(method=DEFAULT_METHOD, threshold=None, rolling_weeks=ROLLING_WEEKS,
+                  granularity=DEFAULT_GRANULARITY):
+    """
+    Build the statement creating the outliers view of a granularity with one
+    method, outlier_weeks for the default weeks.
+
+    :param method: One of METHODS
+    :param threshold: Score above which a period is an outlier, defaults to DEFAULT_THRESHOLDS
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param granularity: One of GRANULARITIES
+    :return: CREATE VIEW statement
+    """
+    select_query = outlier_select_query(method, threshold, rolling_weeks, granularity)
+    return f"""CREATE OR REPLACE VIEW {SCHEMA_NAME}.{VIEW_NAMES[granularity]}
+AS
+{select_query}"""
+
+
+OUTLIER_QUERY = outlier_query()
+
+
+def create_weekly_vote_counts(cursor):
+    """
+    Create the daily and weekly vote counts, rolling baseline and counts version
+    tables if they don't exist yet.
 
     :param cursor: Database cursor
-    :return: True if the view is created successfully, False otherwise
     """
+    db.create_table(cursor, DATABASE, SCHEMA_NAME, DAILY_COUNTS_TABLE_NAME, DAILY_COUNTS_SCHEMA,
+                    primary_key=None)
+    db.create_table(cursor, DATABASE, SCHEMA_NAME, WEEKLY_COUNTS_TABLE_NAME, WEEKLY_COUNTS_SCHEMA,
+                    primary_key=None)
+    db.create_table(cursor, DATABASE, SCHEMA_NAME, ROLLING_BASELINE_TABLE_NAME, ROLLING_BASELINE_SCHEMA,
+                    primary_key=None)
+    db.create_table(cursor, DATABASE, SCHEMA_NAME, COUNTS_VERSION_TABLE_NAME, COUNTS_VERSION_SCHEMA,
+                    primary_key=None)
+
+
+def latest_run_id(cursor):
+    """
+    RunId of the latest ingestion run.
+
+    :param cursor: Database cursor
+    :return: RunId, or None before the first run
+    """
+    if not db.table_exists(cursor, SCHEMA_NAME, RUNS_TABLE_NAME):
+        return None
+    return cursor.execute(f"SELECT max(RunId) FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}").fetchone()[0]
+
+
+def stamp_vote_counts(cursor):
+    """
+    Record that the daily and weekly counts are up to date with the latest
+    ingestion run. The ingestion calls this in the transaction that records the run.
+
+    :param cursor: Database cursor
+    """
+    cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{COUNTS_VERSION_TABLE_NAME}")
+    cursor.execute(f"INSERT INTO {SCHEMA_NAME}.{COUNTS_VERSION_TABLE_NAME} VALUES (?, current_timestamp)",
+                   [latest_run_id(cursor)])
+
+
+def clear_vote_counts_version(cursor):
+    """
+    Mark the daily and weekly counts as stale, e.g. when a full load is about to
+    replace the votes, so they are recounted if the load doesn't finish.
+
+    :param cursor: Database cursor
+    """
+    cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{COUNTS_VERSION_TABLE_NAME}")
+
+
+def update_rolling_baseline(cursor, rolling_weeks=ROLLING_WEEKS, first_week=None):
+    """
+    Recompute the trailing mean of the weeks from `first_week` on. A week's mean
+    only depends on the weeks before it, so when weeks are appended or changed
+    only the tail from the first changed week is rewritten. The window reads just
+    that tail and the `rolling_weeks` weeks before it.
+
+    :param cursor: Database cursor
+    :param rolling_weeks: Number of trailing weeks in the baseline
+    :param first_week: Tuple of the Year and WeekNumber of the first changed week, None for every week
+    """
+    counts_table = f"{SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}"
+    baseline_table = f"{SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME}"
+    year, week = first_week or ("", 0)
+    in_tail = "(Year > ? OR (Year = ? AND WeekNumber >= ?))"
+    try:
+        cursor.execute(f"DELETE FROM {baseline_table} WHERE RollingWeeks = ? AND {in_tail}",
+                       [rolling_weeks, year, year, week])
+        cursor.execute(f"""
+            INSERT INTO {baseline_table}
+            SELECT * FROM (
+                SELECT
+                    {int(rolling_weeks)} AS RollingWeeks, Year, WeekNumber, VoteCount,
+                    round(avg(VoteCount) over (ORDER BY Year, WeekNumber
+                        ROWS BETWEEN {int(rolling_weeks)} PRECEDING AND 1 PRECEDING)) AS RollingMeanVoteCount
+                FROM (
+                    (SELECT * FROM {counts_table} WHERE NOT {in_tail}
+                     ORDER BY Year DESC, WeekNumber DESC LIMIT {int(rolling_weeks)})
+                    UNION ALL
+                    SELECT * FROM {counts_table} WHERE {in_tail}
+                )
+            )
+            WHERE {in_tail}
+        """, [year, year, week] * 3)
+    except Exception as e:
+        logger.error(f"Error while updating {baseline_table} from week {first_week}. Error: {e}")
+        raise
+
+
+def rolling_baseline_lengths(cursor):
+    """
+    Window lengths the rolling baseline is kept for.
+
+    :param cursor: Database cursor
+    :return: List of numbers of trailing weeks
+    """
+    if not db.table_exists(cursor, SCHEMA_NAME, ROLLING_BASELINE_TABLE_NAME):
+        return []
+    return [row[0] for row in cursor.execute(
+        f"SELECT DISTINCT RollingWeeks FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME}").fetchall()]
+
+
+def rolling_baseline_stale(cursor, rolling_weeks=ROLLING_WEEKS):
+    """
+    Check whether the rolling baseline of this window length covers exactly the
+    weeks and votes of the weekly counts.
+
+    :param cursor: Database cursor
+    :param rolling_weeks: Number of trailing weeks in the baseline
+    :return: True if the baseline is missing or out of step with the weekly counts
+    """
+    if not db.table_exists(cursor, SCHEMA_NAME, ROLLING_BASELINE_TABLE_NAME):
+        return True
+    summary = "count(*), coalesce(sum(VoteCount), 0)"
+    baseline = cursor.execute(f"""
+        SELECT {summary} FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME} WHERE RollingWeeks = ?
+    """, [rolling_weeks]).fetchone()
+    counts = cursor.execute(f"SELECT {summary} FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}").fetchone()
+    return baseline != counts
+
+
+def weekly_counts_query(source, engine=DEFAULT_ENGINE):
+    """
+    Build the query counting the votes of each week, Year as text and WeekNumber
+    as the Monday-based week of the year, like strftime's %W.
+
+    The group_by engine hashes on the integer year and week, computed from the
+    day of the year and the ISO weekday, and formats only one Year per week. The
+    window engine is the original plan: every row is formatted with strftime, gets
+    a windowed count of its week and DISTINCT folds the rows back into weeks.
+
+    :param source: Table name or parenthesised SELECT with a CreationDate column
+    :param engine: One of ENGINES
+    :return: SELECT query string with the Year, WeekNumber and VoteCount columns
+    """
+    if engine == "group_by":
+        return f"""
+            SELECT CAST(Year AS VARCHAR) AS Year, WeekNumber, VoteCount
+            FROM (
+                SELECT year(CreationDate) AS Year, (dayofyear(CreationDate) + 7 - isodow(CreationDate)) // 7 AS WeekNumber,
+                    count(CreationDate) AS VoteCount
+                FROM {source}
+                GROUP BY 1, 2
+            )
+        """
+    if engine == "window":
+        return f"""
+            WITH week_data AS (
+                SELECT
+                    strftime(CreationDate, '%Y-%m-%d') AS CreationDate,
+                    strftime(MIN(CreationDate) over(), '%Y-%m-%d') AS MinDate,
+                    strftime(CreationDate, '%Y') AS Year,
+                    CAST(strftime('%W', CreationDate) AS INTEGER) AS WeekNumber
+                FROM {source}
+            )
+            SELECT DISTINCT Year, WeekNumber, count(CreationDate) over (partition by Year, WeekNumber) AS VoteCount
+            FROM week_data
+        """
+    raise ValueError(f"Unknown outlier engine '{engine}', expected one of {ENGINES}")
+
+
+def merge_vote_counts(cursor, counts_table, delta_table, keys):
+    """
+    Add the counts of a delta table to a counts table, dropping the rows whose
+    count falls to zero. Both tables hold one row per period, so this is cheap.
+
+    :param cursor: Database cursor
+    :param counts_table: Qualified name of the table to update
+    :param delta_table: Name of the table with the counts to add, negative to take them out
+    :param keys: Comma separated columns identifying a period
+    """
+    merged_table = f"{delta_table}_merged"
+    cursor.execute(f"""
+        CREATE OR REPLACE TEMP TABLE {merged_table} AS
+        SELECT {keys}, CAST(sum(VoteCount) AS BIGINT) AS VoteCount
+        FROM (
+            SELECT {keys}, VoteCount FROM {counts_table}
+            UNION ALL
+            SELECT {keys}, VoteCount FROM {delta_table}
+        )
+        GROUP BY {keys}
+        HAVING sum(VoteCount) > 0
+    """)
+    cursor.execute(f"DELETE FROM {counts_table}")
+    cursor.execute(f"INSERT INTO {counts_table} SELECT * FROM {merged_table}")
+    cursor.execute(f"DROP TABLE {merged_table}")
+
+
+def add_weekly_vote_counts(cursor, source, sign=1, engine=DEFAULT_ENGINE):
+    """
+    Fold the votes of a table or subquery into the daily and weekly counts, only
+    the days and weeks those votes fall in change. With a negative sign the votes
+    are taken out again, e.g. before they are replaced, and days and weeks left
+    without votes are dropped. The source is read once into per day counts, which
+    the group_by engine rolls up into weeks, so this costs O(days) on top of
+    reading the source. The rolling baselines are recomputed from the first week
+    that changed on.
+
+    :param cursor: Database cursor
+    :param source: Table name or parenthesised SELECT with a CreationDate column
+    :param sign: 1 to add the votes, -1 to remove them
+    :param engine: One of ENGINES
+    """
+    counts_table = f"{SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}"
+    daily_delta_table = f"{DAILY_COUNTS_TABLE_NAME}_delta"
+    delta_table = f"{WEEKLY_COUNTS_TABLE_NAME}_delta"
     try:
-        if db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME):
-            logger.info(
-                f"{SCHEMA_NAME}.{TABLE_NAME} table exists. Proceeding to create the outliers view")
-            cursor.execute(OUTLIER_QUERY)
+        cursor.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {daily_delta_table} AS
+            SELECT CAST(CreationDate AS DATE) AS Day, {sign} * count(CreationDate) AS VoteCount
+            FROM {source}
+            WHERE CreationDate IS NOT NULL
+            GROUP BY 1
+        """)
+        if engine == "group_by":
+            weekly_delta = period_counts_query("week", daily_delta_table)
+        else:
+            weekly_delta = f"SELECT Year, WeekNumber, {sign} * VoteCount AS VoteCount " \
+                           f"FROM ({weekly_counts_query(source, engine)})"
+        cursor.execute(f"CREATE OR REPLACE TEMP TABLE {delta_table} AS {weekly_delta}")
+        merge_vote_counts(cursor, f"{SCHEMA_NAME}.{DAILY_COUNTS_TABLE_NAME}", daily_delta_table, "Day")
+        merge_vote_counts(cursor, counts_table, delta_table, "Year, WeekNumber")
+        first_week = cursor.execute(f"""
+            SELECT Year, WeekNumber FROM {delta_table} WHERE VoteCount <> 0 ORDER BY Year, WeekNumber LIMIT 1
+        """).fetchone()
+        cursor.execute(f"DROP TABLE {delta_table}")
+        cursor.execute(f"DROP TABLE {daily_delta_table}")
+        if first_week:
+            for rolling_weeks in rolling_baseline_lengths(cursor):
+                update_rolling_baseline(cursor, rolling_weeks, first_week)
+    except Exception as e:
+        logger.error(f"Error while updating {counts_table} from {source}. Error: {e}")
+        raise
+
+
+def rebuild_weekly_vote_counts(cursor, engine=DEFAULT_ENGINE):
+    """
+    Recount the votes of every day and week from scratch, and the rolling
+    baselines of every window length kept so far.
+
+    :param cursor: Database cursor
+    :param engine: One of ENGINES
+    """
+    create_weekly_vote_counts(cursor)
+    lengths = {ROLLING_WEEKS, *rolling_baseline_lengths(cursor)}
+    cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{DAILY_COUNTS_TABLE_NAME}")
+    cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}")
+    cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME}")
+    add_weekly_vote_counts(cursor, f"{SCHEMA_NAME}.{TABLE_NAME}", engine=engine)
+    for rolling_weeks in sorted(lengths):
+        update_rolling_baseline(cursor, rolling_weeks)
+    stamp_vote_counts(cursor)
+    logger.info(f"Rebuilt {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME} from {SCHEMA_NAME}.{TABLE_NAME}.")
+
+
+def weekly_vote_counts_stale(cursor, verify_counts=False):
+    """
+    Check whether the daily and weekly counts are up to date with the latest
+    ingestion run and still add up to the same total, which only reads the
+    counts, so it costs O(days) however many votes there are. The ingestion
+    keeps the counts in sync with the votes, so they only need recounting when
+    an ingestion didn't finish. With `verify_counts` the totals are also checked
+    against a count of the votes, to catch votes changed outside the ingestion.
+
+    :param cursor: Database cursor
+    :param verify_counts: Also count the votes, which costs O(votes)
+    :return: True if a counts table is missing, its version is off or its total is off
+    """
+    for counts_table in (DAILY_COUNTS_TABLE_NAME, WEEKLY_COUNTS_TABLE_NAME, COUNTS_VERSION_TABLE_NAME):
+        if not db.table_exists(cursor, SCHEMA_NAME, counts_table):
             return True
+    version = cursor.execute(f"SELECT RunId FROM {SCHEMA_NAME}.{COUNTS_VERSION_TABLE_NAME}").fetchall()
+    if version != [(latest_run_id(cursor),)]:
+        return True
+    total = f"(SELECT count(CreationDate) FROM {SCHEMA_NAME}.{TABLE_NAME})" if verify_counts else "NULL"
+    daily, weekly, total = cursor.execute(f"""
+        SELECT
+            (SELECT coalesce(sum(VoteCount), 0) FROM {SCHEMA_NAME}.{DAILY_COUNTS_TABLE_NAME}),
+            (SELECT coalesce(sum(VoteCount), 0) FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}),
+            {total}
+    """).fetchone()
+    return daily != weekly or (verify_counts and weekly != total)
+
+
+def refresh_weekly_vote_counts(cursor, engine=DEFAULT_ENGINE, rolling_weeks=None, granularity=DEFAULT_GRANULARITY,
+                               verify_counts=False):
+    """
+    Recount the daily and weekly votes if they are stale, and compute the rolling
+    baseline of a window length that isn't kept yet. Only weeks keep their rolling
+    baseline in a table, the other granularities compute it when read.
+
+    :param cursor: Database cursor
+    :param engine: One of ENGINES
+    :param rolling_weeks: Number of trailing weeks of the rolling baseline needed, None if it isn't
+    :param granularity: One of GRANULARITIES, the counts will be read at
+    :param verify_counts: Also recount them if they don't add up to the votes in the table
+    """
+    if weekly_vote_counts_stale(cursor, verify_counts):
+        rebuild_weekly_vote_counts(cursor, engine)
+    if granularity == DEFAULT_GRANULARITY and rolling_weeks and rolling_baseline_stale(cursor, rolling_weeks):
+        create_weekly_vote_counts(cursor)
+        cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME} WHERE RollingWeeks = ?",
+                       [rolling_weeks])
+        update_rolling_baseline(cursor, rolling_weeks)
+
+
+def list_quantile(values, fraction):
+    """
+    Expression interpolating a quantile of a sorted list the way quantile_cont
+    does. Picking from a list sorted per group is much cheaper than the quantile
+    aggregates when there are millions of small groups.
+
+    :param values: SQL expression of a sorted, non-empty list
+    :param fraction: Quantile between 0 and 1
+    :return: SQL expression
+    """
+    position = f"({fraction} * (len({values}) - 1))"
+    lower = f"{values}[CAST(floor({position}) AS BIGINT) + 1]"
+    upper = f"{values}[CAST(ceil({position}) AS BIGINT) + 1]"
+    return f"({lower} + ({position} - floor({position})) * ({upper} - {lower}))"
+
+
+def grouped_bucket_count(cursor, group_by, granularity=DEFAULT_GRANULARITY, bucket_rows=GROUP_BUCKET_ROWS):
+    """
+    Number of buckets to split the groups into so that each holds about
+    `bucket_rows` group periods, from a HyperLogLog estimate of their number.
+
+    :param cursor: Database cursor
+    :param group_by: Columns to partition the votes by, from GROUP_COLUMNS
+    :param granularity: One of GRANULARITIES
+    :param bucket_rows: Group periods per bucket
+    :return: Number of buckets, at least 1
+    """
+    _, year, period = GRANULARITY_PERIODS[granularity]
+    group_periods = cursor.execute(f"""
+        SELECT approx_count_distinct(hash({', '.join(group_columns(group_by))}, {year}, {period}))
+        FROM (SELECT *, CAST(CreationDate AS DATE) AS Day FROM {SCHEMA_NAME}.{TABLE_NAME})
+    """).fetchone()[0]
+    return max(1, -(-group_periods // bucket_rows))
+
+
+def stage_grouped_scores(cursor, table, group_by, methods=METHODS, rolling_weeks=ROLLING_WEEKS,
+                         granularity=DEFAULT_GRANULARITY, condition="true", temporary=False,
+                         bucket_rows=GROUP_BUCKET_ROWS):
+    """
+    Score every period of every group of votes, each group against its own
+    baseline, and write the scores to a table.
+
+    The groups are hashed into buckets of about `bucket_rows` group periods that
+    are scored one after the other, so the working memory is bounded by the size
+    of a bucket rather than the number of groups. Within a bucket the votes are
+    read once into per group counts, one aggregate computes the statistics of
+    all its groups and one join scores their periods. The quantiles are picked
+    from the sorted counts of each group. Votes without a value in a group column
+    belong to no group.
+
+    :param cursor: Database cursor
+    :param table: Name of the table to (re)create
+    :param group_by: Columns to partition the votes by, from GROUP_COLUMNS
+    :param methods: Methods to score the periods with, from METHODS
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param granularity: One of GRANULARITIES
+    :param condition: SQL condition on the scores of the rows to keep
+    :param temporary: Create a temp table instead
+    :param bucket_rows: Group periods per bucket
+    """
+    validate_settings(methods, rolling_weeks)
+    keys = group_columns(group_by)
+    if not keys:
+        raise ValueError(f"The grouped engine needs some of {GROUP_COLUMNS} to partition the votes by")
+    partition = ", ".join(keys)
+    not_null = "".join([f" AND {key} IS NOT NULL" for key in keys])
+    buckets = grouped_bucket_count(cursor, keys, granularity, bucket_rows)
+    rolling = f",\n{rolling_mean(rolling_weeks, granularity, keys)} AS RollingMeanVoteCount" \
+        if "rolling" in methods else ""
+    deviations = "list_sort(list_transform(VoteCounts, count -> abs(count - MedianVoteCount)))"
+    scores_query = f"""
+        SELECT {partition}, Year, {period_column(granularity)}, VoteCount, {score_columns(methods)}
+        FROM {GROUPED_COUNTS_TABLE_NAME} JOIN {GROUPED_STATS_TABLE_NAME} USING ({partition})
+        WHERE {condition}
+    """
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        for bucket in range(buckets):
+            votes = f"""(
+                SELECT {partition}, CAST(CreationDate AS DATE) AS Day, 1 AS VoteCount
+                FROM {SCHEMA_NAME}.{TABLE_NAME}
+                WHERE CreationDate IS NOT NULL{not_null}
+                    AND hash({partition}) % CAST({buckets} AS UBIGINT) = {bucket}
+            )"""
+            cursor.execute(f"""
+                CREATE OR REPLACE TEMP TABLE {GROUPED_COUNTS_TABLE_NAME} AS
+                SELECT *{rolling} FROM ({period_counts_query(granularity, votes, keys)})
+            """)
+            cursor.execute(f"""
+                CREATE OR REPLACE TEMP TABLE {GROUPED_STATS_TABLE_NAME} AS
+                SELECT * EXCLUDE (VoteCounts), {list_quantile(deviations, 0.5)} AS MadVoteCount
+                FROM (
+                    SELECT
+                        {partition}, MeanVoteCount, AvgVoteCount, StddevVoteCount,
+                        {list_quantile("VoteCounts", 0.25)} AS Q1VoteCount,
+                        {list_quantile("VoteCounts", 0.5)} AS MedianVoteCount,
+                        {list_quantile("VoteCounts", 0.75)} AS Q3VoteCount,
+                        VoteCounts
+                    FROM (
+                        SELECT
+                            {partition},
+                            round(avg(VoteCount)) AS MeanVoteCount,
+                            avg(VoteCount) AS AvgVoteCount,
+                            stddev_pop(VoteCount) AS StddevVoteCount,
+                            list_sort(list(VoteCount)) AS VoteCounts
+                        FROM {GROUPED_COUNTS_TABLE_NAME}
+                        GROUP BY {partition}
+                    )
+                )
+            """)
+            if bucket == 0:
+                cursor.execute(f"CREATE {'TEMP ' if temporary else ''}TABLE {table} AS {scores_query}")
+            else:
+                cursor.execute(f"INSERT INTO {table} {scores_query}")
+        cursor.execute(f"DROP TABLE {GROUPED_STATS_TABLE_NAME}")
+        cursor.execute(f"DROP TABLE {GROUPED_COUNTS_TABLE_NAME}")
+        logger.info(f"Scored the votes per {partition} in {buckets} bucket(s) into {table}.")
+    except Exception as e:
+        logger.error(f"Error while scoring the votes per {partition} into {table}. Error: {e}")
+        raise
+
+
+def detect_outliers(cursor, thresholds=None, rolling_weeks=ROLLING_WEEKS, methods=METHODS,
+                    granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Score and flag every period with several methods at once, in one pass over the
+    vote counts. With group columns every group is scored against its own
+    baseline by the grouped engine, whose scores are staged in a temp table.
+
+    :param cursor: Database cursor
+    :param thresholds: Dictionary of method to threshold, DEFAULT_THRESHOLDS fill the rest
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param methods: Methods to evaluate, from METHODS
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns to partition the votes by, from GROUP_COLUMNS
+    :return: DuckDB relation with the group columns, Year, the period column, VoteCount and a
+        <method>_score and <method>_outlier column per method
+    """
+    thresholds = resolve_thresholds(thresholds)
+    keys = "".join([f"{key}, " for key in group_columns(group_by)])
+    flags = ", ".join([f"{method}_score, coalesce({method}_score > {thresholds[method]}, false) AS {method}_outlier"
+                       for method in methods])
+    scores = GROUPED_SCORES_TABLE_NAME if group_by else f"({outlier_scores_query(methods, rolling_weeks, granularity)})"
+    query = f"""
+        SELECT {keys}Year, {period_column(granularity)}, VoteCount, {flags}
+        FROM {scores}
+        ORDER BY {order_by_columns(granularity, group_by)}
+    """
+    try:
+        if group_by:
+            stage_grouped_scores(cursor, GROUPED_SCORES_TABLE_NAME, group_by, methods, rolling_weeks, granularity,
+                                 temporary=True)
         else:
-            logger.info(
-                f"There is no table named '{SCHEMA_NAME}.{TABLE_NAME}'. Please ingest data using the command 'poetry run exercise ingest-data'.")
-            return False
+            refresh_weekly_vote_counts(cursor, rolling_weeks=rolling_weeks if "rolling" in methods else None,
+                                       granularity=granularity)
+        return cursor.sql(query)
+    except Exception as e:
+        logger.error(f"Error while detecting outliers using the query: {query}. Error: {e}")
+        raise
+
+
+def outliers_version(cursor, method=DEFAULT_METHOD, threshold=None, rolling_weeks=ROLLING_WEEKS):
+    """
+    Stamp of the data and settings the outlier periods would be computed from now:
+    the latest ingestion run, the number of votes counted and the method.
+
+    :param cursor: Database cursor
+    :param method: One of METHODS
+    :param threshold: Score above which a week is an outlier, defaults to DEFAULT_THRESHOLDS
+    :param rolling_weeks: Number of trailing weeks in the rolling baseline
+    :return: Dictionary of the VERSION_SCHEMA columns but ComputedAt
+    """
+    run_id = latest_run_id(cursor)
+    vote_total = cursor.execute(
+        f"SELECT coalesce(sum(VoteCount), 0) FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}").fetchone()[0]
+    return {
+        "RunId": run_id,
+        "VoteTotal": vote_total,
+        "Method": method,
+        "Threshold": resolve_thresholds({method: threshold})[method],
+        "RollingWeeks": rolling_weeks
+    }
+
+
+def materialised_table_names(granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Tables the outlier periods of a granularity are stored in, in materialised mode.
+
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns the votes are partitioned by, from GROUP_COLUMNS
+    :return: Tuple of the materialised and version table names
+    """
+    view_name = outliers_view_name(granularity, group_by)
+    if view_name == VIEW_NAME:
+        return MATERIALISED_TABLE_NAME, VERSION_TABLE_NAME
+    return f"{view_name}_materialised", f"{view_name}_version"
+
+
+def materialised_version(cursor, granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Stamp the materialised outlier periods were computed with.
+
+    :param cursor: Database cursor
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns the votes are partitioned by, from GROUP_COLUMNS
+    :return: Dictionary of the VERSION_SCHEMA columns but ComputedAt, None if nothing is materialised
+    """
+    _, version_table = materialised_table_names(granularity, group_by)
+    if not db.table_exists(cursor, SCHEMA_NAME, version_table):
+        return None
+    columns = [column for column in VERSION_SCHEMA if column != "ComputedAt"]
+    row = cursor.execute(f"SELECT {', '.join(columns)} FROM {SCHEMA_NAME}.{version_table}").fetchone()
+    return dict(zip(columns, row)) if row else None
+
+
+def materialise_outliers(cursor, version, granularity=DEFAULT_GRANULARITY, group_by=()):
+    """
+    Store the outlier periods in a table, with their version, and point the view
+    at it, in one transaction. The grouped engine writes the outliers of each
+    group straight into the table.
+
+    :param cursor: Database cursor
+    :param version: Stamp from outliers_version
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns to partition the votes by, from GROUP_COLUMNS
+    """
+    materialised_table, version_table = materialised_table_names(granularity, group_by)
+    method = version["Method"]
+    try:
+        cursor.execute("BEGIN TRANSACTION")
+        if group_by:
+            stage_grouped_scores(cursor, f"{SCHEMA_NAME}.{materialised_table}", group_by, [method],
+                                 version["RollingWeeks"], granularity, f"{method}_score > {version['Threshold']}")
+        else:
+            cursor.execute(f"""
+                CREATE OR REPLACE TABLE {SCHEMA_NAME}.{materialised_table} AS
+                {outlier_select_query(method, version["Threshold"], version["RollingWeeks"], granularity)}
+            """)
+        db.create_table(cursor, DATABASE, SCHEMA_NAME, version_table, VERSION_SCHEMA, primary_key=None)
+        cursor.execute(f"DELETE FROM {SCHEMA_NAME}.{version_table}")
+        cursor.execute(f"INSERT INTO {SCHEMA_NAME}.{version_table} VALUES (?, ?, ?, ?, ?, current_timestamp)",
+                       list(version.values()))
+        cursor.execute(f"""
+            CREATE OR REPLACE VIEW {SCHEMA_NAME}.{outliers_view_name(granularity, group_by)} AS
+            SELECT {order_by_columns(granularity, group_by)}, VoteCount FROM {SCHEMA_NAME}.{materialised_table}
+            ORDER BY {order_by_columns(granularity, group_by)}
+        """)
+        cursor.execute("COMMIT")
+        logger.info(f"Materialised the outlier {granularity}s for ingestion run {version['RunId']}.")
+    except Exception as e:
+        cursor.execute("ROLLBACK")
+        db.invalidate_catalog(cursor)
+        logger.error(f"Error while materialising the outlier {granularity}s. Error: {e}")
+        raise
+
+
+def create_outliers_view(cursor, engine=DEFAULT_ENGINE, method=DEFAULT_METHOD, threshold=None,
+                         rolling_weeks=ROLLING_WEEKS, materialised=False, granularity=DEFAULT_GRANULARITY,
+                         group_by=(), verify_counts=False):
+    """
+    Create a view for detecting outliers in the votes data, outlier_weeks or the
+    view of another granularity from VIEW_NAMES. The view reads the weekly or
+    daily vote counts instead of the votes, which are recounted first if stale.
+
+    In materialised mode the outlier periods are stored in a table that the view
+    reads from. They are only recomputed when their version no longer matches,
+    i.e. after a new ingestion run, a recount of the votes or other settings.
+    Grouped views, e.g. outlier_weeks_by_postid, are always materialised as the
+    grouped engine reads the votes themselves.
+
+    :param cursor: Database cursor
+    :param engine: One of ENGINES, used to recount the weeks
+    :param method: One of METHODS
+    :param threshold: Score above which a period is an outlier, defaults to DEFAULT_THRESHOLDS
+    :param rolling_weeks: Number of trailing periods in the rolling baseline
+    :param materialised: Store the outlier periods instead of computing them on every read
+    :param granularity: One of GRANULARITIES
+    :param group_by: Columns to partition the votes by, from GROUP_COLUMNS
+    :param verify_counts: Also recount the votes if the counts don't add up to them, which reads every vote
+    :return: True if the view is created successfully, False otherwise
+    """
+    query = outlier_query(method, threshold, rolling_weeks, granularity)
+    view_name = outliers_view_name(granularity, group_by)
+    try:
+        with db.catalog_cache(cursor):
+            if db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME):
+                logger.info(
+                    f"{SCHEMA_NAME}.{TABLE_NAME} table exists. Proceeding to create the outliers view")
+                refresh_weekly_vote_counts(cursor, engine, rolling_weeks if method == "rolling" else None, granularity,
+                                           verify_counts)
+                if not materialised and not group_by:
+                    cursor.execute(query)
+                    cursor.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{materialised_table_names(granularity)[1]}")
+                    return True
+                version = outliers_version(cursor, method, threshold, rolling_weeks)
+                if materialised_version(cursor, granularity, group_by) == version:
+                    logger.info(f"{view_name} is up to date with ingestion run {version['RunId']}.")
+                else:
+                    materialise_outliers(cursor, version, granularity, group_by)
+                return True
+            else:
+                logger.info(
+                    f"There is no table named '{SCHEMA_NAME}.{TABLE_NAME}'. Please ingest data using the command 'poetry run exercise ingest-data'.")
+                return False
     except Exception as e:
         logger.error(
-            f"Error while creating view using the query: {OUTLIER_QUERY}. Error: {e}")
+            f"Error while creating view using the query: {query}. Error: {e}")
         raise
 
 
-def display_outliers_view(cursor):
+def display_outliers_view(cursor, granularity=DEFAULT_GRANULARITY, group_by=()):
     """
     Display the outliers view in a tabular format.
 
     :param cursor: Database cursor
+    :param granularity: One of GRANULARITIES, whose view to display
+    :param group_by: Columns the votes are partitioned by in the view, from GROUP_COLUMNS
     """
     try:
-        select_view_query = f"SELECT * FROM {SCHEMA_NAME}.{VIEW_NAME} ORDER BY {ORDER_BY_COLUMNS}"
+        select_view_query = f"SELECT * FROM {SCHEMA_NAME}.{outliers_view_name(granularity, group_by)} " \
+                            f"ORDER BY {order_by_columns(granularity, group_by)}"
         # result = cursor.execute(select_view_query).fetchall()
         result = cursor.sql(select_view_query)
         result.show()
@@ -109,24 +975,107 @@ def display_outliers_view(cursor):
         raise
 
 
-def main(DATABASE):
+def positive_float(value):
+    """
+    Argument type for thresholds, which must be positive.
+    """
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def positive_int(value):
+    """
+    Argument type for options that only accept a positive integer.
+    """
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def parse_arguments(argv):
+    """
+    Parse the command-line arguments of the outlier detection.
+
+    :param argv: List of command-line arguments without the program name
+    :return: Parsed arguments namespace
+    """
+    parser = argparse.ArgumentParser(description="Create and show the outlier_weeks view, or that of another granularity.")
+    parser.add_argument("--method", choices=METHODS, default=DEFAULT_METHOD,
+                        help=f"Rule the view classifies weeks with (default {DEFAULT_METHOD})")
+    parser.add_argument("--threshold", type=positive_float, default=None,
+                        help=f"Score above which a week is an outlier, defaults per method: {DEFAULT_THRESHOLDS}")
+    parser.add_argument("--rolling-weeks", type=positive_int, default=ROLLING_WEEKS,
+                        help=f"Trailing weeks the rolling method compares against (default {ROLLING_WEEKS})")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also show the scores and flags of every method, computed in one pass")
+    parser.add_argument("--materialised", action="store_true",
+                        help="Store the outlier weeks in a table and only recompute them after new data")
+    parser.add_argument("--granularity", choices=GRANULARITIES, default=DEFAULT_GRANULARITY,
+                        help=f"Periods to count the votes in, one view each: {VIEW_NAMES} (default {DEFAULT_GRANULARITY})")
+    parser.add_argument("--group-by", nargs="+", choices=GROUP_COLUMNS, default=[],
+                        help="Score every group of votes against its own baseline, in a view named after the columns")
+    parser.add_argument("--verify-counts", action="store_true",
+                        help="Also count the votes, and recount the periods if the votes were changed outside the ingestion")
+    parser.add_argument("--memory-limit", default=None,
+                        help="Value of DuckDB's memory_limit setting, e.g. 1GB")
+    parser.add_argument("--temp-directory", default=None,
+                        help="Directory DuckDB spills to when it runs over the memory limit")
+    parser.add_argument("--query-log", default=None,
+                        help="Append the wall time and row count of every SQL statement to this JSON lines file")
+    parser.add_argument("--explain-analyze", action="store_true",
+                        help="Also record DuckDB's EXPLAIN ANALYZE profile of every statement in the query log")
+    return parser.parse_args(argv)
+
+
+def main(DATABASE, method=DEFAULT_METHOD, threshold=None, rolling_weeks=ROLLING_WEEKS, compare=False,
+         materialised=False, granularity=DEFAULT_GRANULARITY, group_by=(), memory_limit=None, temp_directory=None,
+         query_log=None, explain_analyze=False, verify_counts=False):
     """
     Main function to create the outliers view and display its contents.
+
+    :param DATABASE: Path to the DuckDB database file
+    :param method: One of METHODS, used by the view
+    :param threshold: Threshold of the view's method, defaults to DEFAULT_THRESHOLDS
+    :param rolling_weeks: Number of trailing weeks in the rolling baseline
+    :param compare: Also display the scores and flags of every method
+    :param materialised: Serve the view from a table that is only recomputed when the data changes
+    :param granularity: One of GRANULARITIES, whose view is created
+    :param group_by: Columns to partition the votes by, from GROUP_COLUMNS
+    :param memory_limit: Value of DuckDB's memory_limit setting, None for its default
+    :param temp_directory: Directory DuckDB spills to, None for its default
+    :param query_log: JSON lines file the metrics of every statement are appended to, None for none
+    :param explain_analyze: Also record DuckDB's profile of every statement
+    :param verify_counts: Also recount the periods if they don't add up to the votes in the table
     """
     cursor = None
     try:
-        cursor = db.connect_to_db(DATABASE)
-        view_created = create_outliers_view(cursor)
+        db.configure_database(DATABASE, {"memory_limit": memory_limit, "temp_directory": temp_directory})
+        db.configure_instrumentation(query_log is not None or explain_analyze, explain_analyze, query_log)
+        cursor = db.pooled_cursor(DATABASE)
+        view_created = create_outliers_view(cursor, method=method, threshold=threshold,
+                                            rolling_weeks=rolling_weeks, materialised=materialised,
+                                            granularity=granularity, group_by=group_by,
+                                            verify_counts=verify_counts)
         if view_created:
-            display_outliers_view(cursor)
+            display_outliers_view(cursor, granularity, group_by)
+            if compare:
+                detect_outliers(cursor, {method: threshold}, rolling_weeks, granularity=granularity,
+                                group_by=group_by).show()
     except Exception as e:
         logger.error(f"An error occurred in the main function: {e}")
         raise
     finally:
         if cursor:
-            cursor.close()
             db.close_connection(cursor)
+        db.close_pool(DATABASE)
+        db.configure_instrumentation(False)
 
 
 if __name__ == "__main__":
-    main(DATABASE)
+    args = parse_arguments(sys.argv[1:])
+    main(DATABASE, args.method, args.threshold, args.rolling_weeks, args.compare, args.materialised,
+         args.granularity, args.group_by, args.memory_limit, args.temp_directory, args.query_log,
+         args.explain_analyze, args.verify_counts)
@@ -0,0 +1,340 @@
+"""
+Times the ingestion engines against each other on the same input file, and the
+multithreaded insert at different thread counts.
+
+With --rows it runs the benchmark suite instead, on a synthetic votes file of that
+many rows: every ingestion engine, the de-duplication and the outlier computation.
+The results are written as JSON, so runs of different releases can be compared.
+--generate only writes the synthetic file.
+
+Every run loads into a throwaway warehouse.db inside a temporary directory, so the
+project's own warehouse.db is left untouched.
+
+    python -m equalexperts_dataeng_exercise.scripts.benchmark uncommitted/votes.jsonl
+    python -m equalexperts_dataeng_exercise.scripts.benchmark --rows 10M --duplicate-ratio 0.1 --output bench.json
+    python -m equalexperts_dataeng_exercise.scripts.benchmark --rows 100M --generate uncommitted/votes_100M.jsonl
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from importlib import metadata
+from pathlib import Path
+
+import duckdb
+
+from equalexperts_dataeng_exercise import db, ingest, outliers
+
+REPEATS = 3
+RESULTS_VERSION = 1  # Bumped when the layout of the results JSON changes
+SIZE_SUFFIXES = {"K": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9}  # 10M is 10 million rows
+SYNTHETIC_START_DATE = "2008-07-31"  # Date of the first vote, like the Stack Exchange dumps
+SYNTHETIC_DAYS = 15 * 365  # The votes are spread evenly over this many days, in Id order
+SYNTHETIC_VOTE_TYPES = 15
+VOTES_PER_POST = 3
+SUITE_ENGINES = {
+    "duckdb": {"engine": "duckdb", "streaming": False},
+    "parallel": {"engine": "parallel", "streaming": False},
+    "python": {"engine": "python", "streaming": False},
+    "streaming": {"engine": "python", "streaming": True},
+}  # Ingestion variants of the suite, by the name used on the command line
+THREAD_COUNTS = (1, 2, 4, 8)
+ENGINE_VARIANTS = {
+    "python (multithreading)": {"engine": "python", "streaming": False},
+    "python (streaming)": {"engine": "python", "streaming": True},
+    "duckdb (read_json)": {"engine": "duckdb", "streaming": False},
+}
+
+logger = logging.getLogger()
+if not logger.hasHandlers():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(levelname)s::: %(message)s"))
+    logger.addHandler(handler)
+    handler.setLevel(logging.INFO)
+logger.setLevel(logging.INFO)
+
+
+def time_engine(file_path: Path, options: dict, repeats: int = REPEATS) -> float:
+    """
+    Returns the best wall time in seconds out of `repeats` full ingestions
+    """
+    timings = []
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        ingest.ingest_file(file_path, **options)
+        timings.append(time.perf_counter() - tic)
+    return min(timings)
+
+
+def time_threads(filtered_data: list, num_threads: int, repeats: int = REPEATS) -> float:
+    """
+    Returns the best wall time in seconds out of `repeats` inserts of the already
+    parsed data, so only the threaded insert and merge are measured
+    """
+    timings = []
+    for _ in range(repeats):
+        ingest.pre_ingestion_db_activities()
+        tic = time.perf_counter()
+        ingest.insert_data_using_multithreading(filtered_data, num_threads=num_threads)
+        timings.append(time.perf_counter() - tic)
+    return min(timings)
+
+
+@contextmanager
+def scratch_directory():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+
+def compare_engines(file_path: Path) -> dict:
+    with scratch_directory():
+        return {name: time_engine(file_path, options) for name, options in ENGINE_VARIANTS.items()}
+
+
+def compare_thread_counts(file_path: Path) -> dict:
+    filtered_data = ingest.filtered_and_formatted_data(ingest.fetch_data(str(file_path)))
+    with scratch_directory():
+        return {num_threads: time_threads(filtered_data, num_threads) for num_threads in THREAD_COUNTS}
+
+
+def report(title: str, results: dict):
+    baseline = next(iter(results.values()))
+    logger.info("%s (best of %d):", title, REPEATS)
+    for name, seconds in results.items():
+        logger.info(" - %-24s %8.3fs  (%.1fx)", name, seconds, baseline / seconds)
+
+
+def row_count(value: str) -> int:
+    """
+    Argument type for a number of rows, with an optional K, M or G suffix.
+    """
+    suffix = value[-1:].upper()
+    try:
+        rows = int(float(value[:-1]) * SIZE_SUFFIXES[suffix]) if suffix in SIZE_SUFFIXES else int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a number of rows such as 1000, 1M or 100M")
+    if rows <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number of rows")
+    return rows
+
+
+def ratio(value: str) -> float:
+    """
+    Argument type for a share of the lines, at least 0 and below 1.
+    """
+    share = float(value)
+    if not 0 <= share < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not at least 0 and below 1")
+    return share
+
+
+def generate_votes(path: Path, rows: int, duplicate_ratio: float = 0.0, days: int = SYNTHETIC_DAYS,
+                   seed: int = 0) -> Path:
+    """
+    Writes a votes.jsonl file of `rows` lines in the format of the exercise's file.
+    The same arguments always give the same bytes, because every value is a hash of
+    the row number and the seed. The dates rise with the Id over `days` days. About
+    `duplicate_ratio` of the lines repeat an earlier line, Id and all, for the
+    de-duplication to remove. DuckDB writes the file, so 100M rows take minutes, not hours.
+    """
+    if not 0 <= duplicate_ratio < 1:
+        raise ValueError(f"The duplicate ratio must be at least 0 and below 1, not {duplicate_ratio}")
+    posts = max(1, rows // VOTES_PER_POST)
+    connection = duckdb.connect()
+    try:
+        # hash() is a UBIGINT, dividing it by a plain integer would go through DOUBLE and lose bits
+        connection.execute(f"""
+            COPY (
+                WITH votes AS (
+                    SELECT CASE
+                        WHEN i > 0 AND hash(i, {seed}, 'duplicate') % CAST(1000000 AS UBIGINT) < {round(duplicate_ratio * 1000000)}
+                        THEN CAST(hash(i, {seed}, 'original') % CAST(i AS UBIGINT) AS BIGINT)
+                        ELSE i
+                    END AS original
+                    FROM range({rows}) AS votes(i)
+                )
+                SELECT
+                    CAST(original + 1 AS VARCHAR) AS Id,
+                    CAST(CAST(hash(original, {seed}, 'post') % CAST({posts} AS UBIGINT) AS BIGINT) + 1 AS VARCHAR) AS PostId,
+                    CAST(CAST(hash(original, {seed}, 'type') % CAST({SYNTHETIC_VOTE_TYPES} AS UBIGINT) AS BIGINT) + 1 AS VARCHAR) AS VoteTypeId,
+                    strftime(DATE '{SYNTHETIC_START_DATE}' + CAST(original * {days} // {rows} AS INTEGER),
+                             '%Y-%m-%dT00:00:00.000') AS CreationDate
+                FROM votes
+            ) TO '{path}' (FORMAT JSON)
+        """)
+    finally:
+        connection.close()
+    return Path(path)
+
+
+def measure(benchmark: str, variant: str, run, repeats: int = REPEATS) -> dict:
+    """
+    Runs a benchmark `repeats` times and returns the metrics of the fastest run, as
+    measured by ingest.stage. `run` returns the number of rows it processed. The
+    stages of an ingestion are kept too.
+    """
+    best = None
+    for _ in range(repeats):
+        ingest.STAGE_REPORT.clear()
+        with ingest.stage(f"{benchmark}.{variant}") as metrics:
+            metrics["rows"] = run()
+        stages = ingest.STAGE_REPORT[1:]
+        if best is None or metrics["wall_seconds"] < best["wall_seconds"]:
+            best = {"benchmark": benchmark, "variant": variant,
+                    **{key: value for key, value in metrics.items() if key != "stage"}}
+            if stages:
+                best["stages"] = stages
+    ingest.STAGE_REPORT.clear()
+    logger.info("%s %s: %.3fs, %s rows/s", benchmark, variant, best["wall_seconds"], best["rows_per_second"])
+    return best
+
+
+def deduplicate(file_path: Path) -> int:
+    """
+    Reads the file through the streaming reader's de-duplication without inserting
+    anything, and returns the number of unique rows.
+    """
+    return sum(len(batch[ingest.PRIMARY_KEY]) for batch in ingest.stream_batches(str(file_path)))
+
+
+def create_view(granularity: str = outliers.DEFAULT_GRANULARITY, group_by: tuple = ()) -> int:
+    """
+    Recounts the votes, creates an outliers view from scratch and fetches its rows,
+    as the view is only computed when read, and returns the number of votes.
+    """
+    cursor = db.pooled_cursor(ingest.DATABASE)
+    try:
+        outliers.rebuild_weekly_vote_counts(cursor)
+        outliers.create_outliers_view(cursor, granularity=granularity, group_by=group_by)
+        cursor.execute(f"SELECT * FROM {outliers.SCHEMA_NAME}.{outliers.outliers_view_name(granularity, group_by)} "
+                       f"ORDER BY {outliers.order_by_columns(granularity, group_by)}").fetchall()
+        return cursor.execute(f"SELECT count(*) FROM {outliers.SCHEMA_NAME}.{outliers.TABLE_NAME}").fetchone()[0]
+    finally:
+        db.close_connection(cursor)
+
+
+def environment() -> dict:
+    """
+    What the results were measured with, so only comparable runs are compared.
+    """
+    try:
+        version = metadata.version("equalexperts_dataeng_exercise")
+    except metadata.PackageNotFoundError:
+        version = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "package_version": version,
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_suite(rows: int, duplicate_ratio: float = 0.0, days: int = SYNTHETIC_DAYS, seed: int = 0,
+              engines=tuple(SUITE_ENGINES), repeats: int = REPEATS) -> dict:
+    """
+    Generates the synthetic file and times every ingestion engine on it, then the
+    de-duplication on its own, then the outlier views of the votes loaded last.
+    Ingestion and de-duplication rates are in lines of the file per second, the
+    outlier rates in votes loaded per second.
+    """
+    results = {
+        "results_version": RESULTS_VERSION,
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": environment(),
+        "parameters": {"rows": rows, "duplicate_ratio": duplicate_ratio, "days": days, "seed": seed,
+                       "repeats": repeats},
+        "benchmarks": [],
+    }
+    benchmarks = results["benchmarks"]
+    with scratch_directory():
+        file_path = Path("votes.jsonl").resolve()
+
+        def generate():
+            generate_votes(file_path, rows, duplicate_ratio, days, seed)
+            return rows
+
+        def load(engine):
+            ingest.ingest_file(str(file_path), **SUITE_ENGINES[engine])
+            return rows
+
+        def dedup():
+            results["parameters"]["unique_rows"] = deduplicate(file_path)
+            return rows
+
+        benchmarks.append(measure("generate", "duckdb", generate, 1))
+        results["parameters"]["file_bytes"] = file_path.stat().st_size
+        for engine in engines:
+            benchmarks.append(measure("ingest", engine, lambda: load(engine), repeats))
+        benchmarks.append(measure("dedup", "streaming", dedup, repeats))
+        if engines:
+            benchmarks.append(measure("outliers", "week", create_view, repeats))
+            benchmarks.append(measure("outliers", "week_by_votetypeid",
+                                      lambda: create_view(group_by=("VoteTypeId",)), repeats))
+    return results
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Time the ingestion engines, or run the benchmark suite.")
+    parser.add_argument("file_path", nargs="?", default=str(Path("uncommitted") / "votes.jsonl"),
+                        help="File to compare the engines and thread counts on, without --rows")
+    parser.add_argument("--rows", type=row_count, default=None,
+                        help="Run the suite on a synthetic file of this many rows, e.g. 1M, 10M or 100M")
+    parser.add_argument("--duplicate-ratio", type=ratio, default=0.0,
+                        help="Share of the synthetic lines that repeat an earlier line")
+    parser.add_argument("--days", type=ingest.positive_int, default=SYNTHETIC_DAYS,
+                        help=f"Days the synthetic votes are spread over (default {SYNTHETIC_DAYS})")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic file")
+    parser.add_argument("--engines", nargs="+", choices=SUITE_ENGINES, default=list(SUITE_ENGINES),
+                        help="Ingestion engines the suite times")
+    parser.add_argument("--repeats", type=ingest.positive_int, default=REPEATS,
+                        help=f"Runs of every benchmark, the fastest is kept (default {REPEATS})")
+    parser.add_argument("--output", default=None,
+                        help="JSON file the results of the suite are written to, they are logged otherwise")
+    parser.add_argument("--generate", default=None,
+                        help="Only write the synthetic file of --rows rows to this path")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arguments(argv)
+    if args.generate:
+        generate_votes(Path(args.generate).resolve(), args.rows or 10 ** 6, args.duplicate_ratio, args.days, args.seed)
+        logger.info("Wrote %s", args.generate)
+    elif args.rows:
+        results = run_suite(args.rows, args.duplicate_ratio, args.days, args.seed, args.engines, args.repeats)
+        if args.output:
+            Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+            logger.info("Wrote the results to %s", args.output)
+        else:
+            logger.info("Benchmark results: %s", json.dumps(results))
+    else:
+        data_file = Path(args.file_path)
+        engine_results = compare_engines(data_file.resolve())
+        thread_results = compare_thread_counts(data_file.resolve())
+        logger.info("Cores available: %d", os.cpu_count() or 1)
+        report("Engine timings", engine_results)
+        report("Multithreaded insert timings by thread count", thread_results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+"""
+Times the engines that count the votes per week for the outliers view against
+each other on a synthetic votes table, and checks that they agree.
+
+The table is generated inside a throwaway database in a temporary directory, so
+the project's own warehouse.db is left untouched.
+
+    python -m equalexperts_dataeng_exercise.scripts.benchmark_outliers [row count]
+"""
+import logging
+import sys
+import time
+
+import duckdb
+
+from equalexperts_dataeng_exercise import outliers
+from equalexperts_dataeng_exercise.scripts.benchmark import REPEATS, report, scratch_directory
+
+ROW_COUNT = 100_000_000
+SYNTHETIC_YEARS = 15  # The votes are spread evenly over this many years
+
+logger = logging.getLogger()
+if not logger.hasHandlers():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(levelname)s::: %(message)s"))
+    logger.addHandler(handler)
+    handler.setLevel(logging.INFO)
+logger.setLevel(logging.INFO)
+
+
+def create_synthetic_votes(connection, row_count: int):
+    """
+    Creates a votes table of `row_count` rows with the typed schema. The votes are
+    spread evenly, so the outliers are the short weeks around each new year.
+    """
+    seconds_per_vote = SYNTHETIC_YEARS * 365 * 24 * 3600 / row_count
+    connection.execute(f"CREATE SCHEMA IF NOT EXISTS {outliers.SCHEMA_NAME}")
+    connection.execute(f"""
+        CREATE OR REPLACE TABLE {outliers.SCHEMA_NAME}.{outliers.TABLE_NAME} AS
+        SELECT
+            i AS Id,
+            i % 100000 AS PostId,
+            CAST(i % 16 AS UTINYINT) AS VoteTypeId,
+            TIMESTAMP '2008-07-31 00:00:00' + to_seconds(CAST(i * {seconds_per_vote} AS BIGINT)) AS CreationDate
+        FROM range({row_count}) AS votes(i)
+    """)
+
+
+def time_engine(connection, engine: str, repeats: int = REPEATS) -> float:
+    """
+    Returns the best wall time in seconds out of `repeats` recounts of every week
+    """
+    timings = []
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        outliers.rebuild_weekly_vote_counts(connection, engine)
+        timings.append(time.perf_counter() - tic)
+    return min(timings)
+
+
+def compare_engines(row_count: int) -> dict:
+    with scratch_directory():
+        connection = duckdb.connect(outliers.DATABASE)
+        try:
+            tic = time.perf_counter()
+            create_synthetic_votes(connection, row_count)
+            logger.info("Generated %d votes in %.1fs", row_count, time.perf_counter() - tic)
+            results, views = {}, {}
+            for engine in outliers.ENGINES:
+                results[engine] = time_engine(connection, engine)
+                outliers.create_outliers_view(connection, engine)
+                views[engine] = connection.execute(
+                    f"SELECT * FROM {outliers.SCHEMA_NAME}.{outliers.VIEW_NAME}").fetchall()
+            if len({tuple(rows) for rows in views.values()}) != 1:
+                raise AssertionError(f"The engines found different outlier weeks: {views}")
+            logger.info("All engines found the same %d outlier weeks", len(views[outliers.DEFAULT_ENGINE]))
+            return results
+        finally:
+            connection.close()
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROW_COUNT
+    report(f"Weekly vote count timings on {rows} votes", compare_engines(rows))
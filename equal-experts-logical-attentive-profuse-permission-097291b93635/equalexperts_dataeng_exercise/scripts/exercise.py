@@ -10,10 +10,12 @@ For example
     poetry run exercise ingest-data
     poetry run exercise detect-outliers
     poetry run exercise test
+    poetry run exercise bench --rows 10M
 
 """
 import subprocess
 from pathlib import Path
+from typing import Optional
 
 import duckdb
 import typer
@@ -52,9 +54,59 @@ def fetch_data():
 
 
 @app.command()
-def ingest_data():
-    path_to_data = Path("uncommitted") / "votes.jsonl"
-    run_cmd(f"python -m equalexperts_dataeng_exercise.ingest {path_to_data}")
+def ingest_data(
+    input_path: str = "",
+    engine: str = "",
+    streaming: bool = False,
+    batch_size: Optional[int] = None,
+    incremental: bool = False,
+    threads: Optional[int] = None,
+    duckdb_threads: Optional[int] = None,
+    memory_limit: str = "",
+    temp_directory: str = "",
+    auto_tune: bool = False,
+    typed_schema: bool = False,
+    resumable: bool = False,
+    query_log: str = "",
+    explain_analyze: bool = False,
+    stage_report: str = "",
+):
+    path_to_data = f"'{input_path}'" if input_path else Path("uncommitted") / "votes.jsonl"
+    options = ""
+    if engine:
+        options += f" --engine {engine}"
+    if streaming:
+        options += " --streaming"
+    if batch_size:
+        options += f" --batch-size {batch_size}"
+    if incremental:
+        options += " --incremental"
+    if threads:
+        options += f" --threads {threads}"
+    if duckdb_threads:
+        options += f" --duckdb-threads {duckdb_threads}"
+    if memory_limit:
+        options += f" --memory-limit {memory_limit}"
+    if temp_directory:
+        options += f" --temp-directory {temp_directory}"
+    if auto_tune:
+        options += " --auto-tune"
+    if typed_schema:
+        options += " --typed-schema"
+    if resumable:
+        options += " --resumable"
+    if query_log:
+        options += f" --query-log {query_log}"
+    if explain_analyze:
+        options += " --explain-analyze"
+    if stage_report:
+        options += f" --stage-report {stage_report}"
+    run_cmd(f"python -m equalexperts_dataeng_exercise.ingest {path_to_data}{options}")
+
+
+@app.command()
+def migrate_schema():
+    run_cmd("python -m equalexperts_dataeng_exercise.scripts.migrate_schema warehouse.db")
 
 
 @app.command()
@@ -65,8 +117,71 @@ def run_query(query: str):
 
 
 @app.command()
-def detect_outliers():
-    run_cmd("python -m equalexperts_dataeng_exercise.outliers")
+def detect_outliers(
+    method: str = "",
+    threshold: Optional[float] = None,
+    rolling_weeks: Optional[int] = None,
+    compare: bool = False,
+    materialised: bool = False,
+    granularity: str = "",
+    group_by: str = "",
+    memory_limit: str = "",
+    temp_directory: str = "",
+    query_log: str = "",
+    explain_analyze: bool = False,
+    verify_counts: bool = False,
+):
+    options = ""
+    if method:
+        options += f" --method {method}"
+    if threshold:
+        options += f" --threshold {threshold}"
+    if rolling_weeks:
+        options += f" --rolling-weeks {rolling_weeks}"
+    if compare:
+        options += " --compare"
+    if materialised:
+        options += " --materialised"
+    if granularity:
+        options += f" --granularity {granularity}"
+    if group_by:
+        options += f" --group-by {' '.join(group_by.split(','))}"
+    if memory_limit:
+        options += f" --memory-limit {memory_limit}"
+    if temp_directory:
+        options += f" --temp-directory {temp_directory}"
+    if query_log:
+        options += f" --query-log {query_log}"
+    if explain_analyze:
+        options += " --explain-analyze"
+    if verify_counts:
+        options += " --verify-counts"
+    run_cmd(f"python -m equalexperts_dataeng_exercise.outliers{options}")
+
+
+@app.command()
+def bench(
+    rows: str = "1M",
+    duplicate_ratio: float = 0.0,
+    days: Optional[int] = None,
+    seed: int = 0,
+    engines: str = "",
+    repeats: Optional[int] = None,
+    output: str = "",
+    generate: str = "",
+):
+    options = f" --rows {rows} --duplicate-ratio {duplicate_ratio} --seed {seed}"
+    if days:
+        options += f" --days {days}"
+    if engines:
+        options += f" --engines {' '.join(engines.split(','))}"
+    if repeats:
+        options += f" --repeats {repeats}"
+    if output:
+        options += f" --output {output}"
+    if generate:
+        options += f" --generate {generate}"
+    run_cmd(f"python -m equalexperts_dataeng_exercise.scripts.benchmark{options}")
 
 
 @app.command()
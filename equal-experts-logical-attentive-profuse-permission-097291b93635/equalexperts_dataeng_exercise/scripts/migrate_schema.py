@@ -0,0 +1,38 @@
+"""
+Migrates the votes table of an existing warehouse.db to the typed schema, keeping its rows.
+
+    python -m equalexperts_dataeng_exercise.scripts.migrate_schema [path/to/warehouse.db]
+"""
+import logging
+import sys
+
+from equalexperts_dataeng_exercise import db, ingest
+
+logger = logging.getLogger()
+if not logger.hasHandlers():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(levelname)s::: %(message)s"))
+    logger.addHandler(handler)
+    handler.setLevel(logging.INFO)
+logger.setLevel(logging.INFO)
+
+
+def migrate_schema(database: str):
+    connection = db.pooled_cursor(database)
+    try:
+        if not db.table_exists(connection, ingest.SCHEMA_NAME, ingest.TABLE_NAME):
+            logger.info("There is no votes table in %s, nothing to migrate.", database)
+            return
+        current_schema = db.table_columns(connection, ingest.SCHEMA_NAME, ingest.TABLE_NAME)
+        if list(current_schema.values()) == list(ingest.TYPED_SCHEMA.values()):
+            logger.info("The votes table in %s already has the typed schema.", database)
+            return
+        ingest.migrate_votes_table(connection, ingest.TYPED_SCHEMA)
+    finally:
+        db.close_connection(connection)
+        db.close_pool(database)
+
+
+if __name__ == "__main__":
+    migrate_schema(sys.argv[1] if len(sys.argv) > 1 else ingest.DATABASE)
@@ -0,0 +1,75 @@
+import argparse
+import json
+
+import pytest
+from equalexperts_dataeng_exercise import db, ingest, outliers
+from equalexperts_dataeng_exercise.scripts.benchmark import (
+    create_view,
+    generate_votes,
+    row_count,
+    scratch_directory,
+)
+
+
+@pytest.mark.parametrize("value, rows", [
+    ("1000", 1000),
+    ("200K", 200000),
+    ("200k", 200000),
+    ("10M", 10000000),
+    ("1.5M", 1500000),
+    ("1G", 1000000000),
+])
+def test_row_count(value, rows):
+    assert row_count(value) == rows
+
+
+@pytest.mark.parametrize("value", ["", "many", "10X", "M", "0", "-5K"])
+def test_row_count_invalid(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        row_count(value)
+
+
+def test_generate_votes_same_seed_same_bytes(tmp_path):
+    first = generate_votes(tmp_path / "first.jsonl", 1000, duplicate_ratio=0.1, seed=7)
+    second = generate_votes(tmp_path / "second.jsonl", 1000, duplicate_ratio=0.1, seed=7)
+    assert first.read_bytes() == second.read_bytes()
+
+
+def test_generate_votes_other_seed_other_bytes(tmp_path):
+    first = generate_votes(tmp_path / "first.jsonl", 1000, seed=7)
+    second = generate_votes(tmp_path / "second.jsonl", 1000, seed=8)
+    assert first.read_bytes() != second.read_bytes()
+
+
+def test_generate_votes_format(tmp_path):
+    path = generate_votes(tmp_path / "votes.jsonl", 300, duplicate_ratio=0.2, seed=1)
+    votes = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(votes) == 300
+    assert all(set(vote) == {"Id", "PostId", "VoteTypeId", "CreationDate"} for vote in votes)
+    ids = [int(vote["Id"]) for vote in votes]
+    assert ids[0] == 1
+    assert len(set(ids)) < len(ids)
+    dates = [vote["CreationDate"] for vote in votes]
+    assert dates[0].startswith("2008-07-31")
+
+
+def test_generate_votes_rejects_bad_duplicate_ratio(tmp_path):
+    with pytest.raises(ValueError):
+        generate_votes(tmp_path / "votes.jsonl", 10, duplicate_ratio=1.0)
+
+
+def test_create_view_reads_the_view(tmp_path):
+    path = generate_votes(tmp_path / "votes.jsonl", 2000, seed=3)
+    with scratch_directory():
+        ingest.ingest_file(str(path))
+        db.QUERY_LOG.clear()
+        db.configure_instrumentation(True)
+        try:
+            votes = create_view()
+        finally:
+            db.configure_instrumentation(False)
+            db.close_pool(ingest.DATABASE)
+    assert votes == 2000
+    view_selects = [record for record in db.QUERY_LOG
+                    if record["statement"].startswith(f"SELECT * FROM {outliers.SCHEMA_NAME}.{outliers.VIEW_NAME} ")]
+    assert len(view_selects) == 1 and view_selects[0]["rows"] > 0
@@ -1,3 +1,7 @@
+import concurrent.futures
+import json
+import os
+import duckdb
 import pytest
 from equalexperts_dataeng_exercise import db 
 
@@ -29,6 +33,16 @@ def test_connect_to_db():
     assert conn is not None
     db.close_connection(conn)
 
+def test_configure_database():
+    db.configure_database(DATABASE_NAME, {"threads": 2, "memory_limit": None})
+    try:
+        conn = db.connect_to_db(DATABASE_NAME)
+        assert conn.execute("SELECT current_setting('threads')").fetchone()[0] == 2
+        conn.execute("RESET threads")
+        db.close_connection(conn)
+    finally:
+        db.configure_database(DATABASE_NAME, {})
+
 def test_close_connection(connection):
      # Creating and closing connection to check if any exceptions are raised
     conn = db.connect_to_db(DATABASE_NAME)
@@ -36,6 +50,137 @@ def test_close_connection(connection):
     with pytest.raises(Exception):
         conn.execute('SELECT 1')
 
+def test_pooled_cursor_shares_one_connection():
+    try:
+        with db.pooled_cursor(DATABASE_NAME) as first:
+            first.execute("CREATE OR REPLACE TABLE pooled (i INTEGER)")
+        assert list(db.CONNECTION_POOL) == [os.path.realpath(DATABASE_NAME)]
+        with pytest.raises(Exception):
+            first.execute("SELECT 1")
+        pooled = db.CONNECTION_POOL[os.path.realpath(DATABASE_NAME)]
+        second = db.pooled_cursor(DATABASE_NAME)
+        assert db.CONNECTION_POOL[os.path.realpath(DATABASE_NAME)] is pooled
+        assert second.execute("SELECT count(*) FROM pooled").fetchone()[0] == 0
+        second.execute("DROP TABLE pooled")
+        db.close_connection(second)
+    finally:
+        db.close_pool(DATABASE_NAME)
+    assert os.path.realpath(DATABASE_NAME) not in db.CONNECTION_POOL
+
+
+def test_pooled_cursor_follows_the_working_directory(tmp_path, monkeypatch):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    try:
+        for directory in (first, second):
+            monkeypatch.chdir(directory)
+            with db.pooled_cursor(DATABASE_NAME) as cursor:
+                cursor.execute("CREATE TABLE directory (name VARCHAR)")
+                cursor.execute("INSERT INTO directory VALUES (?)", [directory.name])
+        for directory in (first, second):
+            monkeypatch.chdir(directory)
+            with db.pooled_cursor(DATABASE_NAME) as cursor:
+                assert cursor.execute("SELECT name FROM directory").fetchall() == [(directory.name,)]
+        assert set(db.CONNECTION_POOL) >= {str(first / DATABASE_NAME), str(second / DATABASE_NAME)}
+    finally:
+        db.close_pool(str(first / DATABASE_NAME))
+        db.close_pool(str(second / DATABASE_NAME))
+
+
+def test_pooled_cursors_across_threads():
+    def insert(i):
+        with db.pooled_cursor(DATABASE_NAME) as cursor:
+            cursor.execute("INSERT INTO pooled VALUES (?)", [i])
+
+    try:
+        with db.pooled_cursor(DATABASE_NAME) as cursor:
+            cursor.execute("CREATE OR REPLACE TABLE pooled (i INTEGER)")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(insert, range(20)))
+        with db.pooled_cursor(DATABASE_NAME) as cursor:
+            assert cursor.execute("SELECT count(*), sum(i) FROM pooled").fetchone() == (20, 190)
+            cursor.execute("DROP TABLE pooled")
+    finally:
+        db.close_pool(DATABASE_NAME)
+
+
+def test_close_pool_closes_open_cursors():
+    cursor = db.pooled_cursor(DATABASE_NAME)
+    db.close_pool()
+    assert db.CONNECTION_POOL == {}
+    with pytest.raises(Exception):
+        cursor.execute("SELECT 1")
+
+
+def test_configure_database_applies_to_the_pool():
+    try:
+        cursor = db.pooled_cursor(DATABASE_NAME)
+        db.configure_database(DATABASE_NAME, {"threads": 2})
+        assert cursor.execute("SELECT current_setting('threads')").fetchone()[0] == 2
+        cursor.execute("RESET threads")
+    finally:
+        db.configure_database(DATABASE_NAME, {})
+        db.close_pool(DATABASE_NAME)
+
+def test_instrumented_cursor(tmp_path):
+    output = tmp_path / "query_log.jsonl"
+    db.QUERY_LOG.clear()
+    cursor = db.InstrumentedCursor(db.connect_to_db(DATABASE_NAME), profile=True, output=str(output))
+    try:
+        cursor.execute("CREATE OR REPLACE TABLE instrumented (i INTEGER)")
+        assert cursor.execute("INSERT INTO instrumented SELECT range FROM range(5)").fetchone() == (5,)
+        cursor.executemany("INSERT INTO instrumented VALUES (?)", [[5], [6]])
+        assert cursor.execute("SELECT i FROM instrumented WHERE i > ?", [3]).fetchall() == [(4,), (5,), (6,)]
+        with pytest.raises(Exception):
+            cursor.execute("SELECT * FROM missing_table")
+        cursor.execute("DROP TABLE instrumented")
+    finally:
+        db.close_connection(cursor)
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert records == list(db.QUERY_LOG)
+    assert [record["rows"] for record in records] == [None, 5, 2, 3, None, None]
+    assert all(record["seconds"] >= 0 for record in records)
+    assert records[1]["statement"] == "INSERT INTO instrumented SELECT range FROM range(5)"
+    assert records[1]["profile"]["children"][0]["name"] == "INSERT"
+    assert records[3]["profile"]["children"][0]["cardinality"] == 3
+    assert "Catalog Error" in records[4]["error"]
+
+def test_instrumented_cursor_sql_and_register():
+    db.QUERY_LOG.clear()
+    cursor = db.InstrumentedCursor(db.connect_to_db(DATABASE_NAME))
+    try:
+        cursor.register("registered", duckdb.sql("SELECT range AS i FROM range(4)").arrow())
+        relation = cursor.sql("SELECT i FROM registered WHERE i > 0")
+        assert relation.columns == ["i"]
+        assert relation.fetchall() == [(1,), (2,), (3,)]
+        assert cursor.sql("CREATE OR REPLACE TEMP TABLE instrumented AS SELECT 1") is None
+        with pytest.raises(Exception):
+            cursor.sql("SELECT * FROM missing_table")
+    finally:
+        db.close_connection(cursor)
+    assert [(record["statement"], record["rows"]) for record in db.QUERY_LOG] == [
+        ("REGISTER registered", None),
+        ("SELECT i FROM registered WHERE i > 0", 3),
+        ("CREATE OR REPLACE TEMP TABLE instrumented AS SELECT 1", None),
+        ("SELECT * FROM missing_table", None)]
+    assert "Catalog Error" in db.QUERY_LOG[-1]["error"]
+
+def test_configure_instrumentation():
+    try:
+        db.configure_instrumentation(True)
+        with db.pooled_cursor(DATABASE_NAME) as cursor:
+            assert isinstance(cursor, db.InstrumentedCursor)
+            assert isinstance(cursor.cursor(), db.InstrumentedCursor)
+            assert cursor.execute("SELECT 42").fetchone() == (42,)
+        assert db.QUERY_LOG[-1]["statement"] == "SELECT 42"
+        db.configure_instrumentation(False)
+        with db.pooled_cursor(DATABASE_NAME) as cursor:
+            assert not isinstance(cursor, db.InstrumentedCursor)
+    finally:
+        db.configure_instrumentation(False)
+        db.close_pool(DATABASE_NAME)
+
 def test_create_schema(cursor):
     db.create_schema(cursor, DATABASE_NAME, SCHEMA_NAME)
     assert db.schema_exists(cursor, SCHEMA_NAME)
@@ -61,6 +206,49 @@ def test_table_exists(cursor):
     db.create_table(cursor, DATABASE_NAME, SCHEMA_NAME, TABLE_NAME, TABLE_SCHEMA, primary_key=None)
     assert db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
 
+def test_table_columns(cursor):
+    db.create_schema(cursor, DATABASE_NAME, SCHEMA_NAME)
+    db.create_table(cursor, DATABASE_NAME, SCHEMA_NAME, TABLE_NAME, TABLE_SCHEMA, primary_key=None)
+    columns = db.table_columns(cursor, SCHEMA_NAME, TABLE_NAME)
+    assert columns == {"Id": "VARCHAR", "PostId": "VARCHAR", "VoteTypeId": "VARCHAR", "CreationDate": "TIMESTAMP"}
+
+def test_table_exists_finds_views(cursor):
+    db.create_schema(cursor, DATABASE_NAME, SCHEMA_NAME)
+    cursor.execute(f"CREATE OR REPLACE VIEW {SCHEMA_NAME}.test_view AS SELECT 1")
+    assert db.table_exists(cursor, SCHEMA_NAME, "test_view")
+    cursor.execute(f"DROP VIEW {SCHEMA_NAME}.test_view")
+    assert not db.table_exists(cursor, SCHEMA_NAME, "test_view")
+
+def test_catalog_cache(cursor):
+    db.create_schema(cursor, DATABASE_NAME, SCHEMA_NAME)
+    cursor.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{TABLE_NAME}")
+    with db.catalog_cache(cursor):
+        assert db.schema_exists(cursor, SCHEMA_NAME)
+        assert not db.schema_exists(cursor, "missing_schema")
+        assert not db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
+        db.create_table(cursor, DATABASE_NAME, SCHEMA_NAME, TABLE_NAME, TABLE_SCHEMA, primary_key=None)
+        assert db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME.upper())
+        cursor.execute(f"DROP TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+        # Answered from the cache until it is invalidated
+        assert db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
+        db.invalidate_catalog(cursor)
+        assert not db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
+        with db.catalog_cache(cursor):
+            db.create_table(cursor, DATABASE_NAME, SCHEMA_NAME, TABLE_NAME, TABLE_SCHEMA, primary_key=None)
+        assert db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
+    assert cursor not in db.CATALOG_CACHE
+
+def test_catalog_cache_reads_the_catalog_once(cursor):
+    db.create_schema(cursor, DATABASE_NAME, SCHEMA_NAME)
+    db.create_table(cursor, DATABASE_NAME, SCHEMA_NAME, TABLE_NAME, TABLE_SCHEMA, primary_key=None)
+    with db.catalog_cache(cursor):
+        assert db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
+        cursor.close()
+        # The closed cursor can't run a query, so these are answered in memory
+        assert db.schema_exists(cursor, SCHEMA_NAME)
+        assert db.table_exists(cursor, SCHEMA_NAME, TABLE_NAME)
+        assert not db.table_exists(cursor, SCHEMA_NAME, "missing_table")
+
 def test_schema_exists(cursor):
     db.create_schema(cursor, DATABASE_NAME, SCHEMA_NAME)
     assert db.schema_exists(cursor, SCHEMA_NAME)
@@ -1,17 +1,55 @@
 import pytest
 import sys
 import os
+import io
+import bz2
+import gzip
 import json
+import tarfile
 import duckdb
+from equalexperts_dataeng_exercise import db
+from equalexperts_dataeng_exercise.outliers import WEEKLY_COUNTS_TABLE_NAME, ROLLING_BASELINE_TABLE_NAME, ROLLING_WEEKS, \
+    weekly_vote_counts_stale
 from equalexperts_dataeng_exercise.ingest import (
     fetch_data,
     filtered_and_formatted_data,
     pre_ingestion_db_activities,
     insert_batch,
+    insert_columns,
     insert_data_using_multithreading,
+    insert_data_streaming,
+    insert_data_using_duckdb,
+    ingest_file,
+    file_fingerprint,
+    split_file,
+    parse_file_in_parallel,
+    insert_data_using_parallel_parse,
+    stream_batches,
+    parse_arguments,
+    resolve_settings,
+    auto_tune,
+    estimate_row_count,
+    migrate_votes_table,
+    open_input,
+    expand_input_paths,
+    SeenIds,
+    bigint_key,
+    get_checkpoint,
+    load_file,
     main,
+    stage,
+    stage_report,
+    STAGE_REPORT,
     SCHEMA_NAME,
-    TABLE_NAME
+    TABLE_NAME,
+    RUNS_TABLE_NAME,
+    CHECKPOINTS_TABLE_NAME,
+    REJECTED_TABLE_NAME,
+    BATCH_COLUMNS,
+    DEDUP_BITMAP_MIN_BYTES,
+    CPU_CORES,
+    PARSE_WORKERS,
+    TYPED_SCHEMA
 )
 
 DATABASE = "warehouse.db"
@@ -34,6 +72,7 @@ def setup_database():
     # Clean up: Drop the schema and table after tests
     conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA_NAME} CASCADE")
     conn.close()
+    db.close_pool(DATABASE)
     if os.path.exists(DATABASE):
         os.remove(DATABASE)
 
@@ -81,8 +120,8 @@ def test_fetch_data_file_not_found():
     original_argv = sys.argv
     sys.argv = ["script_name.py", "non_existent_file.jsonl"]
     try:
-        data = fetch_data()
-        assert data == []
+        with pytest.raises(FileNotFoundError):
+            fetch_data()
     finally:
         sys.argv = original_argv
 
@@ -170,7 +209,21 @@ def test_insert_data_using_multithreading_failure():
     ]
 
     with pytest.raises(Exception):
-        insert_data_using_multithreading(filtered_entry)
+        insert_data_using_multithreading(filtered_entry, table_name="missing_table")
+
+def test_insert_data_using_multithreading_quarantines_missing_keys(setup_database):
+    conn = setup_database
+    pre_ingestion_db_activities()
+    filtered_entry = [
+        {"Id": "1", "PostId": "100", "VoteTypeId": "1", "CreationDate": "2024-01-01T00:00:00", "LineNumber": 1},
+        {"Idd": "4", "PostId": "102", "VoteTypeId": "3", "CreationDate": "2024-01-03T00:00:00", "LineNumber": 2}
+    ]
+    insert_data_using_multithreading(filtered_entry)
+    assert conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchall() == [("1",)]
+    rejected = conn.execute(f"SELECT LineNumber, Reason, PostId FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME}").fetchall()
+    assert rejected == [(2, "missing Id", "102")]
+    tables = conn.execute("SELECT table_name FROM information_schema.tables WHERE table_name LIKE '%worker%'").fetchall()
+    assert tables == []
 
 def test_insert_batch_failure():
     conn = duckdb.connect(DATABASE)
@@ -237,6 +290,847 @@ def test_main_success(setup_database, setup_test_file):
     finally:
         sys.argv = original_argv
 
+def test_stream_batches(setup_test_file):
+    with open(setup_test_file, "a") as file:
+        file.write(json.dumps({"Id": "1", "PostId": "100", "VoteTypeId": "1", "CreationDate": "2024-01-01T00:00:00"}) + "\n")
+    batches = list(stream_batches(setup_test_file, batch_size=3))
+    assert [len(batch["Id"]) for batch in batches] == [3, 1]
+    assert batches[0]["PostId"] == ["100", "101", "100"]
+    assert [vote_id for batch in batches for vote_id in batch["Id"]] == ["1", "2", "3", "4"]
+
+def test_insert_data_streaming(setup_database, setup_test_file):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    insert_data_streaming(setup_test_file, batch_size=2)
+    result = conn.execute(f"SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchall()
+    assert len(result) == 4
+
+def test_insert_data_streaming_failure(setup_database, monkeypatch):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    test_file_path = "two_votes.jsonl"
+    write_votes(test_file_path, [1, 2])
+    fail_on_call(monkeypatch, 2)
+    try:
+        with pytest.raises(duckdb.IOException):
+            insert_data_streaming(test_file_path, batch_size=1)
+        result = conn.execute(f"SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchall()
+        assert result == []
+    finally:
+        os.remove(test_file_path)
+
+def test_parse_arguments():
+    args = parse_arguments(["votes.jsonl", "--streaming", "--batch-size", "10"])
+    assert args.file_path == "votes.jsonl"
+    assert args.streaming is True
+    assert args.batch_size == 10
+    with pytest.raises(SystemExit):
+        parse_arguments(["votes.jsonl", "--batch-size", "0"])
+    args = parse_arguments(["votes.jsonl", "--query-log", "queries.jsonl", "--explain-analyze"])
+    assert (args.query_log, args.explain_analyze) == ("queries.jsonl", True)
+
+def test_main_streaming(setup_database, setup_test_file):
+    original_argv = sys.argv
+    try:
+        sys.argv = ['your_script_name', setup_test_file, "--streaming", "--batch-size", "3"]
+        main()
+        rows = setup_database.execute(f"SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchall()
+        assert len(rows) == 4
+    finally:
+        sys.argv = original_argv
+
+def test_stage():
+    STAGE_REPORT.clear()
+    with stage("load") as metrics:
+        metrics["rows"] = 10
+        with stage("fetch"):
+            pass
+    with pytest.raises(ValueError):
+        with stage("finish"):
+            raise ValueError("failed")
+    assert [metrics["stage"] for metrics in STAGE_REPORT] == ["load", "load.fetch", "finish"]
+    load, fetch, finish = STAGE_REPORT
+    assert load["wall_seconds"] >= fetch["wall_seconds"] >= 0
+    assert load["rows_per_second"] > 0 and fetch["rows_per_second"] is None
+    assert finish["failed"] is True and "failed" not in load
+    assert load["peak_rss_mb"] > 0 and load["rss_growth_mb"] >= 0
+    report = stage_report()
+    assert report["stages"] == STAGE_REPORT
+    assert report["wall_seconds"] == round(load["wall_seconds"] + finish["wall_seconds"], 6)
+    STAGE_REPORT.clear()
+
+def test_main_stage_report(setup_database, setup_test_file, tmp_path):
+    original_argv = sys.argv
+    report_path = tmp_path / "stages.json"
+    try:
+        sys.argv = ['your_script_name', setup_test_file, "--engine", "python", "--stage-report", str(report_path)]
+        main()
+        report = json.loads(report_path.read_text())
+        stages = {metrics["stage"]: metrics for metrics in report["stages"]}
+        assert list(stages) == ["fingerprint", "ddl", "load", "load.fetch", "load.filter", "load.insert", "finish"]
+        assert stages["load"]["rows"] == stages["finish"]["rows"] == 4
+        assert all(metrics["cpu_seconds"] >= 0 and metrics["peak_rss_mb"] > 0 for metrics in stages.values())
+        assert report["peak_rss_mb"] >= max(metrics["peak_rss_mb"] for metrics in stages.values())
+    finally:
+        sys.argv = original_argv
+
+def test_insert_data_using_duckdb(setup_database, setup_test_file):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    with open(setup_test_file, "a") as file:
+        file.write(json.dumps({"Id": "1", "PostId": "999", "VoteTypeId": "3", "CreationDate": "2024-02-01T00:00:00", "UserId": "7"}) + "\n")
+    insert_data_using_duckdb(setup_test_file)
+    result = conn.execute(f"SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+    assert len(result) == 4
+    assert result[0][:3] == ("1", "100", "1")
+
+def test_insert_data_using_duckdb_failure(setup_database):
+    with pytest.raises(duckdb.Error):
+        insert_data_using_duckdb("non_existent_file.jsonl")
+
+def test_ingest_file_falls_back_to_python_engine(setup_database, setup_test_file):
+    with open(setup_test_file, "a") as file:
+        file.write("{not json but the python engine stops here}\n")
+    ingest_file(setup_test_file, engine="duckdb", streaming=False)
+    result = setup_database.execute(f"SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchall()
+    assert len(result) == 4
+
+def test_parse_arguments_engine():
+    assert parse_arguments(["votes.jsonl"]).engine == "duckdb"
+    assert parse_arguments(["votes.jsonl", "--streaming"]).engine == "python"
+    assert parse_arguments(["votes.jsonl", "--engine", "python"]).engine == "python"
+    with pytest.raises(SystemExit):
+        parse_arguments(["votes.jsonl", "--engine", "spark"])
+
+def write_votes(file_path, ids, post_id="100"):
+    with open(file_path, "w") as file:
+        for vote_id in ids:
+            file.write(json.dumps({"Id": str(vote_id), "PostId": post_id, "VoteTypeId": "2", "CreationDate": "2024-01-01T00:00:00"}) + "\n")
+
+def test_file_fingerprint(setup_test_file):
+    assert file_fingerprint(setup_test_file) == file_fingerprint(setup_test_file)
+    with open(setup_test_file, "a") as file:
+        file.write("\n")
+    assert len(file_fingerprint(setup_test_file)) == 64
+
+def test_file_fingerprint_reads_only_the_head(setup_test_file, monkeypatch):
+    from equalexperts_dataeng_exercise import ingest
+    monkeypatch.setattr(ingest, "FINGERPRINT_HEAD_BYTES", 10)
+    stat = os.stat(setup_test_file)
+    fingerprint = file_fingerprint(setup_test_file)
+    with open(setup_test_file, "r+b") as file:
+        file.seek(20)
+        file.write(b"9")
+    os.utime(setup_test_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert file_fingerprint(setup_test_file) == fingerprint
+    os.utime(setup_test_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert file_fingerprint(setup_test_file) != fingerprint
+
+def test_ingest_file_incremental(setup_database):
+    conn = setup_database
+    first_drop, second_drop = "votes_day_1.jsonl", "votes_day_2.jsonl"
+    write_votes(first_drop, [1, 2, 3])
+    write_votes(second_drop, [2, 3, 4, 5], post_id="200")
+    try:
+        ingest_file(first_drop)
+        ingest_file(second_drop, incremental=True)
+        ingest_file(second_drop, incremental=True)
+        rows = conn.execute(f"SELECT Id, PostId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [("1", "100"), ("2", "100"), ("3", "100"), ("4", "200"), ("5", "200")]
+        runs = conn.execute(f"SELECT Mode, MaxId, RowsInserted FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} ORDER BY RunId").fetchall()
+        assert runs[-2:] == [("full", 3, 3), ("incremental", 5, 2)]
+    finally:
+        os.remove(first_drop)
+        os.remove(second_drop)
+
+def test_ingest_file_incremental_upserts_staged_duplicates(setup_database):
+    conn = setup_database
+    first_drop, second_drop = "votes_day_1.jsonl", "votes_day_2.jsonl"
+    write_votes(first_drop, [1])
+    write_votes(second_drop, [7, 7, 8], post_id="300")
+    try:
+        ingest_file(first_drop)
+        conn.execute(f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} VALUES ('7', '999', '2', '2024-01-01T00:00:00')")
+        ingest_file(second_drop, engine="python", streaming=True, incremental=True)
+        rows = conn.execute(f"SELECT Id, PostId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [("1", "100"), ("7", "300"), ("8", "300")]
+    finally:
+        os.remove(first_drop)
+        os.remove(second_drop)
+
+@pytest.mark.parametrize("options", [
+    {"engine": "duckdb"},
+    {"engine": "python"},
+    {"engine": "python", "streaming": True},
+    {"engine": "parallel"},
+    {"engine": "python", "resumable": True},
+])
+def test_ingest_file_incremental_stages_only_rows_beyond_watermark(setup_database, options):
+    conn = setup_database
+    first_drop, second_drop = "votes_day_1.jsonl", "votes_day_2.jsonl"
+    write_votes(first_drop, [1, 2, 3])
+    write_votes(second_drop, [2, 3, 4, 5], post_id="200")
+    with open(second_drop, "a") as file:
+        file.write(json.dumps({"Id": "1", "PostId": "200", "VoteTypeId": "2", "CreationDate": "not a date"}) + "\n")
+    try:
+        ingest_file(first_drop)
+        STAGE_REPORT.clear()
+        ingest_file(second_drop, incremental=True, **options)
+        load = next(metrics for metrics in STAGE_REPORT if metrics["stage"] == "load")
+        assert load["rows"] == 2
+        rows = conn.execute(f"SELECT Id, PostId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [("1", "100"), ("2", "100"), ("3", "100"), ("4", "200"), ("5", "200")]
+        assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME}").fetchone()[0] == 0
+    finally:
+        STAGE_REPORT.clear()
+        os.remove(first_drop)
+        os.remove(second_drop)
+
+def test_parse_arguments_incremental():
+    assert parse_arguments(["votes.jsonl"]).incremental is False
+    assert parse_arguments(["votes.jsonl", "--incremental"]).incremental is True
+
+def test_split_file(setup_test_file):
+    ranges = split_file(setup_test_file, 3)
+    with open(setup_test_file, "rb") as file:
+        content = file.read()
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(content)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    assert all(content[start - 1:start] == b"\n" for start, _ in ranges[1:])
+    assert len(split_file(setup_test_file, 100)) == 4
+
+def test_parse_file_in_parallel_dedups_across_ranges():
+    test_file_path = "parallel_data.jsonl"
+    write_votes(test_file_path, [1, 2, 3, 1, 4, 2, 5, 3])
+    try:
+        columns = parse_file_in_parallel(test_file_path, num_workers=2)
+        assert columns["Id"] == ["1", "2", "3", "4", "5"]
+        assert list(columns) == list(BATCH_COLUMNS)
+        assert columns["LineNumber"] == [1, 2, 3, 5, 7]
+    finally:
+        os.remove(test_file_path)
+
+def test_insert_data_using_parallel_parse(setup_database, setup_test_file):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    insert_data_using_parallel_parse(setup_test_file, num_workers=2)
+    result = conn.execute(f"SELECT * FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchall()
+    assert len(result) == 4
+
+def test_insert_columns(setup_database):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    columns = {
+        "Id": ["1", "2"],
+        "PostId": ["100", "101"],
+        "VoteTypeId": ["1", "2"],
+        "CreationDate": ["2024-01-01T00:00:00", "2024-01-02T00:00:00"]
+    }
+    insert_columns(conn, columns)
+    result = conn.execute(f"SELECT Id, CreationDate FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+    assert [row[0] for row in result] == ["1", "2"]
+    assert str(result[1][1]) == "2024-01-02 00:00:00"
+
+def test_insert_columns_without_pyarrow(setup_database, monkeypatch):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    monkeypatch.setattr("equalexperts_dataeng_exercise.ingest.pyarrow", None)
+    columns = {"Id": ["1"], "PostId": ["100"], "VoteTypeId": ["1"], "CreationDate": ["2024-01-01T00:00:00"]}
+    insert_columns(conn, columns)
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 1
+
+def test_insert_columns_failure(setup_database):
+    columns = {"Id": ["1"], "PostId": ["100"], "VoteTypeId": ["1"], "CreationDate": ["2024-01-01T00:00:00"]}
+    with pytest.raises(duckdb.Error):
+        insert_columns(setup_database, columns, table_name="missing_table")
+
+@pytest.mark.parametrize("options", [
+    {"engine": "duckdb"},
+    {"engine": "python"},
+    {"engine": "python", "streaming": True, "batch_size": 2},
+    {"engine": "parallel"},
+    {"engine": "python", "resumable": True, "batch_size": 2},
+])
+def test_ingest_file_numeric_values(setup_database, tmp_path, options):
+    conn = setup_database
+    file_path = tmp_path / "numeric_votes.jsonl"
+    file_path.write_text("".join(json.dumps(entry) + "\n" for entry in [
+        {"Id": 2, "PostId": 100, "VoteTypeId": 2, "CreationDate": "2024-01-01T00:00:00"},
+        {"Id": "3", "PostId": 101, "VoteTypeId": "1", "CreationDate": "2024-01-02T00:00:00"},
+        {"Id": 2, "PostId": 102, "VoteTypeId": 2, "CreationDate": "2024-01-03T00:00:00"},
+    ]))
+    ingest_file(str(file_path), **options)
+    rows = conn.execute(f"SELECT Id, PostId, VoteTypeId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+    assert rows == [("2", "100", "2"), ("3", "101", "1")]
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME}").fetchone()[0] == 0
+
+def test_insert_data_using_multithreading_more_threads_than_rows(setup_database):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    filtered_entry = [
+        {"Id": "1", "PostId": "100", "VoteTypeId": "1", "CreationDate": "2024-01-01T00:00:00"},
+        {"Id": "2", "PostId": "101", "VoteTypeId": "2", "CreationDate": "2024-01-02T00:00:00"}
+    ]
+    insert_data_using_multithreading(filtered_entry, num_threads=8)
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 2
+    worker_tables = conn.execute(
+        f"SELECT table_name FROM information_schema.tables WHERE table_name LIKE '{TABLE_NAME}_worker_%'").fetchall()
+    assert worker_tables == []
+
+def test_insert_data_using_multithreading_worker_failure(setup_database, monkeypatch):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    filtered_entry = [
+        {"Id": "1", "PostId": "100", "VoteTypeId": "1", "CreationDate": "2024-01-01T00:00:00"},
+        {"Id": "2", "PostId": "101", "VoteTypeId": "2", "CreationDate": "2024-01-02T00:00:00"}
+    ]
+    fail_on_call(monkeypatch, 2)
+    with pytest.raises(Exception):
+        insert_data_using_multithreading(filtered_entry, num_threads=2)
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 0
+    worker_tables = conn.execute(
+        f"SELECT table_name FROM information_schema.tables WHERE table_name LIKE '{TABLE_NAME}_worker_%'").fetchall()
+    assert worker_tables == []
+
+def test_estimate_row_count(setup_test_file):
+    assert estimate_row_count(setup_test_file) == 4
+    assert estimate_row_count(setup_test_file, sample_bytes=100) in (3, 4, 5)
+
+def test_auto_tune(setup_test_file):
+    settings = auto_tune(setup_test_file)
+    assert settings["threads"] == settings["duckdb_threads"] == CPU_CORES >= 1
+    assert settings["batch_size"] == 10000
+    assert settings["memory_limit"] is None or settings["memory_limit"].endswith("MB")
+
+@pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="CPU affinity is not exposed on this platform")
+def test_cpu_cores_follow_the_affinity():
+    assert CPU_CORES == PARSE_WORKERS == len(os.sched_getaffinity(0))
+
+def test_resolve_settings_precedence(setup_test_file, monkeypatch):
+    monkeypatch.setenv("INGEST_THREADS", "6")
+    monkeypatch.setenv("INGEST_MEMORY_LIMIT", "1GB")
+    settings = resolve_settings(parse_arguments([setup_test_file, "--auto-tune", "--batch-size", "500"]))
+    assert settings["threads"] == 6
+    assert settings["memory_limit"] == "1GB"
+    assert settings["batch_size"] == 500
+    assert settings["duckdb_threads"] >= 1
+    assert settings["temp_directory"] is None
+
+def test_resolve_settings_defaults(setup_test_file):
+    settings = resolve_settings(parse_arguments([setup_test_file]))
+    assert settings == {"threads": None, "batch_size": 50000, "duckdb_threads": None,
+                        "memory_limit": None, "temp_directory": None}
+
+def test_main_with_tuning_options(setup_database, setup_test_file):
+    conn = setup_database
+    original_argv = sys.argv
+    try:
+        sys.argv = ['your_script_name', setup_test_file, "--engine", "python",
+                    "--threads", "5", "--batch-size", "1", "--duckdb-threads", "2", "--memory-limit", "1GB"]
+        main()
+        assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 4
+        assert conn.execute("SELECT current_setting('threads')").fetchone()[0] == 2
+    finally:
+        sys.argv = original_argv
+        conn.execute("RESET threads")
+        conn.execute("RESET memory_limit")
+        db.configure_database(DATABASE, {})
+
+def test_ingest_file_typed_schema(setup_database, setup_test_file):
+    conn = setup_database
+    try:
+        for engine in ("duckdb", "python", "parallel"):
+            ingest_file(setup_test_file, engine=engine, typed_schema=True)
+            columns = db.table_columns(conn, SCHEMA_NAME, TABLE_NAME)
+            assert list(columns.values()) == ["BIGINT", "BIGINT", "UTINYINT", "TIMESTAMP"]
+            rows = conn.execute(f"SELECT Id, PostId, VoteTypeId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+            assert rows[0] == (1, 100, 1) and len(rows) == 4
+    finally:
+        conn.execute(f"DROP TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+        conn.execute(f"CREATE TABLE {SCHEMA_NAME}.{TABLE_NAME} (Id STRING, PostId STRING, VoteTypeId STRING, CreationDate TIMESTAMP)")
+
+@pytest.mark.parametrize("options", [
+    {"engine": "duckdb"},
+    {"engine": "python"},
+    {"engine": "python", "streaming": True, "batch_size": 2},
+    {"engine": "parallel"},
+    {"engine": "python", "resumable": True, "batch_size": 2},
+])
+def test_ingest_file_typed_schema_deduplicates_numeric_ids(setup_database, tmp_path, options):
+    conn = setup_database
+    file_path = tmp_path / "typed_votes.jsonl"
+    file_path.write_text("".join(json.dumps(entry) + "\n" for entry in [
+        {"Id": "007", "PostId": "100", "VoteTypeId": "1", "CreationDate": "2024-01-01T00:00:00"},
+        {"Id": 2, "PostId": "101", "VoteTypeId": "1", "CreationDate": "2024-01-02T00:00:00"},
+        {"Id": "7", "PostId": "102", "VoteTypeId": "1", "CreationDate": "2024-01-03T00:00:00"},
+        {"Id": "2.0", "PostId": "103", "VoteTypeId": "1", "CreationDate": "2024-01-04T00:00:00"},
+        {"Id": "3", "PostId": "104", "VoteTypeId": "1", "CreationDate": "2024-01-05T00:00:00"},
+    ]))
+    try:
+        ingest_file(str(file_path), typed_schema=True, **options)
+        rows = conn.execute(f"SELECT Id, PostId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [(2, 101), (3, 104), (7, 100)]
+    finally:
+        conn.execute(f"DROP TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+        conn.execute(f"CREATE TABLE {SCHEMA_NAME}.{TABLE_NAME} (Id STRING, PostId STRING, VoteTypeId STRING, CreationDate TIMESTAMP)")
+
+def test_ingest_file_incremental_migrates_to_typed_schema(setup_database):
+    conn = setup_database
+    first_drop, second_drop = "votes_day_1.jsonl", "votes_day_2.jsonl"
+    write_votes(first_drop, [1, 2])
+    write_votes(second_drop, [3])
+    try:
+        ingest_file(first_drop)
+        ingest_file(second_drop, incremental=True, typed_schema=True)
+        columns = db.table_columns(conn, SCHEMA_NAME, TABLE_NAME)
+        assert list(columns.values()) == list(TYPED_SCHEMA.values())
+        rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [(1,), (2,), (3,)]
+    finally:
+        os.remove(first_drop)
+        os.remove(second_drop)
+        conn.execute(f"DROP TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+        conn.execute(f"CREATE TABLE {SCHEMA_NAME}.{TABLE_NAME} (Id STRING, PostId STRING, VoteTypeId STRING, CreationDate TIMESTAMP)")
+
+def test_migrate_votes_table_failure_keeps_table(setup_database):
+    conn = setup_database
+    conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+    conn.execute(f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} VALUES ('not a number', '100', '1', '2024-01-01T00:00:00')")
+    cursor = conn.cursor()
+    with pytest.raises(duckdb.Error):
+        migrate_votes_table(cursor, TYPED_SCHEMA)
+    columns = db.table_columns(conn, SCHEMA_NAME, TABLE_NAME)
+    assert columns["Id"] == "VARCHAR"
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 1
+
+@pytest.fixture
+def compressed_test_files(setup_test_file):
+    """
+    Fixture writing the test file as .gz, .bz2 and as a member of a .tar.gz archive.
+    """
+    with open(setup_test_file, "rb") as file:
+        content = file.read()
+    with gzip.open("test_data.jsonl.gz", "wb") as file:
+        file.write(content)
+    with bz2.open("test_data.jsonl.bz2", "wb") as file:
+        file.write(content)
+    with tarfile.open("test_data.tar.gz", "w:gz") as archive:
+        readme = tarfile.TarInfo("votes/README")
+        readme.size = 5
+        archive.addfile(readme, io.BytesIO(b"votes"))
+        member = tarfile.TarInfo("votes/test_data.jsonl")
+        member.size = len(content)
+        archive.addfile(member, io.BytesIO(content))
+    paths = ["test_data.jsonl.gz", "test_data.jsonl.bz2", "test_data.tar.gz"]
+    yield paths
+    for path in paths:
+        os.remove(path)
+
+def test_open_input_compressed(setup_test_file, compressed_test_files):
+    with open(setup_test_file) as file:
+        expected = file.read()
+    for path in compressed_test_files + ["test_data.tar.gz::test_data.jsonl", "test_data.tar.gz::votes/test_data.jsonl"]:
+        with open_input(path) as file:
+            assert file.read() == expected
+    with pytest.raises(FileNotFoundError):
+        with open_input("test_data.tar.gz::missing.jsonl"):
+            pass
+
+def test_open_input_zstd_requires_zstandard(monkeypatch):
+    from equalexperts_dataeng_exercise import ingest
+    monkeypatch.setattr(ingest, "zstandard", None)
+    write_votes("test_data.jsonl.zst", [1])
+    try:
+        with pytest.raises(ImportError):
+            with open_input("test_data.jsonl.zst"):
+                pass
+    finally:
+        os.remove("test_data.jsonl.zst")
+
+@pytest.mark.parametrize("options", [
+    {"engine": "python"},
+    {"engine": "python", "streaming": True},
+    {"engine": "parallel"},
+    {"engine": "duckdb", "resumable": True},
+])
+def test_ingest_file_zstd_without_zstandard_keeps_votes(setup_database, setup_test_file, monkeypatch, options):
+    from equalexperts_dataeng_exercise import ingest
+    conn = setup_database
+    ingest_file(setup_test_file)
+    runs = conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}").fetchone()[0]
+    monkeypatch.setattr(ingest, "zstandard", None)
+    write_votes("test_data.jsonl.zst", [1])
+    try:
+        with pytest.raises(ImportError, match="zstandard"):
+            ingest_file("test_data.jsonl.zst", **options)
+        assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 4
+        assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}").fetchone()[0] == runs
+    finally:
+        os.remove("test_data.jsonl.zst")
+
+def test_open_input_zstd(setup_test_file):
+    zstandard = pytest.importorskip("zstandard")
+    with open(setup_test_file, "rb") as file:
+        content = file.read()
+    with open("test_data.jsonl.zst", "wb") as file:
+        file.write(zstandard.ZstdCompressor().compress(content))
+    try:
+        with open_input("test_data.jsonl.zst", text=False) as file:
+            assert file.read() == content
+    finally:
+        os.remove("test_data.jsonl.zst")
+
+def test_load_file_compressed(setup_database, compressed_test_files):
+    conn = setup_database
+    for path in compressed_test_files:
+        for engine in ("duckdb", "parallel", "python"):
+            conn.execute(f"TRUNCATE TABLE {SCHEMA_NAME}.{TABLE_NAME}")
+            load_file(path, TABLE_NAME, engine)
+            count = conn.execute(f"SELECT COUNT(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0]
+            assert count == 4, (path, engine)
+
+def test_file_fingerprint_tar_members(compressed_test_files):
+    assert file_fingerprint("test_data.tar.gz::a.jsonl") != file_fingerprint("test_data.tar.gz::b.jsonl")
+    assert file_fingerprint("test_data.tar.gz") != file_fingerprint("test_data.tar.gz::a.jsonl")
+
+def test_estimate_row_count_compressed(compressed_test_files):
+    for path in compressed_test_files:
+        assert estimate_row_count(path) > 0
+
+@pytest.fixture
+def shard_directory(tmp_path):
+    """
+    Fixture writing three hourly shards, one compressed, that repeat Ids across shards.
+    """
+    write_votes(tmp_path / "votes-2024-08-19-00.jsonl", [1, 2], post_id="100")
+    write_votes(tmp_path / "votes-2024-08-19-01.jsonl", [2, 3], post_id="101")
+    with gzip.open(tmp_path / "votes-2024-08-19-02.jsonl.gz", "wt") as file:
+        for i in (3, 4):
+            file.write(json.dumps({"Id": str(i), "PostId": "102", "VoteTypeId": "2",
+                                   "CreationDate": "2024-01-01T00:00:00"}) + "\n")
+    (tmp_path / "notes.txt").write_text("not a shard")
+    return tmp_path
+
+def test_expand_input_paths(shard_directory):
+    shards = [str(shard_directory / f"votes-2024-08-19-0{hour}.jsonl") for hour in (0, 1)]
+    assert expand_input_paths(shard_directory) == shards + [shards[1].replace("01.jsonl", "02.jsonl.gz")]
+    assert expand_input_paths(shard_directory / "votes-2024-08-19-0[01].jsonl") == shards
+    assert expand_input_paths(shards[0]) == [shards[0]]
+    with pytest.raises(FileNotFoundError):
+        expand_input_paths(shard_directory / "votes-2025-*.jsonl")
+
+def test_ingest_file_shards(setup_database, shard_directory):
+    conn = setup_database
+    patterns = [shard_directory, shard_directory / "votes-2024-08-19-*.jsonl*"]
+    for pattern in patterns:
+        for engine, streaming in (("duckdb", False), ("parallel", False), ("python", False), ("python", True)):
+            ingest_file(pattern, engine=engine, streaming=streaming)
+            rows = conn.execute(f"SELECT Id, PostId FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+            assert rows == [("1", "100"), ("2", "100"), ("3", "101"), ("4", "102")], (engine, streaming)
+
+def test_file_fingerprint_shards(shard_directory):
+    fingerprint = file_fingerprint(shard_directory)
+    assert fingerprint == file_fingerprint(shard_directory / "*.jsonl*")
+    write_votes(shard_directory / "votes-2024-08-19-03.jsonl", [5])
+    assert file_fingerprint(shard_directory) != fingerprint
+
+def test_seen_ids_first_occurrence():
+    seen = SeenIds()
+    keys = ["3", "1", "3", "007", "7", "abc", "abc", 7, "-1", "-1", "0", "0"]
+    assert [seen.add_new(key) for key in keys] == [True, True, False, True, True, True, False, False, True, False, True, False]
+    assert seen.others == {"007", "abc", "-1"}
+
+def test_seen_ids_typed_compares_numbers():
+    seen = SeenIds(typed=True)
+    keys = ["007", "7", " 7 ", 7, 2, "2.0", 2.0, "abc", "abc", "-1", "-1.0", "1e1", "10"]
+    assert [seen.add_new(key) for key in keys] == [True, False, False, False, True, False, False, True, False, True, False,
+                                                   True, False]
+    assert seen.others == {"abc", -1}
+
+@pytest.mark.parametrize("key", ["7", "007", " 7\n", "+7", "-0", "2.0", "2.5", "-2.5", "1.49999", ".5", "5.", "1e3",
+                                 "7e+2", "1e-1", "1e30", "0x10", "0XfF", "0B101", "-0x10", "0x", "1_000", "\u0663",
+                                 "9223372036854775807", "9223372036854775807.5", "-9223372036854775808", "abc", "",
+                                 2, 2.0, 1e400, True])
+def test_bigint_key_matches_duckdb_cast(key):
+    text = key if isinstance(key, str) else json.dumps(key)
+    expected = duckdb.connect().execute("SELECT TRY_CAST(CAST(? AS VARCHAR) AS BIGINT)", [text]).fetchone()[0]
+    assert bigint_key(key) == expected
+
+def test_seen_ids_warns_once_when_sets_grow_large(monkeypatch, caplog):
+    from equalexperts_dataeng_exercise import ingest
+    monkeypatch.setattr(ingest, "DEDUP_SET_WARNING_IDS", 3)
+    seen = SeenIds()
+    for key in ["a", "b", 10 ** 12, "c", 10 ** 13]:
+        assert seen.add_new(key)
+    warnings = [record for record in caplog.records if "held in sets" in record.getMessage()]
+    assert len(warnings) == 1 and warnings[0].levelname == "WARNING"
+
+def test_seen_ids_bitmap_is_compact():
+    seen = SeenIds()
+    for key in range(1_000_000):
+        assert seen.add_new(str(key))
+    assert len(seen.bitmap) <= 2 * 1_000_000 // 8
+    assert not seen.others
+
+def test_seen_ids_beyond_max_id():
+    seen = SeenIds(max_id=64)
+    assert seen.add_new("63") and seen.add_new("64") and seen.add_new("10000000000")
+    assert not seen.add_new("64")
+    assert len(seen.bitmap) == 8
+    assert seen.sparse == {64, 10000000000}
+
+def test_seen_ids_huge_id_keeps_bitmap_small():
+    seen = SeenIds()
+    assert seen.add_new("4294967000") and seen.add_new(1)
+    assert not seen.add_new(4294967000)
+    assert len(seen.bitmap) <= DEDUP_BITMAP_MIN_BYTES
+    assert seen.sparse == {4294967000}
+
+def test_seen_ids_bitmap_grows_over_sparse_ids(monkeypatch):
+    from equalexperts_dataeng_exercise import ingest
+    monkeypatch.setattr(ingest, "DEDUP_BITMAP_MIN_BYTES", 1)
+    monkeypatch.setattr(ingest, "DEDUP_BITMAP_BYTES_PER_ID", 1)
+    seen = SeenIds()
+    assert seen.add_new("100")
+    assert seen.sparse == {100}
+    for key in range(100):
+        assert seen.add_new(key)
+    assert not seen.sparse and len(seen.bitmap) <= 2 * 100 // 8
+    assert not seen.add_new("100")
+
+def fail_on_call(monkeypatch, call_number):
+    """
+    Make the nth insert_columns call of a load fail, like a transient error would.
+    """
+    from equalexperts_dataeng_exercise import ingest
+    original = ingest.insert_columns
+    calls = []
+
+    def flaky_insert_columns(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == call_number:
+            raise duckdb.IOException("transient failure")
+        return original(*args, **kwargs)
+    monkeypatch.setattr(ingest, "insert_columns", flaky_insert_columns)
+
+def test_ingest_file_resumable(setup_database, setup_test_file):
+    conn = setup_database
+    ingest_file(setup_test_file, batch_size=3, resumable=True)
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 4
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{CHECKPOINTS_TABLE_NAME}").fetchone()[0] == 0
+
+def test_ingest_file_resumes_from_checkpoint(setup_database, monkeypatch):
+    conn = setup_database
+    file_path = "votes_resumable.jsonl"
+    write_votes(file_path, [1, 2, 1, 3, 4], post_id="100")
+    with open(file_path) as file:
+        first_line_length = len(file.readline())
+    try:
+        fail_on_call(monkeypatch, 2)
+        with pytest.raises(duckdb.IOException):
+            ingest_file(file_path, batch_size=1, resumable=True)
+        checkpoint = get_checkpoint(file_fingerprint(file_path), TABLE_NAME)
+        assert checkpoint["ByteOffset"] == first_line_length
+        assert checkpoint["LastId"] == "1" and checkpoint["RowsCommitted"] == 1
+        assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{TABLE_NAME}").fetchone()[0] == 1
+
+        monkeypatch.undo()
+        ingest_file(file_path, batch_size=1, resumable=True)
+        rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [("1",), ("2",), ("3",), ("4",)]
+        assert get_checkpoint(file_fingerprint(file_path), TABLE_NAME) is None
+        run = conn.execute(f"SELECT Mode, RowsInserted FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} ORDER BY RunId DESC LIMIT 1").fetchone()
+        assert run == ("full", 4)
+    finally:
+        os.remove(file_path)
+
+def test_ingest_file_resume_reads_committed_keys_in_batches(setup_database, monkeypatch):
+    conn = setup_database
+    file_path = "votes_resumable.jsonl"
+    write_votes(file_path, [1, 2, 3, 2, 1, 4, 3], post_id="100")
+    try:
+        fail_on_call(monkeypatch, 4)
+        with pytest.raises(duckdb.IOException):
+            ingest_file(file_path, batch_size=1, resumable=True)
+        assert get_checkpoint(file_fingerprint(file_path), TABLE_NAME)["RowsCommitted"] == 3
+        monkeypatch.undo()
+        ingest_file(file_path, batch_size=1, resumable=True)
+        rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [("1",), ("2",), ("3",), ("4",)]
+    finally:
+        os.remove(file_path)
+
+def write_vote_lines(file_path, votes):
+    with open(file_path, "w") as file:
+        for vote_id, creation_date in votes:
+            file.write(json.dumps({"Id": vote_id, "PostId": "100", "VoteTypeId": "2", "CreationDate": creation_date}) + "\n")
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_ingest_file_resume_treats_quarantined_keys_as_seen(setup_database, monkeypatch, incremental):
+    conn = setup_database
+    file_path = "votes_resumable.jsonl"
+    valid, invalid = "2024-01-01T00:00:00", "not a date"
+    try:
+        # An earlier run quarantined Id 12 of another file at the same path, which must not count as seen
+        write_vote_lines(file_path, [("1", valid), ("12", invalid)])
+        ingest_file(file_path)
+        # Id 15 is quarantined before the crash, so its repeat after the crash is a duplicate
+        write_vote_lines(file_path, [("15", invalid), ("11", valid), ("12", valid), ("15", valid), ("13", valid)])
+        fail_on_call(monkeypatch, 3)
+        with pytest.raises(duckdb.IOException):
+            ingest_file(file_path, batch_size=1, incremental=incremental, resumable=True)
+        monkeypatch.undo()
+        ingest_file(file_path, batch_size=1, incremental=incremental, resumable=True)
+        rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == ([("1",)] if incremental else []) + [("11",), ("12",), ("13",)]
+        rejected = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME} ORDER BY RejectedAt").fetchall()
+        assert rejected == ([("12",)] if incremental else []) + [("15",)]
+    finally:
+        os.remove(file_path)
+
+def test_ingest_file_full_load_discards_checkpoints(setup_database, setup_test_file, monkeypatch):
+    conn = setup_database
+    fail_on_call(monkeypatch, 2)
+    with pytest.raises(duckdb.IOException):
+        ingest_file(setup_test_file, batch_size=1, resumable=True)
+    monkeypatch.undo()
+    ingest_file(setup_test_file)
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{CHECKPOINTS_TABLE_NAME}").fetchone()[0] == 0
+
+def test_ingest_file_incremental_resumable(setup_database, monkeypatch):
+    conn = setup_database
+    first_drop, second_drop = "votes_day_1.jsonl", "votes_day_2.jsonl"
+    write_votes(first_drop, [1, 2])
+    write_votes(second_drop, [3, 4, 5], post_id="200")
+    try:
+        ingest_file(first_drop)
+        fail_on_call(monkeypatch, 3)
+        with pytest.raises(duckdb.IOException):
+            ingest_file(second_drop, batch_size=1, incremental=True, resumable=True)
+        monkeypatch.undo()
+        ingest_file(second_drop, batch_size=1, incremental=True, resumable=True)
+        rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+        assert rows == [("1",), ("2",), ("3",), ("4",), ("5",)]
+    finally:
+        os.remove(first_drop)
+        os.remove(second_drop)
+
+
+MESSY_LINES = [
+    json.dumps({"Id": "1", "PostId": "100", "VoteTypeId": "2", "CreationDate": "2024-01-01T00:00:00"}),
+    '{"Id": "2", "PostId": ',
+    "",
+    json.dumps(["not", "an", "object"]),
+    json.dumps({"Id": "3", "PostId": "100", "VoteTypeId": "2", "CreationDate": "not a date"}),
+    json.dumps({"Id": "4", "PostId": "100", "VoteTypeId": "2"}),
+    json.dumps({"Id": "5", "PostId": "100", "VoteTypeId": "2", "CreationDate": "2024-01-02T00:00:00"}),
+]
+
+@pytest.fixture
+def messy_test_file(tmp_path):
+    file_path = tmp_path / "messy_votes.jsonl"
+    file_path.write_text("\n".join(MESSY_LINES) + "\n")
+    return str(file_path)
+
+@pytest.mark.parametrize("options", [
+    {"engine": "duckdb"},
+    {"engine": "python"},
+    {"engine": "python", "streaming": True, "batch_size": 2},
+    {"engine": "parallel"},
+    {"engine": "python", "resumable": True, "batch_size": 2},
+])
+def test_ingest_file_quarantines_bad_rows(setup_database, messy_test_file, options):
+    conn = setup_database
+    ingest_file(messy_test_file, **options)
+    rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+    assert rows == [("1",), ("5",)]
+    rejected = conn.execute(f"""
+        SELECT LineNumber, Reason, Id, RawLine FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME} ORDER BY LineNumber
+    """).fetchall()
+    assert [(line, reason.split(":")[0], vote_id, raw_line) for line, reason, vote_id, raw_line in rejected] == [
+        (2, "invalid JSON", None, MESSY_LINES[1]),
+        (4, "not a JSON object", None, MESSY_LINES[3]),
+        (5, "CreationDate is not a valid TIMESTAMP", "3", None),
+        (6, "missing CreationDate", "4", None),
+    ]
+
+def test_fetch_data_skips_bad_lines(messy_test_file):
+    assert [entry["Id"] for entry in fetch_data(messy_test_file)] == ["1", "3", "4", "5"]
+
+@pytest.mark.parametrize("options", [
+    {"engine": "duckdb"},
+    {"engine": "python"},
+    {"engine": "python", "streaming": True, "batch_size": 2},
+    {"engine": "parallel"},
+    {"engine": "python", "resumable": True, "batch_size": 2},
+])
+@pytest.mark.parametrize("bad_line", [1, 4])
+def test_ingest_file_quarantines_invalid_utf8(setup_database, tmp_path, options, bad_line):
+    conn = setup_database
+    file_path = tmp_path / "invalid_utf8_votes.jsonl"
+    lines = [json.dumps({"Id": str(i), "PostId": "100", "VoteTypeId": "2",
+                         "CreationDate": "2024-01-01T00:00:00"}).encode() for i in range(1, 6)]
+    lines[bad_line - 1] = lines[bad_line - 1].replace(b'"100"', b'"\xff"')
+    file_path.write_bytes(b"\n".join(lines) + b"\n")
+    ingest_file(str(file_path), **options)
+    rows = conn.execute(f"SELECT Id FROM {SCHEMA_NAME}.{TABLE_NAME} ORDER BY Id").fetchall()
+    assert rows == [(str(i),) for i in range(1, 6) if i != bad_line]
+    rejected = conn.execute(f"SELECT LineNumber, Reason FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME}").fetchall()
+    assert [(line, reason.split(":")[0]) for line, reason in rejected] == [(bad_line, "invalid UTF-8")]
+
+def test_insert_stage_counts_only_inserted_rows(setup_database, messy_test_file):
+    STAGE_REPORT.clear()
+    ingest_file(messy_test_file, engine="python")
+    rows = {metrics["stage"]: metrics["rows"] for metrics in STAGE_REPORT}
+    assert rows["load.insert"] == 2
+    assert rows["load.filter"] > rows["load.insert"]
+    STAGE_REPORT.clear()
+
+def test_full_load_truncates_rejected_rows(setup_database, messy_test_file, setup_test_file):
+    conn = setup_database
+    ingest_file(messy_test_file)
+    ingest_file(setup_test_file)
+    assert conn.execute(f"SELECT count(*) FROM {SCHEMA_NAME}.{REJECTED_TABLE_NAME}").fetchone()[0] == 0
+
+
+def weekly_counts(conn):
+    return conn.execute(f"SELECT * FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME} ORDER BY ALL").fetchall()
+
+def test_ingest_file_counts_votes_per_week(setup_database, setup_test_file):
+    conn = setup_database
+    ingest_file(setup_test_file)
+    assert weekly_counts(conn) == conn.execute(f"""
+        SELECT strftime(CreationDate, '%Y'), CAST(strftime('%W', CreationDate) AS INTEGER), count(*)
+        FROM {SCHEMA_NAME}.{TABLE_NAME} GROUP BY ALL ORDER BY ALL
+    """).fetchall()
+
+def test_ingest_file_incremental_updates_touched_weeks(setup_database):
+    conn = setup_database
+    first_drop, second_drop = "votes_week_1.jsonl", "votes_week_2.jsonl"
+    write_votes(first_drop, [1, 2])
+    with open(second_drop, "w") as file:
+        file.write(json.dumps({"Id": "3", "PostId": "100", "VoteTypeId": "2", "CreationDate": "2024-01-08T00:00:00"}) + "\n")
+    try:
+        ingest_file(first_drop)
+        assert weekly_counts(conn) == [("2024", 1, 2)]
+        ingest_file(second_drop, incremental=True)
+        assert weekly_counts(conn) == [("2024", 1, 2), ("2024", 2, 1)]
+        assert not weekly_vote_counts_stale(conn.cursor())
+        assert conn.execute(f"""
+            SELECT Year, WeekNumber, RollingMeanVoteCount FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME}
+            WHERE RollingWeeks = {ROLLING_WEEKS} ORDER BY ALL
+        """).fetchall() == [("2024", 1, None), ("2024", 2, 2.0)]
+    finally:
+        os.remove(first_drop)
+        os.remove(second_drop)
+
+def test_unfinished_full_load_leaves_weekly_counts_stale(setup_database, setup_test_file):
+    conn = setup_database
+    ingest_file(setup_test_file)
+    assert not weekly_vote_counts_stale(conn.cursor())
+    pre_ingestion_db_activities()
+    assert weekly_vote_counts_stale(conn.cursor())
+
 
 if __name__ == "__main__":
     pytest.main()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import pytest
 import duckdb
 import os
+import json
 import logging
 import sys
 from equalexperts_dataeng_exercise import db
@@ -11,7 +12,34 @@ from equalexperts_dataeng_exercise.outliers import (
     main,
     SCHEMA_NAME,
     TABLE_NAME,
-    OUTLIER_QUERY
+    WEEKLY_COUNTS_TABLE_NAME,
+    OUTLIER_QUERY,
+    ENGINES,
+    METHODS,
+    DEFAULT_THRESHOLDS,
+    detect_outliers,
+    ROLLING_BASELINE_TABLE_NAME,
+    materialised_version,
+    MATERIALISED_TABLE_NAME,
+    outlier_query,
+    parse_arguments,
+    add_weekly_vote_counts,
+    weekly_counts_query,
+    rebuild_weekly_vote_counts,
+    weekly_vote_counts_stale,
+    clear_vote_counts_version,
+    COUNTS_VERSION_TABLE_NAME,
+    RUNS_TABLE_NAME,
+    DAILY_COUNTS_TABLE_NAME,
+    GRANULARITIES,
+    VIEW_NAMES,
+    period_column,
+    period_counts_query,
+    materialised_table_names,
+    GROUP_COLUMNS,
+    list_quantile,
+    outliers_view_name,
+    stage_grouped_scores
 )
 DATABASE = "warehouse_test.db"
 
@@ -40,6 +68,7 @@ def setup_database():
     yield conn
     conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA_NAME} CASCADE")
     conn.close()
+    db.close_pool(DATABASE)
     if os.path.exists(DATABASE):
         os.remove(DATABASE)
 
@@ -179,4 +208,403 @@ def test_sample_test_case(setup_database, caplog):
         main(DATABASE)
     # Verify the output
     result = cursor.execute(f"SELECT Year, WeekNumber, VoteCount FROM {SCHEMA_NAME}.{VIEW_NAME} ORDER BY Year, WeekNumber").fetchall()
-    assert result == expected_output, f"Expected {expected_output}, but got {result}"
\ No newline at end of file
+    assert result == expected_output, f"Expected {expected_output}, but got {result}"
+
+
+WEEKLY_COUNTS_FROM_VOTES = f"""
+    SELECT strftime(CreationDate, '%Y'), CAST(strftime('%W', CreationDate) AS INTEGER), count(CreationDate)
+    FROM {SCHEMA_NAME}.{TABLE_NAME} GROUP BY ALL ORDER BY ALL
+"""
+
+def weekly_counts(cursor):
+    return cursor.execute(f"SELECT * FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME} ORDER BY ALL").fetchall()
+
+def test_create_outliers_view_recounts_stale_weeks(setup_database, setup_test_data):
+    cursor = setup_database.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}")
+    assert weekly_vote_counts_stale(cursor)
+    create_outliers_view(cursor)
+    assert weekly_counts(cursor) == cursor.execute(WEEKLY_COUNTS_FROM_VOTES).fetchall()
+
+    # Votes changed outside the ingestion are only noticed when the counts are verified
+    cursor.execute(f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} VALUES ('99', '1', '2', '2022-03-07T00:00:00.000')")
+    assert not weekly_vote_counts_stale(cursor)
+    assert weekly_vote_counts_stale(cursor, verify_counts=True)
+    create_outliers_view(cursor, verify_counts=True)
+    assert not weekly_vote_counts_stale(cursor, verify_counts=True)
+    assert weekly_counts(cursor) == cursor.execute(WEEKLY_COUNTS_FROM_VOTES).fetchall()
+
+def test_weekly_vote_counts_stale_follows_ingestion_runs(setup_database, setup_test_data):
+    cursor = setup_database.cursor()
+    rebuild_weekly_vote_counts(cursor)
+    assert not weekly_vote_counts_stale(cursor)
+    # The check only reads the counts and the runs, not the votes
+    cursor.execute(f"ALTER TABLE {SCHEMA_NAME}.{TABLE_NAME} RENAME TO votes_elsewhere")
+    try:
+        assert not weekly_vote_counts_stale(cursor)
+        with pytest.raises(duckdb.CatalogException):
+            weekly_vote_counts_stale(cursor, verify_counts=True)
+    finally:
+        cursor.execute(f"ALTER TABLE {SCHEMA_NAME}.votes_elsewhere RENAME TO {TABLE_NAME}")
+    cursor.execute(f"CREATE TABLE {SCHEMA_NAME}.{RUNS_TABLE_NAME} AS SELECT 1 AS RunId")
+    try:
+        assert weekly_vote_counts_stale(cursor)
+        rebuild_weekly_vote_counts(cursor)
+        assert cursor.execute(f"SELECT RunId FROM {SCHEMA_NAME}.{COUNTS_VERSION_TABLE_NAME}").fetchall() == [(1,)]
+        assert not weekly_vote_counts_stale(cursor)
+        clear_vote_counts_version(cursor)
+        assert weekly_vote_counts_stale(cursor)
+    finally:
+        cursor.execute(f"DROP TABLE {SCHEMA_NAME}.{RUNS_TABLE_NAME}")
+
+def test_add_weekly_vote_counts(setup_database, setup_test_data):
+    cursor = setup_database.cursor()
+    rebuild_weekly_vote_counts(cursor)
+    before = dict(((year, week), count) for year, week, count in weekly_counts(cursor))
+    new_votes = """(SELECT TIMESTAMP '2022-01-09 12:00:00' AS CreationDate
+                    UNION ALL SELECT TIMESTAMP '2023-06-01 00:00:00')"""
+    add_weekly_vote_counts(cursor, new_votes)
+    after = dict(((year, week), count) for year, week, count in weekly_counts(cursor))
+    assert after[("2022", 1)] == before[("2022", 1)] + 1
+    assert after[("2023", 22)] == 1
+    add_weekly_vote_counts(cursor, new_votes, sign=-1)
+    assert dict(((year, week), count) for year, week, count in weekly_counts(cursor)) == before
+
+@pytest.mark.parametrize("dates", [
+    [],
+    ["2022-01-01T23:59:59", "2022-01-02T00:00:00", "2022-01-03T00:00:00", "2021-12-31T12:00:00"],
+    ["2024-12-29T00:00:00", "2024-12-30T00:00:00", "2024-12-31T00:00:00", "2025-01-01T00:00:00", "2025-01-05T00:00:00"],
+    ["2020-02-29T08:00:00", "2020-03-02T00:00:00", None, None, "2020-03-08T23:00:00"],
+])
+def test_weekly_counts_engines_agree(setup_database, dates):
+    cursor = setup_database.cursor()
+    rows = ", ".join([f"(TIMESTAMP '{date}')" if date else "(NULL::TIMESTAMP)" for date in dates] or ["(NULL::TIMESTAMP)"])
+    source = f"(SELECT * FROM (VALUES {rows}) AS votes(CreationDate))"
+    results = {engine: cursor.execute(f"SELECT * FROM ({weekly_counts_query(source, engine)}) ORDER BY ALL").fetchall()
+               for engine in ENGINES}
+    assert results["group_by"] == results["window"]
+
+def test_create_outliers_view_engines_agree(setup_database, setup_test_data):
+    cursor = setup_database.cursor()
+    views = {}
+    for engine in ENGINES:
+        cursor.execute(f"DROP TABLE IF EXISTS {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME}")
+        create_outliers_view(cursor, engine)
+        views[engine] = cursor.execute(f"SELECT * FROM {SCHEMA_NAME}.{VIEW_NAME}").fetchall()
+    assert views["group_by"] == views["window"]
+    assert len(views["group_by"]) > 0
+
+def test_weekly_counts_query_unknown_engine():
+    with pytest.raises(ValueError):
+        weekly_counts_query(TABLE_NAME, "sort")
+
+
+WEEKLY_VOTES = [10, 11, 9, 10, 12, 10, 9, 11, 10, 40, 10, 30]
+
+@pytest.fixture
+def weekly_votes():
+    """In-memory votes table with WEEKLY_VOTES[n] votes on the Monday of week n + 1 of 2024."""
+    conn = duckdb.connect()
+    conn.execute(f"CREATE SCHEMA {SCHEMA_NAME}")
+    conn.execute(f"CREATE TABLE {SCHEMA_NAME}.{TABLE_NAME} (Id STRING, PostId STRING, VoteTypeId STRING, CreationDate TIMESTAMP)")
+    for week, count in enumerate(WEEKLY_VOTES):
+        conn.execute(f"""
+            INSERT INTO {SCHEMA_NAME}.{TABLE_NAME}
+            SELECT i, '1', '2', TIMESTAMP '2024-01-01' + INTERVAL {7 * week} DAY FROM range(?) AS votes(i)
+        """, [count])
+    yield conn
+    conn.close()
+
+def outlier_weeks(relation, method):
+    return [week for week, flagged in relation.project(f"WeekNumber, {method}_outlier").fetchall() if flagged]
+
+def test_detect_outliers_scores_every_method(weekly_votes):
+    relation = detect_outliers(weekly_votes, rolling_weeks=3)
+    assert relation.columns == ["Year", "WeekNumber", "VoteCount"] + [
+        column for method in METHODS for column in (f"{method}_score", f"{method}_outlier")]
+    # The two spikes pull the mean to 14 and inflate the standard deviation, which
+    # the median-based methods are robust to
+    assert outlier_weeks(relation, "mean") == [1, 2, 3, 4, 6, 7, 8, 9, 10, 11, 12]
+    assert outlier_weeks(relation, "zscore") == []
+    assert outlier_weeks(relation, "iqr") == [10, 12]
+    assert outlier_weeks(relation, "mad") == [10, 12]
+    assert outlier_weeks(relation, "rolling") == [10, 11, 12]
+
+def test_detect_outliers_thresholds(weekly_votes):
+    relation = detect_outliers(weekly_votes, {"zscore": 2.0, "mean": 2.0}, methods=["mean", "zscore"])
+    assert relation.columns == ["Year", "WeekNumber", "VoteCount", "mean_score", "mean_outlier",
+                                "zscore_score", "zscore_outlier"]
+    assert outlier_weeks(relation, "zscore") == [10]
+    assert outlier_weeks(relation, "mean") == []
+
+@pytest.mark.parametrize("method", METHODS)
+def test_create_outliers_view_matches_detect_outliers(weekly_votes, method):
+    assert create_outliers_view(weekly_votes, method=method, rolling_weeks=3)
+    view = weekly_votes.execute(f"SELECT WeekNumber FROM {SCHEMA_NAME}.{VIEW_NAME}").fetchall()
+    assert [week for week, in view] == outlier_weeks(detect_outliers(weekly_votes, rolling_weeks=3), method)
+
+def test_outlier_query_invalid_settings():
+    with pytest.raises(ValueError):
+        outlier_query("median")
+    with pytest.raises(ValueError):
+        outlier_query("mean", threshold=-0.1)
+    with pytest.raises(ValueError):
+        outlier_query("rolling", rolling_weeks=0)
+
+def test_parse_arguments():
+    args = parse_arguments([])
+    assert (args.method, args.threshold, args.compare) == ("mean", None, False)
+    args = parse_arguments(["--method", "iqr", "--threshold", "3", "--rolling-weeks", "4", "--compare"])
+    assert (args.method, args.threshold, args.rolling_weeks, args.compare) == ("iqr", 3.0, 4, True)
+    with pytest.raises(SystemExit):
+        parse_arguments(["--threshold", "0"])
+    assert DEFAULT_THRESHOLDS["mean"] == 0.2
+
+def test_create_outliers_view_materialised(weekly_votes, monkeypatch):
+    from equalexperts_dataeng_exercise import outliers
+    materialisations = []
+    original = outliers.materialise_outliers
+    monkeypatch.setattr(outliers, "materialise_outliers",
+                        lambda *args: materialisations.append(1) or original(*args))
+    live_rows = outlier_weeks(detect_outliers(weekly_votes), "mean")
+
+    assert create_outliers_view(weekly_votes, materialised=True)
+    assert create_outliers_view(weekly_votes, materialised=True)
+    assert len(materialisations) == 1
+    view_type = weekly_votes.execute(f"""
+        SELECT table_type FROM information_schema.tables WHERE table_schema = '{SCHEMA_NAME}' AND table_name = '{VIEW_NAME}'
+    """).fetchone()[0]
+    assert view_type == "VIEW"
+    assert [week for week, in weekly_votes.execute(f"SELECT WeekNumber FROM {SCHEMA_NAME}.{VIEW_NAME}").fetchall()] == live_rows
+    assert materialised_version(weekly_votes)["RunId"] is None
+
+    weekly_votes.execute(f"CREATE TABLE {SCHEMA_NAME}.ingestion_runs AS SELECT 1 AS RunId")
+    assert create_outliers_view(weekly_votes, materialised=True)
+    assert len(materialisations) == 2
+    assert materialised_version(weekly_votes)["RunId"] == 1
+
+    assert create_outliers_view(weekly_votes, method="iqr", materialised=True)
+    assert len(materialisations) == 3
+    assert weekly_votes.execute(f"SELECT WeekNumber FROM {SCHEMA_NAME}.{MATERIALISED_TABLE_NAME}").fetchall() == [(10,), (12,)]
+
+    weekly_votes.execute(f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} VALUES ('99', '1', '2', '2024-01-01')")
+    assert create_outliers_view(weekly_votes, method="iqr", materialised=True)
+    assert len(materialisations) == 3
+    assert create_outliers_view(weekly_votes, method="iqr", materialised=True, verify_counts=True)
+    assert len(materialisations) == 4
+
+    assert create_outliers_view(weekly_votes)
+    assert materialised_version(weekly_votes) is None
+    assert create_outliers_view(weekly_votes, materialised=True)
+    assert len(materialisations) == 5
+
+def rolling_baseline(conn, rolling_weeks):
+    return conn.execute(f"""
+        SELECT Year, WeekNumber, VoteCount, RollingMeanVoteCount FROM {SCHEMA_NAME}.{ROLLING_BASELINE_TABLE_NAME}
+        WHERE RollingWeeks = ? ORDER BY Year, WeekNumber
+    """, [rolling_weeks]).fetchall()
+
+def full_rolling_baseline(conn, rolling_weeks):
+    return conn.execute(f"""
+        SELECT Year, WeekNumber, VoteCount,
+            round(avg(VoteCount) over (ORDER BY Year, WeekNumber ROWS BETWEEN {rolling_weeks} PRECEDING AND 1 PRECEDING))
+        FROM {SCHEMA_NAME}.{WEEKLY_COUNTS_TABLE_NAME} ORDER BY Year, WeekNumber
+    """).fetchall()
+
+def test_rolling_baseline_recomputes_only_the_tail(weekly_votes, monkeypatch):
+    from equalexperts_dataeng_exercise import outliers
+    detect_outliers(weekly_votes, rolling_weeks=3)
+    assert rolling_baseline(weekly_votes, 3) == full_rolling_baseline(weekly_votes, 3)
+    assert rolling_baseline(weekly_votes, 8) == full_rolling_baseline(weekly_votes, 8)
+
+    updates = []
+    original = outliers.update_rolling_baseline
+    monkeypatch.setattr(outliers, "update_rolling_baseline",
+                        lambda cursor, weeks, first_week=None: updates.append((weeks, first_week)) or
+                        original(cursor, weeks, first_week))
+    appended = "(SELECT TIMESTAMP '2024-03-25' AS CreationDate UNION ALL SELECT TIMESTAMP '2024-04-01')"
+    add_weekly_vote_counts(weekly_votes, appended)
+    assert sorted(updates) == [(3, ("2024", 13)), (8, ("2024", 13))]
+    assert rolling_baseline(weekly_votes, 3) == full_rolling_baseline(weekly_votes, 3)
+
+    updates.clear()
+    changed = "(SELECT TIMESTAMP '2024-02-05' AS CreationDate FROM range(25))"
+    add_weekly_vote_counts(weekly_votes, changed, sign=-1)
+    assert sorted(updates) == [(3, ("2024", 6)), (8, ("2024", 6))]
+    assert rolling_baseline(weekly_votes, 3) == full_rolling_baseline(weekly_votes, 3)
+    assert rolling_baseline(weekly_votes, 8) == full_rolling_baseline(weekly_votes, 8)
+
+
+NEW_YEAR_VOTES = ["2020-12-30 10:00:00", "2021-01-01 00:00:00", "2021-01-01 23:59:59", "2021-01-03 12:00:00",
+                  "2021-01-04 00:00:00", "2021-02-01 08:00:00", None]
+
+@pytest.fixture
+def new_year_votes():
+    """In-memory votes table with NEW_YEAR_VOTES, around the new year of 2021 which starts on a Friday."""
+    conn = duckdb.connect()
+    conn.execute(f"CREATE SCHEMA {SCHEMA_NAME}")
+    conn.execute(f"CREATE TABLE {SCHEMA_NAME}.{TABLE_NAME} (Id STRING, PostId STRING, VoteTypeId STRING, CreationDate TIMESTAMP)")
+    conn.executemany(f"INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} VALUES (?, '1', '2', ?)",
+                     [[str(i), date] for i, date in enumerate(NEW_YEAR_VOTES)])
+    rebuild_weekly_vote_counts(conn)
+    yield conn
+    conn.close()
+
+def period_counts(conn, granularity):
+    return conn.execute(f"SELECT * FROM ({period_counts_query(granularity)}) ORDER BY ALL").fetchall()
+
+def test_period_counts_across_new_year(new_year_votes):
+    assert new_year_votes.execute(
+        f"SELECT strftime(Day, '%m-%d'), VoteCount FROM {SCHEMA_NAME}.{DAILY_COUNTS_TABLE_NAME} ORDER BY Day"
+    ).fetchall() == [("12-30", 1), ("01-01", 2), ("01-03", 1), ("01-04", 1), ("02-01", 1)]
+    # The %W weeks split at the new year, the ISO week of 2021-01-01 belongs to 2020
+    assert period_counts(new_year_votes, "week") == [("2020", 52, 1), ("2021", 0, 3), ("2021", 1, 1), ("2021", 5, 1)]
+    assert period_counts(new_year_votes, "week") == weekly_counts(new_year_votes)
+    assert period_counts(new_year_votes, "isoweek") == [("2020", 53, 4), ("2021", 1, 1), ("2021", 5, 1)]
+    assert period_counts(new_year_votes, "month") == [("2020", 12, 1), ("2021", 1, 4), ("2021", 2, 1)]
+    assert [(year, count) for year, _, count in period_counts(new_year_votes, "day")] == [
+        ("2020", 1), ("2021", 2), ("2021", 1), ("2021", 1), ("2021", 1)]
+
+def test_add_weekly_vote_counts_updates_daily_counts(new_year_votes):
+    before = period_counts(new_year_votes, "day")
+    new_votes = "(SELECT TIMESTAMP '2021-01-01 06:00:00' AS CreationDate UNION ALL SELECT TIMESTAMP '2021-03-01')"
+    add_weekly_vote_counts(new_year_votes, new_votes)
+    assert period_counts(new_year_votes, "isoweek") == [("2020", 53, 5), ("2021", 1, 1), ("2021", 5, 1), ("2021", 9, 1)]
+    add_weekly_vote_counts(new_year_votes, new_votes, sign=-1)
+    assert period_counts(new_year_votes, "day") == before
+    new_year_votes.execute(f"DELETE FROM {SCHEMA_NAME}.{DAILY_COUNTS_TABLE_NAME}")
+    assert weekly_vote_counts_stale(new_year_votes)
+
+@pytest.mark.parametrize("granularity", GRANULARITIES)
+def test_create_outliers_view_granularity(weekly_votes, granularity):
+    assert create_outliers_view(weekly_votes, method="mad", granularity=granularity)
+    column = period_column(granularity)
+    view = weekly_votes.execute(f"SELECT Year, {column} FROM {SCHEMA_NAME}.{VIEW_NAMES[granularity]}").fetchall()
+    relation = detect_outliers(weekly_votes, methods=["mad"], granularity=granularity)
+    assert view == relation.filter("mad_outlier").project(f"Year, {column}").fetchall()
+    assert relation.columns[:3] == ["Year", column, "VoteCount"]
+
+def test_create_outliers_view_months(weekly_votes):
+    # The weeks of 2024 start on Mondays from January 1st, so the spikes of weeks 10 and 12 fall in March
+    relation = detect_outliers(weekly_votes, {"rolling": 0.5}, rolling_weeks=1, methods=["rolling"], granularity="month")
+    assert relation.project("MonthNumber, VoteCount").fetchall() == [(1, 52), (2, 40), (3, 80)]
+    assert [month for month, flagged in relation.project("MonthNumber, rolling_outlier").fetchall() if flagged] == [3]
+    assert create_outliers_view(weekly_votes, method="rolling", threshold=0.5, rolling_weeks=1, materialised=True,
+                                granularity="month")
+    materialised_table, _ = materialised_table_names("month")
+    assert weekly_votes.execute(f"SELECT MonthNumber FROM {SCHEMA_NAME}.{materialised_table}").fetchall() == [(3,)]
+    assert materialised_version(weekly_votes, "month")["RollingWeeks"] == 1
+    assert materialised_version(weekly_votes) is None
+
+def test_granularity_arguments():
+    assert parse_arguments([]).granularity == "week"
+    assert parse_arguments(["--granularity", "isoweek"]).granularity == "isoweek"
+    with pytest.raises(SystemExit):
+        parse_arguments(["--granularity", "year"])
+    with pytest.raises(ValueError):
+        outlier_query(granularity="year")
+
+
+def test_list_quantile_matches_quantile_cont():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE counts AS SELECT i % 97 AS g, CAST(random() * 100 AS BIGINT) AS v FROM range(5000) AS t(i)")
+    mismatches = conn.execute(f"""
+        SELECT count(*) FROM (
+            SELECT quantile_cont(v, 0.25) AS q1, median(v) AS q2, quantile_cont(v, 0.75) AS q3,
+                list_sort(list(v)) AS l
+            FROM counts GROUP BY g
+        )
+        WHERE q1 <> {list_quantile("l", 0.25)} OR q2 <> {list_quantile("l", 0.5)} OR q3 <> {list_quantile("l", 0.75)}
+    """).fetchone()[0]
+    conn.close()
+    assert mismatches == 0
+
+SPIKY_VOTES = [5, 6, 4, 50, 5, 6, 4, 5, 6, 5, 4, 5]
+
+def add_spiky_vote_type(conn):
+    """Add SPIKY_VOTES[n] votes of type 3 on the Monday of week n + 1 of 2024, next to the WEEKLY_VOTES of type 2."""
+    for week, count in enumerate(SPIKY_VOTES):
+        conn.execute(f"""
+            INSERT INTO {SCHEMA_NAME}.{TABLE_NAME}
+            SELECT 'spiky', '1', '3', TIMESTAMP '2024-01-01' + INTERVAL {7 * week} DAY FROM range(?) AS votes(i)
+        """, [count])
+
+def test_detect_outliers_per_group(weekly_votes):
+    columns = ", ".join([f"{method}_score" for method in METHODS])
+    overall = detect_outliers(weekly_votes, rolling_weeks=3).project(f"Year, WeekNumber, VoteCount, {columns}").fetchall()
+    add_spiky_vote_type(weekly_votes)
+    relation = detect_outliers(weekly_votes, rolling_weeks=3, group_by=["VoteTypeId"])
+    assert relation.columns[:4] == ["VoteTypeId", "Year", "WeekNumber", "VoteCount"]
+    # Each group is scored against its own baseline, as if its votes were the only ones
+    assert relation.filter("VoteTypeId = '2'").project(
+        f"Year, WeekNumber, VoteCount, {columns}").fetchall() == overall
+    spiky = relation.filter("VoteTypeId = '3'")
+    assert [week for week, flagged in spiky.project("WeekNumber, mad_outlier").fetchall() if flagged] == [4]
+    # Week 3 has 4 votes against a baseline of 6, the spike inflates the baselines of the three weeks after it
+    assert [week for week, flagged in spiky.project("WeekNumber, rolling_outlier").fetchall() if flagged] == [3, 4, 5, 6, 7]
+
+def test_stage_grouped_scores_buckets(weekly_votes):
+    add_spiky_vote_type(weekly_votes)
+    weekly_votes.execute(f"UPDATE {SCHEMA_NAME}.{TABLE_NAME} SET PostId = Id")
+    tables = {}
+    for bucket_rows in (1000, 3):
+        table = f"scores_{bucket_rows}"
+        stage_grouped_scores(weekly_votes, table, GROUP_COLUMNS, granularity="month", temporary=True,
+                             bucket_rows=bucket_rows)
+        tables[bucket_rows] = weekly_votes.execute(f"SELECT * FROM {table} ORDER BY ALL").fetchall()
+    assert tables[3] == tables[1000]
+    assert len(tables[3]) == weekly_votes.execute(f"""
+        SELECT count(DISTINCT (PostId, VoteTypeId, month(CreationDate))) FROM {SCHEMA_NAME}.{TABLE_NAME}
+    """).fetchone()[0]
+    with pytest.raises(ValueError):
+        stage_grouped_scores(weekly_votes, "scores", [])
+    with pytest.raises(ValueError):
+        stage_grouped_scores(weekly_votes, "scores", ["UserId"])
+
+def test_create_outliers_view_per_group(weekly_votes, monkeypatch):
+    from equalexperts_dataeng_exercise import outliers
+    add_spiky_vote_type(weekly_votes)
+    stages = []
+    original = outliers.stage_grouped_scores
+    monkeypatch.setattr(outliers, "stage_grouped_scores", lambda *args, **kwargs: stages.append(1) or original(*args, **kwargs))
+    view_name = outliers_view_name(group_by=["VoteTypeId"])
+    assert view_name == "outlier_weeks_by_votetypeid"
+    assert create_outliers_view(weekly_votes, method="mad", group_by=["VoteTypeId"])
+    assert weekly_votes.execute(f"""
+        SELECT table_type FROM information_schema.tables WHERE table_schema = '{SCHEMA_NAME}' AND table_name = '{view_name}'
+    """).fetchone()[0] == "VIEW"
+    assert weekly_votes.execute(f"SELECT * FROM {SCHEMA_NAME}.{view_name}").fetchall() == [
+        ("2", "2024", 10, 40), ("2", "2024", 12, 30), ("3", "2024", 4, 50)]
+    assert create_outliers_view(weekly_votes, method="mad", group_by=["VoteTypeId"])
+    assert len(stages) == 1
+    assert materialised_version(weekly_votes, group_by=["VoteTypeId"])["Method"] == "mad"
+
+def test_main_query_log(setup_database, setup_test_data, tmp_path):
+    query_log = tmp_path / "query_log.jsonl"
+    main(DATABASE, query_log=str(query_log), explain_analyze=True)
+    records = [json.loads(line) for line in query_log.read_text().splitlines()]
+    assert any(VIEW_NAME in record["statement"] and record["statement"].startswith("CREATE OR REPLACE VIEW")
+               for record in records)
+    assert any("profile" in record for record in records)
+    assert not db.INSTRUMENTATION["enabled"]
+    args = parse_arguments(["--query-log", "queries.jsonl", "--explain-analyze"])
+    assert (args.query_log, args.explain_analyze) == ("queries.jsonl", True)
+    assert parse_arguments(["--verify-counts"]).verify_counts and not parse_arguments([]).verify_counts
+
+def test_main_query_log_records_the_outliers_select(setup_database, setup_test_data, tmp_path):
+    query_log = tmp_path / "query_log.jsonl"
+    db.QUERY_LOG.clear()
+    main(DATABASE, compare=True, query_log=str(query_log))
+    records = [json.loads(line) for line in query_log.read_text().splitlines()]
+    assert records == list(db.QUERY_LOG)
+    view_selects = [record for record in records
+                    if record["statement"].startswith(f"SELECT * FROM {SCHEMA_NAME}.{VIEW_NAME} ")]
+    assert len(view_selects) == 1 and view_selects[0]["seconds"] > 0
+    assert any(record["statement"].startswith("SELECT Year, WeekNumber, VoteCount, mean_score") for record in records)
+
+def test_group_by_arguments():
+    assert parse_arguments([]).group_by == []
+    args = parse_arguments(["--group-by", "PostId", "VoteTypeId", "--memory-limit", "1GB", "--temp-directory", "spill"])
+    assert (args.group_by, args.memory_limit, args.temp_directory) == (["PostId", "VoteTypeId"], "1GB", "spill")
+    with pytest.raises(SystemExit):
+        parse_arguments(["--group-by", "UserId"])